@@ -86,12 +86,13 @@ def filter_csv(csv, query):
     return path_dict
         
              
-def filter_images(input_path, query):
+def filter_images(input_path, query, manifest_path=None):
     """ Filters the input images by the given query.
 
     Args:
         input_path (str): Path to a folder or tabled prediction info CSV.
         query (dict): The given query from the config.
+        manifest_path (str): A dataset manifest of the folder's images. (Optional)
 
     Returns:
         dict or list: A collection of image file paths.
@@ -99,8 +100,7 @@ def filter_images(input_path, query):
     # If directory, read in and filter the image paths.
     if os.path.isdir(input_path):
         print(colored("Note: An input directory of images was given. Only subjects and true labels can be filtered.", 'yellow'))
-        image_paths = get_files(input_path, False, 1)
-        image_paths = get_files(input_path, False, 1)
+        image_paths = get_files(input_path, False, 1, manifest_path)
         return filter_file_list(image_paths, query)
     
     # Read in the tabled prediction info CSV, filter it, and return the image paths
@@ -181,7 +181,7 @@ def main(config=None):
         config = get_config.parse_json('./results_processing/grad_cam/grad_cam_many_config.json')
 
     # Read in and filter the image paths to include only the relevant items
-    img_addrs = filter_images(config["input_directory_or_tabled_info"], config["query"])
+    img_addrs = filter_images(config["input_directory_or_tabled_info"], config["query"], config.get("manifest_path"))
     
     # Run the program for each image address
     run_program(img_addrs, config)
@@ -1,5 +1,6 @@
 from results_processing.tabled_prediction_info import tabled_prediction_info
 from training.training_modules.image_processing.image_parser import *
+from training.training_modules.image_processing.manifest import DatasetManifest
 from util.get_config import parse_json
 from termcolor import colored
 from tensorflow import keras
@@ -12,13 +13,14 @@ os.environ['TF_CPP_MIN_LOG_LEVEL'] = '3'
 import tensorflow as tf
 
 
-def get_images(data_input, class_names):
+def get_images(data_input, class_names, manifest_directory=None):
     """
         Reads in a dictionary of arrays of data-paths.
 
     Args:
         data_input (dict): A dictionary of key-array form.
         class_names (list of str): A list of classes/labels.
+        manifest_directory (str): Where to keep a dataset manifest for each subject. (Optional)
         
     Reeturns:
         (dict) A dictionary of key-array form, of all the images.
@@ -29,6 +31,13 @@ def get_images(data_input, class_names):
         # Check if valid location
         if not os.path.isdir(data_input[subject]):
             raise Exception(colored(f"Error: Expected '{data_input[subject]}' to be a directory path.", 'red'))
+        
+        # Read the image paths from the subject's manifest, if given
+        if manifest_directory:
+            manifest = DatasetManifest(os.path.join(manifest_directory, f"{subject}_manifest.npz"), data_input[subject]).load()
+            image_paths[subject] = [os.path.abspath(path) for path in manifest.get_paths() if path.endswith((".png", ".jpg", ".jpeg"))]
+            continue
+        
         subdirs = os.listdir(data_input[subject])
         if len(subdirs) == 0:
             print(colored(f"Warning: The data path '{data_input[subject]}' is empty.", 'yellow'))
@@ -279,7 +288,7 @@ def main(config=None):
 
     # Read in the input data
     class_names = config['image_settings']['class_names']
-    data = get_images(config["test_subject_data_input"], class_names)
+    data = get_images(config["test_subject_data_input"], class_names, config.get("manifest_directory"))
     print(colored('Input images sucessfully read.', 'green'))
     
     # Read in the models
@@ -6,38 +6,30 @@ from pathlib import Path
 import numpy as np
 import pandas as pd
 from util.get_config import parse_json
+from training.random_search.search_space import SearchSpace, get_array_lr, get_array_batch
 
 # https://www.geeksforgeeks.org/reading-and-writing-json-to-a-file-in-python/#
 
-def get_array_lr(config):
-    
-    lr_min = config["hyperparameters"]['learning_rate_min']
-    lr_max = config["hyperparameters"]['learning_rate_max']
-    
-    log_lr_min = np.log10(lr_min)
-    log_lr_max = np.log10(lr_max)
-    
-    a_log_lr = np.arange(log_lr_min, log_lr_max+1, 1)
-    a_lr = 10**a_log_lr
-    
-    return a_lr
-
+# Optional training settings, copied to every trial's configuration if given
+OPTIONAL_KEYS = [
+    "shard_cache_directory",
+    "dataset_cache",
+    "manifest_path",
+    "async_checkpoint",
+    "resume_checkpoint",
+    "telemetry",
+    "reuse_models",
+    "fused_replicas",
+    "feature_bank",
+    "asha"
+]
+
+# The hyperparameters, output path, and job name of a trial
+RandomVariables = namedtuple("random_variables",
+                             ["batch_size", "learning_rate", "decay",
+                              "momentum", "bool_nesterov", "model",
+                              "output_path", "job_name"])
 
-def get_array_batch(config):
-    
-    batch_size_min = config["hyperparameters"]["batch_size_min"]
-    batch_size_max = config["hyperparameters"]["batch_size_max"]
-    
-    log2_batch_size_min  = np.log2(batch_size_min)
-    log2_batch_size_max = np.log2(batch_size_max)
-    
-    a_log2_batch_size = np.arange(log2_batch_size_min,
-                                  log2_batch_size_max+1, 1)
-    
-    a_batch_size = 2**a_log2_batch_size
-    
-    return a_batch_size
-    
 
 def create_dict_json(temp_variable, config):
 
@@ -79,6 +71,10 @@ def create_dict_json(temp_variable, config):
     dict_json["image_size"] = config["image_size"]
     dict_json["target_height"] = config["target_height"]
     dict_json["target_width"] = config["target_width"]
+    
+    for key in OPTIONAL_KEYS:
+        if key in config:
+            dict_json[key] = config[key]
 
     return dict_json
 
@@ -96,78 +92,50 @@ def create_json_file(index, dict_json, config):
         json.dump(dict_json, output, indent=4)
 
 
+def write_trial_config(index, values, config):
+    """ Writes the configuration of a proposed trial, in the same form as the random trials.
+
+    Args:
+        index (int): The trial index.
+        values (dict): The batch_size, learning_rate, momentum, bool_nesterov, and model of the trial.
+        config (dict): The random search configuration.
+
+    Returns:
+        (dict): The trial's configuration.
+    """
+    temp_variable = RandomVariables(
+        values["batch_size"], values["learning_rate"], values["learning_rate"],
+        values["momentum"], values["bool_nesterov"], values["model"],
+        Path(config["output_path"]) / f"random-search_{index}", f"random-search_{index}"
+    )
+    dict_json = create_dict_json(temp_variable, config)
+    create_json_file(index, dict_json, config)
+    return dict_json
+
+
 def get_combinations(config):
-    
-    np.random.seed(config["seed"])
-    
-    a_batch_size = get_array_batch(config)
-    a_learning_rate = get_array_lr(config)
-    
-    a_momentum = np.array(config["hyperparameters"]["l_momentum"])
-    a_nesterov = np.array(config["hyperparameters"]["l_nesterov"])
-    a_models = np.array(config["hyperparameters"]["l_models"])
-
-
-    variables = namedtuple("random_variables",
-                           ["batch_size", "learning_rate", "decay",
-                            "momentum", "bool_nesterov", "model",
-                            "output_path", "job_name"])
-
-
-    df_summary = pd.DataFrame(columns = ["index", "model","batch_size",
-                                         "learning_rate", "decay",
-                                         "momentum", "bool_nesterov"])
-
-    for index in range(config["n_trials"]):
-        
-        # While loop until avoiding repetition
-
-        while True:
-        # random
-            bool_repeated = False
-
-            batch_size = np.random.choice(a_batch_size)
-            learning_rate = np.random.choice(a_learning_rate)
-            decay = learning_rate
-            
-            momentum = np.random.choice(a_momentum)
-            bool_nesterov = bool(np.random.choice(a_nesterov))
-            model = np.random.choice(a_models)
-            
-            path_output_directory = Path(config["output_path"])
-            path_output_subdirectory = path_output_directory / f"random-search_{index}"
-        
-            output_path = path_output_subdirectory
-            job_name = f"random-search_{index}"
-            
-            df_temp = pd.DataFrame({"index":[index],
-                                    "model": [model],
-                                    "batch_size": [int(batch_size)],
-                                    "learning_rate": [learning_rate],
-                                    "decay": [decay],
-                                    "momentum": [momentum],
-                                    "bool_nesterov": [bool_nesterov] })
-            
-            # iterate through rows in pandas dataframe
-            for i in range(df_summary.shape[0]):
-                return_compare = df_temp.iloc[:, 1:].compare(df_summary.iloc[[i], 1:].reset_index(drop=True))
-                if return_compare.shape[0] == 0:
-                    bool_repeated = True
-            
-            if bool_repeated == False:
-                break
-            
-        df_summary = pd.concat([df_summary, df_temp], ignore_index=True)
-        
-        temp_variable = variables(batch_size, learning_rate, decay,
-                                momentum, bool_nesterov, model,
-                                output_path, job_name)        
-
-        # fixed
-        dict_json_temp = create_dict_json(temp_variable, config)
-        create_json_file(index, dict_json_temp, config)
-
-    filename_summary = "random_search_summary.csv"
+    """ Writes the configuration of every random search trial within this shard, and a summary of their hyperparameters.
+        The trials are distinct combinations of the search space, drawn from the seed.
+
+    Args:
+        config (dict): The random search configuration. It may give a 'shard_index' and 'n_shards'.
+    """
+    search_space = SearchSpace(config)
+    shard_index = config.get("shard_index", 0)
+    n_shards = config.get("n_shards", 1)
+    trials = search_space.sample_trials(config["n_trials"], config["seed"], shard_index, n_shards)
+
+    rows = []
+    for index, point in trials:
+        values = search_space.decode(point)
+        write_trial_config(index, values, config)
+        rows.append({"index": index, **values, "decay": values["learning_rate"]})
+
+    df_summary = pd.DataFrame(rows, columns=["index", "model", "batch_size",
+                                             "learning_rate", "decay",
+                                             "momentum", "bool_nesterov"])
+
+    filename_summary = "random_search_summary.csv" if n_shards == 1 else f"random_search_summary_shard_{shard_index}.csv"
     path_output_directory_config = Path(config["configurations_directory"])
     path_output_file_summary = path_output_directory_config / filename_summary  
     
@@ -0,0 +1,165 @@
+from termcolor import colored
+import numpy as np
+
+
+# Dimensions whose values are ordered, so nearby grid values are alike
+ORDERED_DIMENSIONS = ('batch_size', 'learning_rate', 'momentum')
+
+
+def get_array_lr(config):
+
+    lr_min = config["hyperparameters"]['learning_rate_min']
+    lr_max = config["hyperparameters"]['learning_rate_max']
+
+    log_lr_min = np.log10(lr_min)
+    log_lr_max = np.log10(lr_max)
+
+    a_log_lr = np.arange(log_lr_min, log_lr_max+1, 1)
+    a_lr = 10**a_log_lr
+
+    return a_lr
+
+
+def get_array_batch(config):
+
+    batch_size_min = config["hyperparameters"]["batch_size_min"]
+    batch_size_max = config["hyperparameters"]["batch_size_max"]
+
+    log2_batch_size_min  = np.log2(batch_size_min)
+    log2_batch_size_max = np.log2(batch_size_max)
+
+    a_log2_batch_size = np.arange(log2_batch_size_min,
+                                  log2_batch_size_max+1, 1)
+
+    a_batch_size = 2**a_log2_batch_size
+
+    return a_batch_size
+
+
+class SearchSpace:
+    def __init__(self, config):
+        """ The hyperparameter grids of a random search: batch sizes, learning rates, momentums, Nesterov, and models.
+            A point of the space is a tuple with the grid index of each dimension.
+
+        Args:
+            config (dict): The random search configuration.
+        """
+        self.dimensions = {
+            'batch_size': get_array_batch(config),
+            'learning_rate': get_array_lr(config),
+            'momentum': np.array(config["hyperparameters"]["l_momentum"]),
+            'bool_nesterov': np.array(config["hyperparameters"]["l_nesterov"]),
+            'model': np.array(config["hyperparameters"]["l_models"])
+        }
+        self.names = list(self.dimensions)
+        self.sizes = [len(values) for values in self.dimensions.values()]
+
+
+    def size(self):
+        """ Gets the number of points in the space.
+
+        Returns:
+            (int): The product of the grid sizes.
+        """
+        return int(np.prod(self.sizes))
+
+
+    def get_point(self, index):
+        """ Gets the point at an index of the grid, in mixed radix. The last dimension changes the fastest.
+
+        Args:
+            index (int): An index from 0 up to the size of the space.
+
+        Returns:
+            (tuple of int): The point.
+        """
+        point = []
+        for size in reversed(self.sizes):
+            index, i = divmod(int(index), size)
+            point.append(i)
+        return tuple(reversed(point))
+
+
+    def get_index(self, point):
+        """ Gets the grid index of a point, the inverse of get_point.
+
+        Args:
+            point (tuple of int): The point.
+
+        Returns:
+            (int): The index.
+        """
+        index = 0
+        for size, i in zip(self.sizes, point):
+            index = index * size + int(i)
+        return index
+
+
+    def sample_trials(self, n_trials, seed, shard_index=0, n_shards=1):
+        """ Samples distinct points for the trials of a random search, without replacement.
+            Every shard draws the same sequence from the seed, and keeps the trials whose index falls to it,
+            so shards on different nodes never repeat a point.
+
+        Args:
+            n_trials (int): The total number of trials. At most the size of the space.
+            seed (int): The random seed.
+            shard_index (int): The index of this shard. Default is 0. (Optional)
+            n_shards (int): The number of shards. Default is 1. (Optional)
+
+        Returns:
+            (list of tuples): The trial index and point of each trial within the shard.
+        """
+        if not 0 <= shard_index < n_shards:
+            raise ValueError(colored(f"Error: The shard index {shard_index} must be from 0 to {n_shards - 1}.", 'red'))
+        size = self.size()
+        if n_trials > size:
+            print(colored(f"Warning: {n_trials} trials were asked for, but the search space only has {size} combinations. Each is used once.", 'yellow'))
+            n_trials = size
+        indexes = np.random.default_rng(seed).choice(size, size=n_trials, replace=False)
+        return [(i, self.get_point(indexes[i])) for i in range(shard_index, n_trials, n_shards)]
+
+
+    def sample(self, rng):
+        """ Samples a point uniformly.
+
+        Args:
+            rng (np.random.Generator): The random generator.
+
+        Returns:
+            (tuple of int): The point.
+        """
+        return tuple(int(rng.integers(size)) for size in self.sizes)
+
+
+    def decode(self, point):
+        """ Gets the hyperparameter values of a point.
+
+        Args:
+            point (tuple of int): The point.
+
+        Returns:
+            (dict): The value of each dimension.
+        """
+        values = {name: self.dimensions[name][i] for name, i in zip(self.names, point)}
+        values['batch_size'] = int(values['batch_size'])
+        values['bool_nesterov'] = bool(values['bool_nesterov'])
+        return values
+
+
+    def encode(self, values):
+        """ Gets the point of some hyperparameter values. Each value is matched to the nearest in its grid.
+
+        Args:
+            values (dict): The value of each dimension.
+
+        Returns:
+            (tuple of int): The point.
+        """
+        point = []
+        for name in self.names:
+            grid = self.dimensions[name]
+            if name in ORDERED_DIMENSIONS:
+                point.append(int(np.argmin(np.abs(grid.astype(float) - float(values[name])))))
+            else:
+                point.append(int(np.flatnonzero(grid == values[name])[0]))
+        return tuple(point)
@@ -0,0 +1,149 @@
+from training.random_search.search_space import ORDERED_DIMENSIONS
+import numpy as np
+import math
+
+
+class TPEProposer:
+    def __init__(self, search_space, seed=None, n_startup=5, gamma=0.25, n_candidates=64, prior_weight=1.0):
+        """ Proposes hyperparameters with a tree-structured Parzen estimator (TPE), through an ask/tell interface.
+            The finished trials are split into the best gamma fraction and the rest. Each dimension gets a smoothed
+            distribution over its grid for both groups, and candidates are chosen by their likelihood ratio.
+            Trials that were asked for, but not told, count as the worst finished trial (a constant liar),
+            so several proposals made at once are spread apart.
+
+        Args:
+            search_space (SearchSpace): The hyperparameter grids.
+            seed (int): The random seed. Default is None. (Optional)
+            n_startup (int): The number of finished trials before proposals are no longer random. Default is 5. (Optional)
+            gamma (float): The fraction of finished trials that are considered good. Default is 0.25. (Optional)
+            n_candidates (int): The number of candidates sampled for each proposal. Default is 64. (Optional)
+            prior_weight (float): The weight of the uniform prior within each distribution. Default is 1.0. (Optional)
+        """
+        self.search_space = search_space
+        self.rng = np.random.default_rng(seed)
+        self.n_startup = n_startup
+        self.gamma = gamma
+        self.n_candidates = n_candidates
+        self.prior_weight = prior_weight
+
+        # The told points with their losses, and the asked points without one
+        self.observations = []
+        self.pending = []
+
+        # The kernel of each dimension, which spreads a grid value's weight to its neighbours
+        self.kernels = []
+        for name, size in zip(search_space.names, search_space.sizes):
+            if name in ORDERED_DIMENSIONS:
+                distance = np.subtract.outer(np.arange(size), np.arange(size))
+                kernel = np.exp(-0.5 * distance.astype(float)**2)
+                self.kernels.append(kernel / kernel.sum(axis=1, keepdims=True))
+            else:
+                self.kernels.append(np.eye(size))
+
+
+    def ask(self, n=1):
+        """ Proposes hyperparameters to try.
+
+        Args:
+            n (int): The number of proposals. Default is 1. (Optional)
+
+        Returns:
+            (list of dict): The hyperparameter values of each proposal.
+        """
+        proposals = []
+        for _ in range(n):
+            point = self._propose()
+            self.pending.append(point)
+            proposals.append(self.search_space.decode(point))
+        return proposals
+
+
+    def tell(self, values, loss):
+        """ Gives the result of a trial.
+
+        Args:
+            values (dict): The trial's hyperparameter values.
+            loss (float): The trial's loss. None if it failed, in which case it counts as the worst.
+        """
+        point = self.search_space.encode(values)
+        if point in self.pending:
+            self.pending.remove(point)
+        self.observations.append((point, math.inf if loss is None else float(loss)))
+
+
+    def add_pending(self, values):
+        """ Marks a trial that was proposed elsewhere, such as by an earlier run, as running.
+
+        Args:
+            values (dict): The trial's hyperparameter values.
+        """
+        self.pending.append(self.search_space.encode(values))
+
+
+    def _propose(self):
+        """ Chooses a point that was not tried yet, if any remain.
+
+        Returns:
+            (tuple of int): The point.
+        """
+        seen = {point for point, _ in self.observations} | set(self.pending)
+        exhausted = len(seen) >= self.search_space.size()
+        if len(self.observations) < self.n_startup:
+            return self._sample_unseen(seen, exhausted)
+
+        # Count the running trials as the worst finished one
+        losses = [loss for _, loss in self.observations]
+        finite = [loss for loss in losses if loss != math.inf]
+        liar = max(finite) if finite else 0.0
+        points = [point for point, _ in self.observations] + self.pending
+        losses = [liar if loss == math.inf else loss for loss in losses] + [liar] * len(self.pending)
+
+        # Split the trials into the good and bad groups
+        order = np.argsort(losses, kind='stable')
+        n_good = max(1, math.ceil(self.gamma * len(order)))
+        good = np.array([points[i] for i in order[:n_good]])
+        bad = np.array([points[i] for i in order[n_good:]]).reshape(-1, len(self.kernels))
+
+        # Sample the candidates from the good distribution, and keep the best unseen one by l(x) / g(x)
+        good_pdfs = [self._get_pdf(good[:, d], d) for d in range(len(self.kernels))]
+        bad_pdfs = [self._get_pdf(bad[:, d], d) for d in range(len(self.kernels))]
+        candidates = np.stack([self.rng.choice(len(pdf), size=self.n_candidates, p=pdf) for pdf in good_pdfs], axis=1)
+        scores = sum(np.log(good_pdfs[d][candidates[:, d]]) - np.log(bad_pdfs[d][candidates[:, d]]) for d in range(len(self.kernels)))
+        for i in np.argsort(-scores, kind='stable'):
+            point = tuple(int(v) for v in candidates[i])
+            if exhausted or point not in seen:
+                return point
+        return self._sample_unseen(seen, exhausted)
+
+
+    def _get_pdf(self, indexes, dimension):
+        """ Gets the smoothed distribution of a dimension over its grid.
+
+        Args:
+            indexes (np.ndarray): The grid indexes of the group's trials.
+            dimension (int): The dimension.
+
+        Returns:
+            (np.ndarray): The probability of each grid value.
+        """
+        kernel = self.kernels[dimension]
+        pdf = np.full(len(kernel), self.prior_weight / len(kernel))
+        if len(indexes):
+            pdf += kernel[indexes].sum(axis=0)
+        return pdf / pdf.sum()
+
+
+    def _sample_unseen(self, seen, exhausted):
+        """ Samples a random point, that was not tried unless all were.
+
+        Args:
+            seen (set of tuples): The tried points.
+            exhausted (bool): If every point was tried.
+
+        Returns:
+            (tuple of int): The point.
+        """
+        while True:
+            point = self.search_space.sample(self.rng)
+            if exhausted or point not in seen:
+                return point
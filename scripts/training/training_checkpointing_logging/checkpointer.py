@@ -1,8 +1,14 @@
 from tensorflow.keras.callbacks import ModelCheckpoint
+from training.training_modules.model_processing.fused_model import FusedModel
 from termcolor import colored
+from time import perf_counter
 from keras import models
+import numpy as np
+import threading
 import fasteners
+import queue
 import keras
+import math
 import os
 
 
@@ -55,16 +61,194 @@ class Checkpointer(keras.callbacks.Callback):
         else:
             self.prev_save = None
             
+            
+class AsyncCheckpointer(Checkpointer):
+    def __init__(self, n_epochs, k_epochs, file_name, rank, save_path="./", queue_size=2, max_overhead=0.05):
+        """ This will checkpoint the weights and optimizer state from a background thread.
+            The state is copied into host memory at the end of an epoch, and written as <NAME>_<EPOCH>.npz.
+            The interval is at least every k epochs, and grows when saving costs too much of the epoch time.
+        Args:
+            n_epochs (int): The total expected epochs.
+            k_epochs (int): The smallest interval of epochs at which to save.
+            file_name (str): The model metadata. Contains the job name, config name, and subjects.
+            save_path (str, optional): Where the checkpoint is saved to. Defaults to "./".
+            queue_size (int, optional): The most snapshots waiting to be written. Training waits when it is full. Defaults to 2.
+            max_overhead (float, optional): The largest fraction of the epoch time that saving may block training. Defaults to 0.05.
+        """ 
+        super().__init__(n_epochs, k_epochs, file_name, rank, save_path)
+        self.queue_size = queue_size
+        self.max_overhead = max_overhead
+        self.interval = k_epochs
+        self.last_save = 0
+        
+        # The measured epoch, snapshot, and write times
+        self.epoch_start = None
+        self.epoch_time = 0
+        self.snapshot_time = 0
+        self.write_time = 0
+        
+        self.queue = None
+        self.thread = None
+        self.error = None
+        
+        
+    def on_train_begin(self, logs=None):
+        """ Starts the background writer. """
+        os.makedirs(self.save_path, exist_ok=True)
+        self.queue = queue.Queue(maxsize=self.queue_size)
+        self.thread = threading.Thread(target=self._write_loop, daemon=True)
+        self.thread.start()
+        
+        
+    def on_epoch_begin(self, epoch, logs=None):
+        self.epoch_start = perf_counter()
+        
+        
+    def on_epoch_end(self, epoch, logs=None):
+        """ After each epoch, this function is called. Snapshots are queued when the interval is reached.
+        Args:
+            epochs (int): The current epoch.
+            logs (str): Needed by Keras to have this function run. Unused.
+        """ 
+        self._raise_error()
+        self.epoch_time = perf_counter() - self.epoch_start
+        if (epoch+1) - self.last_save < self.interval and (epoch+1) != self.n_epochs:
+            return
+        
+        # Copy the state into host memory. Waits for the writer if the queue is full.
+        start = perf_counter()
+        weights, optimizer_weights = self._get_state()
+        self.queue.put((epoch+1, weights, optimizer_weights))
+        self.snapshot_time = perf_counter() - start
+        self.last_save = epoch+1
+        self._update_interval()
+        
+        
+    def on_train_end(self, logs=None):
+        """ Waits for every queued snapshot to be written, then stops the writer. """
+        if self.thread is None:
+            return
+        self.queue.put(None)
+        self.thread.join()
+        self.thread = None
+        self._raise_error()
+        
+        
+    def _get_state(self):
+        """ Copies the weights and optimizer state of the model into host memory.
+
+        Returns:
+            (tuple): The model weights, and the optimizer weights.
+        """
+        return self.model.get_weights(), self.model.optimizer.get_weights()
+        
+        
+    def _update_interval(self):
+        """ Chooses the next checkpoint interval from the measured save and epoch times. """
+        if self.epoch_time <= 0:
+            return
+        self.interval = max(
+            self.k_epochs,
+            math.ceil(self.snapshot_time / (self.max_overhead * self.epoch_time)),
+            math.ceil(self.write_time / self.epoch_time)
+        )
+        
+        
+    def _write_loop(self):
+        """ Writes the queued snapshots, until it is given None. """
+        while True:
+            item = self.queue.get()
+            if item is None:
+                return
+            if self.error is not None:
+                continue
+            try:
+                start = perf_counter()
+                new_save_path = save_weights_checkpoint(os.path.join(self.save_path, f"{self.file_name}_{item[0]}.npz"), item[1], item[2])
+                self.write_time = perf_counter() - start
+                print(colored(f"\nSaved a checkpoint for epoch {item[0]}/{self.n_epochs}.", 'cyan'))
+                self.clear_prev_save(new_save_path)
+            except Exception as e:
+                self.error = e
+                
+                
+    def _raise_error(self):
+        """ Raises any error of the background writer on the training thread. """
+        if self.error is not None:
+            raise self.error
+            
+
+class FusedCheckpointer(AsyncCheckpointer):
+    """ Checkpoints the weights and optimizer states of every replica of a fused model from a background thread.
+        They are written as one <NAME>_<EPOCH>.npz, in replica order. See AsyncCheckpointer.
+    """
+    def _get_state(self):
+        return self.model.get_replica_weights(), self.model.get_optimizer_weights()
+            
+
+def save_weights_checkpoint(path, weights, optimizer_weights):
+    """ Writes the weights and optimizer state of a model, through a temporary file and an atomic rename.
+
+    Args:
+        path (str): The path of the checkpoint. (.npz)
+        weights (list of np.ndarray): The model weights.
+        optimizer_weights (list of np.ndarray): The optimizer state.
+
+    Returns:
+        str: The path of the checkpoint.
+    """
+    arrays = {f'weight_{i}': w for i, w in enumerate(weights)}
+    arrays.update({f'optimizer_{i}': w for i, w in enumerate(optimizer_weights)})
+    
+    # The temporary name does not start with the checkpoint prefix, so it is never loaded
+    tmp_path = os.path.join(os.path.dirname(path), f".{os.path.basename(path)}.{os.getpid()}.tmp")
+    with open(tmp_path, 'wb') as fp:
+        np.savez(fp, n_weights=len(weights), n_optimizer_weights=len(optimizer_weights), **arrays)
+        fp.flush()
+        os.fsync(fp.fileno())
+    os.replace(tmp_path, path)
+    return path
+
 
-def get_most_recent_checkpoint(save_path, file_prefix, get_epoch=True):
+def load_weights_checkpoint(path, model):
+    """ Loads the weights and optimizer state of a checkpoint into a compiled model.
+
+    Args:
+        path (str): The path of the checkpoint. (.npz)
+        model (keras.Model): The model to load into. May be a fused model.
+
+    Returns:
+        keras.Model: The given model.
+    """
+    with np.load(path) as data:
+        weights = [data[f'weight_{i}'] for i in range(int(data['n_weights']))]
+        optimizer_weights = [data[f'optimizer_{i}'] for i in range(int(data['n_optimizer_weights']))]
+        
+    # A fused model has the weights and optimizer of each replica
+    if isinstance(model, FusedModel):
+        model.set_replica_weights(weights, optimizer_weights)
+        return model
+    model.set_weights(weights)
+        
+    # The optimizer slots only exist after they are created
+    if optimizer_weights:
+        model.optimizer._create_all_weights(model.trainable_variables)
+        model.optimizer.set_weights(optimizer_weights)
+    return model
+
+
+def get_most_recent_checkpoint(save_path, file_prefix, get_epoch=True, model=None):
     """ Get the most recent checkpoint of a job, being the one with the highest epoch value.
     Args:
         save_path (str): Where the checkpoints are saved to.
-        file_prefix (str): The job name in the file: <NAME>_<EPOCH>.h5
+        file_prefix (str): The job name in the file: <NAME>_<EPOCH>.h5 or <NAME>_<EPOCH>.npz
         get_epoch (bool): Whether to return the epoch count from the file.
+        model (keras.Model): The compiled model to load a weights checkpoint (.npz) into. (Optional)
     """ 
     # Get what checkpoints are in the given save path.
-    checkpoints = [os.path.join(save_path, file) for file in os.listdir(save_path) if file.startswith(file_prefix)]
+    if not os.path.isdir(save_path):
+        return None
+    checkpoints = [os.path.join(save_path, file) for file in os.listdir(save_path) if file.startswith(file_prefix) and os.path.isfile(os.path.join(save_path, file))]
     if len(checkpoints) == 0:
         return None
     elif len(checkpoints) > 1:
@@ -73,7 +257,13 @@ def get_most_recent_checkpoint(save_path, file_prefix, get_epoch=True):
     # Read the epochs from each checkpoint and choose the maximum one.
     checkpoint_epochs = [int(os.path.splitext(os.path.basename(chkpt))[0].split('_')[-1]) for chkpt in checkpoints]
     max_epoch = max(checkpoint_epochs)
-    model = load_checkpoint(checkpoints[checkpoint_epochs.index(max_epoch)], False)
+    checkpoint = checkpoints[checkpoint_epochs.index(max_epoch)]
+    if checkpoint.endswith('.npz'):
+        if model is None:
+            raise Exception(colored(f"Error: A model is needed to load the weights checkpoint '{checkpoint}'", 'red'))
+        model = load_weights_checkpoint(checkpoint, model)
+    else:
+        model = load_checkpoint(checkpoint, False)
     if get_epoch:
         return model, max_epoch
     return model
@@ -1,25 +1,125 @@
+from contextlib import nullcontext
+from time import perf_counter
 import termcolor
 import fasteners
+import threading
+import struct
+import queue
+import zlib
 import dill
+import csv
 import os
 import tensorflow as tf
 
-class StepLearningRateLogger(tf.keras.callbacks.Callback):
+
+# Journal logs start with a header of this tag and the size of the log when last compacted
+_JOURNAL_MAGIC = b'TLJ1'
+_HEADER = struct.Struct('<4sQ')
+
+# Each record is prefixed by its length and checksum
+_RECORD = struct.Struct('<II')
+
+# Journals are compacted once they pass this size, and four times their last compacted size
+_COMPACT_BYTES = 64 * 1024
+
+class StepTelemetryLogger(tf.keras.callbacks.Callback):
+    # The batch logs are kept as tensors, so Keras does not copy them to the host every step
+    _supports_tf_logs = True
+    
+    def __init__(self, telemetry_path, sample_steps=50, console_seconds=30):
+        """ Samples the step metrics and learning rate every few steps, and writes them to a CSV file from a background thread.
+            The loss and accuracy are the running means of the epoch, which Keras accumulates on the device.
+            Only sampled steps copy them to the host, so the other steps never wait on the device.
+
+        Args:
+            telemetry_path (str): The CSV file to write to. Rows are appended if it exists.
+            sample_steps (int): The number of steps between samples. Default is 50. (Optional)
+            console_seconds (float): The least time between console prints. Default is 30. (Optional)
+        """
+        super().__init__()
+        self.telemetry_path = telemetry_path
+        self.sample_steps = sample_steps
+        self.console_seconds = console_seconds
+        
+        self.current_epoch = 0
+        self.prev_step = 0
+        self.step_time = None
+        self.last_print = None
+        self.queue = None
+        self.thread = None
+        
+    
     def on_train_begin(self, logs=None):
-        self.epochs = self.params.get('epochs')
+        """ Starts the background writer. """
         self.steps_per_epoch = self.params.get('steps')
-        print(f"Training will run for {self.epochs} epochs, each with {self.steps_per_epoch} steps.")
-    
+        print(f"Training will run for {self.params.get('epochs')} epochs, each with {self.steps_per_epoch} steps.")
+        self.step_time = perf_counter()
+        self.last_print = perf_counter() - self.console_seconds
+        self.queue = queue.Queue()
+        self.thread = threading.Thread(target=self._write_loop, daemon=True)
+        self.thread.start()
+        
+        
     def on_epoch_begin(self, epoch, logs=None):
-        self.current_epoch = epoch  # Store it if you want to access it in other methods
-    
-    def on_train_batch_begin(self, batch, logs=None):
-        lr = self.model.optimizer._decayed_lr(tf.float32).numpy()
-        step = self.model.optimizer.iterations.numpy()
-        n_epochs = self.params.get('epochs')
-        steps_per_epoch = self.params.get('steps')
-        prefix ="" if ( (step + 1) % steps_per_epoch) == 1 else "\n"
-        print(f"{prefix}Step: {(step+1)-self.current_epoch*self.steps_per_epoch} Step total: {step+1}: Learning rate = {lr:.6f}")
+        self.current_epoch = epoch
+        self.prev_step = 0
+        self.step_time = perf_counter()
+        
+        
+    def on_train_batch_end(self, batch, logs=None):
+        """ Samples the step metrics every few steps, and at the end of the epoch. """
+        if (batch + 1) % self.sample_steps != 0 and (batch + 1) != self.steps_per_epoch:
+            return
+        
+        # Only sampled steps are copied to the host
+        logs = logs or {}
+        row = {
+            'epoch': self.current_epoch + 1,
+            'step': batch + 1,
+            'step_total': int(self.model.optimizer.iterations.numpy()),
+            'learning_rate': float(self.model.optimizer._decayed_lr(tf.float32).numpy()),
+            'loss': float(logs['loss']) if 'loss' in logs else float('nan'),
+            'accuracy': float(logs['accuracy']) if 'accuracy' in logs else float('nan'),
+            'seconds_per_step': (perf_counter() - self.step_time) / max(batch + 1 - self.prev_step, 1)
+        }
+        self.prev_step = batch + 1
+        self.step_time = perf_counter()
+        self.queue.put(row)
+        
+        # Rate-limit the console
+        if perf_counter() - self.last_print >= self.console_seconds:
+            self.last_print = perf_counter()
+            print(f"\nStep: {row['step']} Step total: {row['step_total']}: Learning rate = {row['learning_rate']:.6f}, Loss = {row['loss']:.4f}")
+            
+            
+    def on_train_end(self, logs=None):
+        """ Waits for every sample to be written, then stops the writer. """
+        if self.thread is None:
+            return
+        self.queue.put(None)
+        self.thread.join()
+        self.thread = None
+        
+        
+    def _write_loop(self):
+        """ Appends the queued samples to the CSV file, until it is given None. """
+        os.makedirs(os.path.dirname(self.telemetry_path), exist_ok=True)
+        write_header = not os.path.exists(self.telemetry_path) or os.path.getsize(self.telemetry_path) == 0
+        with open(self.telemetry_path, 'a', newline='') as fp:
+            writer = None
+            while True:
+                row = self.queue.get()
+                if row is None:
+                    return
+                if writer is None:
+                    writer = csv.DictWriter(fp, fieldnames=list(row.keys()))
+                    if write_header:
+                        writer.writeheader()
+                writer.writerow(row)
+                
+                # Flush once the queue is caught up
+                if self.queue.empty():
+                    fp.flush()
 
 
 def read_log_items(training_output_path, job_name, item_list, rank=None):
@@ -49,6 +149,7 @@ def read_log_items(training_output_path, job_name, item_list, rank=None):
 
 def read_log(training_output_path, job_name, rank=None):
     """ Reads in a log file.
+        Journal logs are replayed record by record. Logs written as a single dill file are still read.
 
     Args:
         training_output_path (str): The output path of the training results.
@@ -66,15 +167,14 @@ def read_log(training_output_path, job_name, rank=None):
         
         # Try loading it as a dictionary
         try:
-            with open(log_path, 'rb') as fp:
-                return dill.load(fp, encoding='latin1')
+            return _replay(log_path)[0]
         except:
             print(termcolor.colored(f"Warning: Unable to open '{log_path}'", 'yellow'))
             return None
         
         
 def _writing_prep(training_output_path, job_name, use_lock=True, rank=None):
-    """ Gets the logging path and current log.
+    """ Gets the logging path, creating the logging directory if needed.
 
     Args:
         training_output_path (str): The output path of the training results.
@@ -90,11 +190,7 @@ def _writing_prep(training_output_path, job_name, use_lock=True, rank=None):
                 os.makedirs(logging_path, exist_ok = True)
         else:
             os.makedirs(logging_path, exist_ok = True)
-        
-    # Check if the log already exists and get the path to write to.
-    current_log = read_log(training_output_path, job_name, rank)
-    log_path = get_log_name(training_output_path, job_name, rank)
-    return log_path, current_log
+    return get_log_name(training_output_path, job_name, rank)
         
         
 def add_to_log_item_list(training_output_path, job_name, data_dict, use_lock=True, rank=None):
@@ -107,21 +203,8 @@ def add_to_log_item_list(training_output_path, job_name, data_dict, use_lock=Tru
         use_lock (bool): Whether to use a lock or not when writing results. Default is true. (Optional.)
         rank (int): The process rank. Default is none. (Optional)
     """
-    # Get the log path and value
-    log_path, current_log = _writing_prep(training_output_path, job_name, use_lock, rank)
-    
-    # Write info
-    with open(log_path, 'wb') as fp:
-        
-        # Write each element given in the dict to the output dictionary
-        if current_log == None:
-            current_log = {}
-        for key in data_dict:
-            if key not in current_log:
-                current_log[key] = data_dict[key]
-            else:
-                current_log[key].extend(data_dict[key])
-        dill.dump(current_log, fp, encoding='latin1')
+    log_path = _writing_prep(training_output_path, job_name, use_lock, rank)
+    _append(log_path, 'extend', data_dict, use_lock)
         
         
 def write_log(training_output_path, job_name, data_dict, use_lock=True, rank=None):
@@ -134,18 +217,161 @@ def write_log(training_output_path, job_name, data_dict, use_lock=True, rank=Non
         use_lock (bool): Whether to use a lock or not when writing results. Default is true. (Optional.)
         rank (int): The process rank. Default is none. (Optional)
     """
-    # Get the log path and value
-    log_path, current_log = _writing_prep(training_output_path, job_name, use_lock, rank)
+    log_path = _writing_prep(training_output_path, job_name, use_lock, rank)
+    _append(log_path, 'set', data_dict, use_lock)
+
+
+def _append(log_path, operation, data_dict, use_lock):
+    """ Appends a record to a journal log, and compacts the log once it has grown too large.
+        Only the new record is written, so the cost does not depend on the size of the log.
+        A torn record left at the end by a cut off write is removed first, so the new record can be read back.
+
+    Args:
+        log_path (str): The path of the log.
+        operation (str): Either 'set' or 'extend'.
+        data_dict (dict): The items of the record.
+        use_lock (bool): Whether to lock the log while writing.
+    """
+    record = dill.dumps((operation, data_dict))
+    with fasteners.InterProcessLock(f'{log_path}.lock') if use_lock else nullcontext():
+        
+        # Start a new journal, or convert a log written as a single dill file
+        base_size = _read_base_size(log_path)
+        if base_size is None:
+            log = _replay(log_path)[0] if os.path.exists(log_path) and os.path.getsize(log_path) > 0 else {}
+            base_size = _compact(log_path, log)
+            
+        # Records after a torn one would never be replayed
+        else:
+            end = _find_end(log_path)
+            if os.path.getsize(log_path) > end:
+                print(termcolor.colored(f"Warning: Removing a torn record at the end of the log '{log_path}'.", 'yellow'))
+                os.truncate(log_path, end)
+            
+        # Append the record, and make sure it reaches the disk
+        with open(log_path, 'ab') as fp:
+            fp.write(_RECORD.pack(len(record), zlib.crc32(record)) + record)
+            fp.flush()
+            os.fsync(fp.fileno())
+            size = fp.tell()
+            
+        # Replace the records with a single snapshot
+        if size > max(_COMPACT_BYTES, 4 * base_size):
+            _compact(log_path, _replay(log_path)[0])
+
+
+def _compact(log_path, log):
+    """ Atomically replaces a log with a journal holding a single snapshot record.
+
+    Args:
+        log_path (str): The path of the log.
+        log (dict): The full state of the log.
+
+    Returns:
+        int: The size of the compacted journal.
+    """
+    record = dill.dumps(('set', log))
+    base_size = _HEADER.size + _RECORD.size + len(record)
+    tmp_path = f'{log_path}.{os.getpid()}.tmp'
+    with open(tmp_path, 'wb') as fp:
+        fp.write(_HEADER.pack(_JOURNAL_MAGIC, base_size))
+        fp.write(_RECORD.pack(len(record), zlib.crc32(record)) + record)
+        fp.flush()
+        os.fsync(fp.fileno())
+    os.replace(tmp_path, log_path)
     
-    # Write info
-    with open(log_path, 'wb') as fp:
+    # Make the rename durable
+    dir_fd = os.open(os.path.dirname(log_path), os.O_RDONLY)
+    try:
+        os.fsync(dir_fd)
+    finally:
+        os.close(dir_fd)
+    return base_size
+
+
+def _read_base_size(log_path):
+    """ Reads the compacted size from the header of a journal log.
+
+    Args:
+        log_path (str): The path of the log.
+
+    Returns:
+        int: The size of the log when it was last compacted. None if it is not a journal.
+    """
+    if not os.path.exists(log_path):
+        return None
+    with open(log_path, 'rb') as fp:
+        header = fp.read(_HEADER.size)
+    if len(header) != _HEADER.size or not header.startswith(_JOURNAL_MAGIC):
+        return None
+    return _HEADER.unpack(header)[1]
+
+
+def _replay(log_path):
+    """ Reads a log by replaying its records in order.
+        A torn record at the end, from a write that was cut off, is ignored.
+
+    Args:
+        log_path (str): The path of the log.
+
+    Returns:
+        dict: The state of the log.
+        int: The end of the last valid record.
+    """
+    with open(log_path, 'rb') as fp:
+        data = fp.read()
         
-        # Write each element given in the dict to the output dictionary
-        if current_log == None:
-            current_log = {}
+    # Logs written before the journal format are a single dill dictionary
+    if not data.startswith(_JOURNAL_MAGIC):
+        return dill.loads(data, encoding='latin1'), len(data)
+    
+    log = {}
+    offset = _HEADER.size
+    for record, offset in _iter_records(data):
+        operation, data_dict = dill.loads(record)
         for key in data_dict:
-            current_log[key] = data_dict[key]
-        dill.dump(current_log, fp)
+            if operation == 'extend' and key in log:
+                log[key].extend(data_dict[key])
+            else:
+                log[key] = data_dict[key]
+    return log, offset
+
+
+def _find_end(log_path):
+    """ Finds the end of the last valid record of a journal log, by checking the record checksums without unpickling them.
+
+    Args:
+        log_path (str): The path of the log.
+
+    Returns:
+        int: The end of the last valid record.
+    """
+    with open(log_path, 'rb') as fp:
+        data = fp.read()
+    offset = _HEADER.size
+    for _, offset in _iter_records(data):
+        pass
+    return offset
+
+
+def _iter_records(data):
+    """ Iterates over the valid records of a journal log, stopping at the first torn one.
+
+    Args:
+        data (bytes): The contents of the log.
+
+    Yields:
+        bytes: The pickled record.
+        int: The end of the record.
+    """
+    offset = _HEADER.size
+    while offset + _RECORD.size <= len(data):
+        length, checksum = _RECORD.unpack_from(data, offset)
+        record = data[offset + _RECORD.size:offset + _RECORD.size + length]
+        if len(record) != length or zlib.crc32(record) != checksum:
+            return
+        offset += _RECORD.size + length
+        yield record, offset
         
         
 def delete_log(training_output_path, job_name, rank=None):
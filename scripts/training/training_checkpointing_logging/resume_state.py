@@ -0,0 +1,149 @@
+from termcolor import colored
+from time import perf_counter
+import tensorflow as tf
+import threading
+import signal
+import keras
+import os
+
+
+class ResumeState:
+    def __init__(self, directory, model, max_to_keep=1):
+        """ The resumable state of a training fold: the model, optimizer, position within training, and random generator.
+            It is saved with a tf.train.CheckpointManager, which tracks the latest checkpoint in its own index file.
+
+        Args:
+            directory (str): Where the checkpoints of this fold are saved.
+            model (keras.Model): The compiled model.
+            max_to_keep (int): The number of checkpoints to keep. Default is 1. (Optional)
+        """
+        self.epoch = tf.Variable(0, dtype=tf.int64, trainable=False)
+        self.step = tf.Variable(0, dtype=tf.int64, trainable=False)
+        self.checkpoint = tf.train.Checkpoint(
+            model=model,
+            optimizer=model.optimizer,
+            epoch=self.epoch,
+            step=self.step,
+            rng=tf.random.get_global_generator()
+        )
+        self.manager = tf.train.CheckpointManager(self.checkpoint, directory, max_to_keep=max_to_keep)
+
+
+    def save(self, epoch, step):
+        """ Saves the state.
+
+        Args:
+            epoch (int): The current epoch.
+            step (int): The number of finished steps within the epoch.
+
+        Returns:
+            str: The path of the checkpoint.
+        """
+        self.epoch.assign(epoch)
+        self.step.assign(step)
+        return self.manager.save()
+
+
+    def restore(self):
+        """ Restores the latest saved state, if any.
+
+        Returns:
+            (int, int): The epoch and the number of finished steps within it. None if nothing was saved.
+        """
+        if self.manager.latest_checkpoint is None:
+            return None
+        self.checkpoint.restore(self.manager.latest_checkpoint).expect_partial()
+        return int(self.epoch.numpy()), int(self.step.numpy())
+
+
+
+class ResumeCheckpointer(keras.callbacks.Callback):
+    # The batch logs are unused, so they can stay as tensors
+    _supports_tf_logs = True
+    
+    def __init__(self, resume_state, n_epochs, save_seconds=600, save_steps=None, signals=(signal.SIGTERM, signal.SIGUSR1)):
+        """ Saves the resumable state at the end of every epoch, and periodically within epochs.
+            When one of the given signals is received, the state is saved after the current step,
+            and the process is then ended by the signal as it would have been.
+
+        Args:
+            resume_state (ResumeState): The state to save.
+            n_epochs (int): The total expected epochs.
+            save_seconds (float): The time between saves within an epoch. Default is 600. (Optional)
+            save_steps (int): The number of steps between saves within an epoch. Default is None. (Optional)
+            signals (tuple of int): The signals to save on before ending. Default is SIGTERM and SIGUSR1. (Optional)
+        """
+        super().__init__()
+        self.resume_state = resume_state
+        self.n_epochs = n_epochs
+        self.save_seconds = save_seconds
+        self.save_steps = save_steps
+        self.signals = signals
+
+        # Steps already finished in the current epoch before this fit began
+        self.step_offset = 0
+        self.current_epoch = 0
+        self.last_save = None
+        self.received_signal = None
+        self.prev_handlers = {}
+
+
+    def on_train_begin(self, logs=None):
+        """ Installs the signal handlers. Only the main thread may do so. """
+        self.last_save = perf_counter()
+        if threading.current_thread() is threading.main_thread():
+            for signum in self.signals:
+                self.prev_handlers[signum] = signal.signal(signum, self._handle_signal)
+
+
+    def on_train_end(self, logs=None):
+        """ Restores the previous signal handlers. """
+        for signum, handler in self.prev_handlers.items():
+            signal.signal(signum, handler)
+        self.prev_handlers = {}
+
+
+    def on_epoch_begin(self, epoch, logs=None):
+        self.current_epoch = epoch
+
+
+    def on_train_batch_end(self, batch, logs=None):
+        """ Saves the state if a signal was received, or the save interval has passed. """
+        step = self.step_offset + batch + 1
+        if self.received_signal is not None:
+            path = self.resume_state.save(self.current_epoch, step)
+            print(colored(f"\nReceived signal {self.received_signal}. Saved the training state at epoch {self.current_epoch+1}, step {step} to '{path}'.", 'yellow'))
+            self._end_process()
+        elif (self.save_steps and step % self.save_steps == 0) or \
+             (self.save_seconds and perf_counter() - self.last_save >= self.save_seconds):
+            self.resume_state.save(self.current_epoch, step)
+            self.last_save = perf_counter()
+
+
+    def on_epoch_end(self, epoch, logs=None):
+        """ Saves the state at the start of the next epoch. """
+        self.step_offset = 0
+        self.resume_state.save(epoch+1, 0)
+        self.last_save = perf_counter()
+        print(colored(f"\nSaved the training state for epoch {epoch+1}/{self.n_epochs}.", 'cyan'))
+        
+        # A signal received during validation ends the process once the epoch is saved
+        if self.received_signal is not None:
+            self._end_process()
+
+
+    def _handle_signal(self, signum, frame):
+        """ Marks that a signal was received. The state is saved at the end of the current step. """
+        self.received_signal = signum
+
+
+    def _end_process(self):
+        """ Ends the process with the received signal, using its previous handler. """
+        signum = self.received_signal
+        self.on_train_end()
+        if signal.getsignal(signum) is None:
+            signal.signal(signum, signal.SIG_DFL)
+        os.kill(os.getpid(), signum)
+        
+        # Only reached if the signal is ignored
+        self.received_signal = None
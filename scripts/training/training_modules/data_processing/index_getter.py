@@ -1,53 +1,82 @@
 from termcolor import colored
+import numpy as np
 
 
 def get_indexes(files, class_names, subject_list):
     """ Gets the indexes of classes, and the subjects within the image file names.
-        
+        The name tokens are resolved with hash lookups, so the cost does not grow with the number of classes or subjects.
+
     Args:
         files (list of str): List of input image paths.
         class_names (list of str): List of class names.
         subject_list (list of str): List of subject names
-        
+
     Returns:
-        (dict of lists): A dictionary containing all labels, indexes, and subjects.
+        (dict of arrays): A dictionary containing the class index ('idx') and subject index ('subject_idx') of each file.
         (int): The label position.
-        
+
     Exception:
         When more than one label or subject is given.
     """
-    indexes = {'labels': [], 'idx': [], 'subjects': []}
+    class_ids = {name: i for i, name in enumerate(class_names)}
+    subject_ids = {name: i for i, name in enumerate(subject_list)}
+    idx = np.empty(len(files), dtype=np.int32)
+    subject_idx = np.empty(len(files), dtype=np.int32)
     label_position = None
 
-    for file in files:
-        
+    # Files without exactly one label or subject, reported together
+    label_errors = []
+    subject_errors = []
+
+    for i, file in enumerate(files):
+
         # Get the proper filename to parse
-        formatted_name = file.replace("%20", " ").split('/')[-1].split('.')[:-1]
-        formatted_name = '.'.join(formatted_name)
-        formatted_name = formatted_name.split('_')
-        
-        # Get the image label
-        labels = [c for c in class_names if c in formatted_name]
+        formatted_name = file.replace("%20", " ").split('/')[-1].rpartition('.')[0].split('_')
+
+        # Get the image label and subject
+        labels = {class_ids[token] for token in formatted_name if token in class_ids}
+        subjects = {subject_ids[token] for token in formatted_name if token in subject_ids}
         if len(labels) != 1:
-            raise ValueError(colored(f"Error: {len(labels)} labels found for '{file}'. \nThere should be exactly one. Is the case correct?", 'red'))
-        
-        # Get index of the label in the class name list
-        idx = class_names.index(labels[0])
-            
-        # Get the image subject
-        subjects = [s for s in subject_list if s in formatted_name]
+            label_errors.append((file, len(labels)))
+            continue
         if len(subjects) != 1:
-            raise Exception(colored(f"Error: {len(subjects)} subjects found for '{file}'. \nThere should be exactly one. Is the case correct?", 'red'))
-        
+            subject_errors.append((file, len(subjects)))
+            continue
+        idx[i] = labels.pop()
+        subject_idx[i] = subjects.pop()
+
         # Get the position of the label in the string
-        if not label_position:
-            label_position = formatted_name.index(labels[0])
-            
-        # Add the values
-        indexes['labels'].append(labels[0])
-        indexes['idx'].append(idx)
-        indexes['subjects'].append(subjects[0])
-        
+        if label_position is None:
+            label_position = formatted_name.index(class_names[idx[i]])
+
+    # Report every invalid file at once
+    if label_errors or subject_errors:
+        message = ""
+        for kind, errors in (('labels', label_errors), ('subjects', subject_errors)):
+            if errors:
+                message += f"Error: {len(errors)} files do not have exactly one of the {kind}. Is the case correct?\n"
+                message += "".join(f"    {n_found} {kind} found for '{file}'\n" for file, n_found in errors[:10])
+                if len(errors) > 10:
+                    message += f"    ...and {len(errors) - 10} more.\n"
+        raise ValueError(colored(message, 'red'))
+
     print(colored('Finished finding the label indexes.', 'green'))
-    return indexes, label_position
- 
+    return {'idx': idx, 'subject_idx': subject_idx}, label_position
+
+
+def get_subject_ranges(subject_idx, n_subjects):
+    """ Groups the file indexes by subject, so the files of a subject can be found without searching every file.
+        The files of subject i are subject_order[subject_offsets[i]:subject_offsets[i + 1]], in their original order.
+
+    Args:
+        subject_idx (np.ndarray): The subject index of each file.
+        n_subjects (int): The number of subjects.
+
+    Returns:
+        (np.ndarray): The file indexes, sorted by subject.
+        (np.ndarray): The offset of each subject's range within the sorted file indexes.
+    """
+    subject_order = np.argsort(subject_idx, kind='stable')
+    subject_offsets = np.zeros(n_subjects + 1, dtype=np.int64)
+    np.cumsum(np.bincount(subject_idx, minlength=n_subjects), out=subject_offsets[1:])
+    return subject_order, subject_offsets
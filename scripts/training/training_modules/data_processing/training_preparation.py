@@ -1,7 +1,9 @@
 from training.training_modules.data_processing.fold_generator import generate_folds
-from training.training_modules.data_processing.index_getter import get_indexes
-from training.training_modules.image_processing.image_getter import get_files
+from training.training_modules.data_processing.index_getter import get_indexes, get_subject_ranges
+from training.training_modules.image_processing.image_getter import get_files, get_file_order
+from training.training_modules.image_processing.manifest import DatasetManifest
 from random import seed
+import numpy as np
 
 
 class TrainingVars:
@@ -17,9 +19,21 @@ class TrainingVars:
         # Set the seed
         seed(config['seed'])
         
-        # The files to train with and info about its contents
-        self.files = get_files(config['data_input_directory'], config['shuffle_the_images'], config['seed'])
-        self.indexes, self.label_position = get_indexes(self.files, config['class_names'], config['subject_list'])
+        # The files to train with and info about its contents. Read them from the manifest, if given.
+        if 'manifest_path' in config:
+            manifest = DatasetManifest(config['manifest_path'], config['data_input_directory'], config['class_names'], config['subject_list']).load()
+            order = get_file_order(len(manifest.paths), config['shuffle_the_images'], config['seed'])
+            paths = manifest.get_paths()
+            indexes = manifest.get_indexes()
+            self.files = np.array(paths)[order]
+            self.indexes = {key: indexes[key][order] for key in indexes}
+            self.label_position = manifest.label_position
+        else:
+            self.files = np.array(get_files(config['data_input_directory'], config['shuffle_the_images'], config['seed']))
+            self.indexes, self.label_position = get_indexes(self.files, config['class_names'], config['subject_list'])
+        
+        # The file ranges of each subject, so the folds can be partitioned without searching every file
+        self.indexes['subject_order'], self.indexes['subject_offsets'] = get_subject_ranges(self.indexes['subject_idx'], len(config['subject_list']))
         
         # Make sure test subjects and validation subjects are unique
         test_subjects = list(config['test_subjects'])
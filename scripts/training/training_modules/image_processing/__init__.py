@@ -1,6 +1,11 @@
-from . import image_getter, image_parser, image_reader
+from . import dataset_cache, feature_bank, image_getter, image_parser, image_reader, manifest, shard_cache, volume_converter
 __all__ = [
+    'dataset_cache',
+    'feature_bank',
     'image_getter', 
     'image_parser', 
-    'image_reader'
+    'image_reader',
+    'manifest',
+    'shard_cache',
+    'volume_converter'
 ]
@@ -0,0 +1,155 @@
+from termcolor import colored
+import tensorflow as tf
+import glob
+import os
+
+
+# The possible caching modes of a split
+CACHE_MODES = ('memory', 'disk', 'none')
+
+
+class DatasetCache:
+    def __init__(self, cache_config, cache_name):
+        """ Caches and prefetches the datasets of a training fold.
+            Each split can be cached in memory or on disk. Memory caches are limited by a budget,
+            splits that do not fit are spilled to disk instead.
+
+        Args:
+            cache_config (dict): The 'dataset_cache' settings of the configuration. May be empty.
+            cache_name (str): A name, unique to the fold, for the on-disk cache files.
+        """
+        self.modes = {
+            split: cache_config.get(split, 'none') for split in ('training', 'validation', 'testing')
+        }
+        for split, mode in self.modes.items():
+            if mode not in CACHE_MODES:
+                raise ValueError(colored(f"Error: Unknown cache mode '{mode}' for the {split} split. The choices are: {CACHE_MODES}", 'red'))
+
+        self.memory_budget = cache_config.get('memory_budget_mb', 4096) * 1024**2
+        self.cache_directory = cache_config.get('cache_directory', None)
+        self.use_prefetch = cache_config.get('prefetch', True)
+        self.cache_name = cache_name
+
+        # What each split was given, and the number of elements decoded and read from it
+        self.memory_used = 0
+        self.splits = {}
+
+
+    def cache(self, split, ds, n_items, item_bytes):
+        """ Caches the (unbatched) dataset of a split.
+
+        Args:
+            split (str): The split name. Either training, validation, or testing.
+            ds (tf.data.Dataset): The dataset of image-label pairs.
+            n_items (int): The number of images in the split.
+            item_bytes (int): The size of one decoded image, in bytes.
+
+        Returns:
+            (tf.data.Dataset): The cached dataset.
+        """
+        mode = self.modes[split]
+        size = n_items * item_bytes
+
+        # Spill to disk if the split does not fit in the memory budget
+        if mode == 'memory' and self.memory_used + size > self.memory_budget:
+            if self.cache_directory:
+                print(colored(f"Warning: The {split} split ({size / 1024**2:.1f} MB) exceeds the dataset cache memory budget. It will be cached on disk.", 'yellow'))
+                mode = 'disk'
+            else:
+                print(colored(f"Warning: The {split} split ({size / 1024**2:.1f} MB) exceeds the dataset cache memory budget, and no cache directory is given. It will not be cached.", 'yellow'))
+                mode = 'none'
+        if mode == 'disk' and not self.cache_directory:
+            raise ValueError(colored(f"Error: A 'cache_directory' is needed to cache the {split} split on disk.", 'red'))
+        if mode == 'none':
+            return ds
+
+        # Count the decoded elements before the cache, and the read elements after it
+        with tf.device('/cpu:0'):
+            decoded = tf.Variable(0, dtype=tf.int64, trainable=False)
+            read = tf.Variable(0, dtype=tf.int64, trainable=False)
+        self.splits[split] = {'mode': mode, 'size': size, 'n_items': n_items, 'decoded': decoded, 'read': read}
+
+        ds = ds.map(lambda image, label: _count(decoded, image, label))
+        if mode == 'memory':
+            self.memory_used += size
+            ds = ds.cache()
+        else:
+            os.makedirs(self.cache_directory, exist_ok=True)
+            cache_path = self._cache_path(split)
+            _remove_files(cache_path)
+            ds = ds.cache(cache_path)
+        return ds.map(lambda image, label: _count(read, image, label))
+
+
+    def prefetch(self, ds):
+        """ Prefetches the batches of a dataset, so the model does not wait on the input pipeline.
+
+        Args:
+            ds (tf.data.Dataset): A batched dataset.
+
+        Returns:
+            (tf.data.Dataset): The prefetched dataset.
+        """
+        if self.use_prefetch:
+            return ds.prefetch(tf.data.AUTOTUNE)
+        return ds
+
+
+    def report(self):
+        """ Prints the hit rate and memory of every cached split.
+
+        Returns:
+            (dict): The hit rate and memory (MB) of each cached split.
+        """
+        results = {}
+        for split, info in self.splits.items():
+            decoded = int(info['decoded'].numpy())
+            read = int(info['read'].numpy())
+            hit_rate = 1 - decoded / read if read else 0.0
+
+            # Memory is only held once a full pass has filled the cache
+            memory = info['size'] / 1024**2 if info['mode'] == 'memory' and decoded >= info['n_items'] else 0.0
+            results[split] = {'hit_rate': hit_rate, 'memory_mb': memory}
+            print(colored(
+                f"Dataset cache for the {split} split ({info['mode']}): {read} reads, {decoded} decoded, " +
+                f"hit rate {hit_rate:.1%}, {memory:.1f} MB of RAM.",
+                'cyan'
+            ))
+        return results
+
+
+    def cleanup(self):
+        """ Removes the on-disk cache files of this fold. """
+        for split, info in self.splits.items():
+            if info['mode'] == 'disk':
+                _remove_files(self._cache_path(split))
+
+
+    def _cache_path(self, split):
+        return os.path.join(self.cache_directory, f'{self.cache_name}_{split}')
+
+
+
+def _count(counter, image, label):
+    """ Increments a counter for every element passing through a dataset.
+
+    Args:
+        counter (tf.Variable): The counter.
+        image (Tensor): An image.
+        label (Tensor): Its label.
+
+    Returns:
+        (Tensor, Tensor): The unchanged image-label pair.
+    """
+    counter.assign_add(1)
+    return image, label
+
+
+def _remove_files(cache_path):
+    """ Removes the files of an on-disk cache, including stale ones of an interrupted run.
+
+    Args:
+        cache_path (str): The cache file prefix.
+    """
+    for path in glob.glob(f'{cache_path}*'):
+        os.remove(path)
@@ -0,0 +1,166 @@
+from training.training_modules.image_processing.shard_cache import SubjectShardCache
+from termcolor import colored
+from tensorflow import keras
+import tensorflow as tf
+import numpy as np
+import fasteners
+import hashlib
+import json
+import os
+
+
+# The content hashes of the backbone checkpoints, by path, size, and modification time
+_model_hashes = {}
+
+
+class FeatureBank(SubjectShardCache):
+    # The pooled features are stored as they are given to the head
+    shard_dtype = np.float32
+
+
+    def __init__(self, bank_directory, backbone_checkpoint, data_input_directory, channels, do_cropping, offset_height, offset_width, target_height, target_width, batch_size=32):
+        """ A store of the pooled features of a frozen backbone, with one memory-mappable float32 shard per subject.
+            The features are keyed by the hash of the backbone checkpoint, within the image settings,
+            so the backbone runs once per image for every fold and trial that trains a head on it.
+
+        Args:
+            bank_directory (str): Where the features are stored.
+            backbone_checkpoint (str): The saved model whose layers up to its pooling are the backbone. (.h5)
+            data_input_directory (str): Where the input images are located.
+
+            channels (int): Channels in which to decode image.
+            do_cropping (bool): Whether to crop the image.
+            offset_height (int): Image height offset.
+
+            offset_width (int): Image width offset.
+            target_height (int): Image height target.
+            target_width (int): Image width target.
+            batch_size (int): The images run through the backbone at once. Default is 32. (Optional)
+        """
+        super().__init__(bank_directory, data_input_directory, channels, do_cropping, offset_height, offset_width, target_height, target_width)
+        self.backbone_checkpoint = backbone_checkpoint
+        self.batch_size = batch_size
+
+        # The features of each backbone are kept under the decoding parameters of its images
+        self.model_hash = get_model_hash(backbone_checkpoint)
+        self.path = os.path.join(self.path, self.model_hash)
+        os.makedirs(self.path, exist_ok=True)
+
+        # Only loaded when features are missing
+        self._backbone = None
+        self._n_features = None
+
+
+    def get_n_features(self):
+        """ Gets the length of a feature vector, loading the backbone only the first time it is used.
+
+        Returns:
+            (int): The number of features.
+        """
+        if self._n_features is not None:
+            return self._n_features
+        info_path = os.path.join(self.path, 'backbone.json')
+        if not os.path.exists(info_path):
+            with fasteners.InterProcessLock(os.path.join(self.path, 'backbone.lock')):
+                if not os.path.exists(info_path):
+                    tmp_info_path = f'{info_path}.{os.getpid()}.tmp'
+                    with open(tmp_info_path, 'w') as fp:
+                        json.dump({
+                            'backbone_checkpoint': os.path.abspath(self.backbone_checkpoint),
+                            'n_features': int(self._get_backbone().output_shape[-1])
+                        }, fp)
+                    os.replace(tmp_info_path, info_path)
+        with open(info_path) as fp:
+            self._n_features = json.load(fp)['n_features']
+        return self._n_features
+
+
+    def _build_shard(self, subject, files, signature):
+        """ Runs every image of a subject through the backbone into a shard.
+
+        Args:
+            subject (str): The subject name.
+            files (list of str): The sorted image paths of the subject.
+            signature (dict): The file paths, sizes, and modification times.
+        """
+        print(colored(f"Extracting the backbone features of {len(files)} images into the feature bank for subject {subject}.", 'cyan'))
+        backbone = self._get_backbone()
+
+        # Write into a temporary file, batch by batch, so the whole subject is never in memory
+        tmp_data_path = f'{self._data_path(subject)}.{os.getpid()}.tmp'
+        shard = np.lib.format.open_memmap(tmp_data_path, mode='w+', dtype=np.float32, shape=(len(files), self.get_n_features()))
+        try:
+            for start in range(0, len(files), self.batch_size):
+                images = np.stack([self._decode(file) for file in files[start:start + self.batch_size]])
+                shard[start:start + len(images)] = backbone.predict_on_batch(tf.image.convert_image_dtype(images, tf.float32))
+            shard.flush()
+        
+        # Do not leave partly written features behind
+        except BaseException:
+            del shard
+            os.remove(tmp_data_path)
+            raise
+        del shard
+        self._replace_shard(subject, tmp_data_path, signature)
+
+
+    def _get_backbone(self):
+        """ Loads the backbone: the checkpoint's model, up to the output of its pooling layer.
+
+        Raises:
+            ValueError: When the checkpoint does not end in a pooling and dense layer.
+
+        Returns:
+            (keras.Model): The backbone.
+        """
+        if self._backbone is not None:
+            return self._backbone
+        model = keras.models.load_model(self.backbone_checkpoint, compile=False)
+        if not isinstance(model.layers[-2], keras.layers.GlobalAveragePooling2D):
+            raise ValueError(colored(f"Error: The backbone checkpoint '{self.backbone_checkpoint}' does not end in a GlobalAveragePooling2D and Dense layer.", 'red'))
+        self._backbone = keras.models.Model(inputs=model.input, outputs=model.layers[-2].output)
+        return self._backbone
+
+
+
+def get_feature_bank(config):
+    """ Creates the feature bank of a configuration.
+
+    Args:
+        config (dict): The training configuration, with a 'feature_bank' setting.
+
+    Returns:
+        (FeatureBank): The feature bank.
+    """
+    return FeatureBank(
+        config['feature_bank']['directory'],
+        config['feature_bank']['backbone_checkpoint'],
+        config['data_input_directory'],
+        config['hyperparameters']['channels'],
+        config['hyperparameters']['do_cropping'],
+        config['hyperparameters']['cropping_position'][0],
+        config['hyperparameters']['cropping_position'][1],
+        config['target_height'],
+        config['target_width'],
+        config['feature_bank'].get('batch_size', 32)
+    )
+
+
+def get_model_hash(path):
+    """ Gets the hash of a checkpoint's contents. It is only computed once per process for an unchanged file.
+
+    Args:
+        path (str): The checkpoint path.
+
+    Returns:
+        (str): The hash.
+    """
+    stat = os.stat(path)
+    key = (os.path.abspath(path), stat.st_size, stat.st_mtime_ns)
+    if key not in _model_hashes:
+        sha1 = hashlib.sha1()
+        with open(path, 'rb') as fp:
+            for chunk in iter(lambda: fp.read(1 << 20), b''):
+                sha1.update(chunk)
+        _model_hashes[key] = sha1.hexdigest()[:16]
+    return _model_hashes[key]
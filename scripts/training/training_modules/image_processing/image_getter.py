@@ -1,15 +1,17 @@
+from training.training_modules.image_processing.manifest import DatasetManifest, IMAGE_EXTENSIONS
 from termcolor import colored
 import random
 import os
 
 
-def get_files(input_path, shuffle_images, seed):
+def get_files(input_path, shuffle_images, seed, manifest_path=None):
     """ Gets all of the input paths of the image data.
 
     Args:
         input_path (str): A path to some directory.
         shuffle_images (bool): Whether to shuffle the image paths.
         seed (int): Random seed.
+        manifest_path (str): A dataset manifest to read the paths from, instead of searching the directory. (Optional)
 
     Raises:
         Exception: If an input path cannot be reached.
@@ -21,34 +23,60 @@ def get_files(input_path, shuffle_images, seed):
     if not os.path.isdir(input_path):
         raise Exception(colored(f"Error: '{input_path}' is not a valid input path.", 'red'))
     
+    # Read the paths from the manifest, if given
+    if manifest_path:
+        files = DatasetManifest(manifest_path, input_path).load().get_paths()
+    
     # Search through the first level, of subdirectories (1)
-    files = []
-    _flatten_dir(input_path, files)
+    else:
+        files = []
+        skipped = []
+        _flatten_dir(input_path, files, skipped)
+        if skipped:
+            print(colored(f"Warning: {len(skipped)} non-image files were skipped. For example: '{skipped[0]}'"))
                     
     # Shuffle the list
     files.sort()
+    files = [files[i] for i in get_file_order(len(files), shuffle_images, seed)]
+    print(colored('Finished getting the image paths.', 'green'))
+    return files
+
+
+def get_file_order(n_files, shuffle_images, seed):
+    """ Gets the order of the sorted image paths. 
+        The same seed gives the same order as shuffling the paths themselves.
+
+    Args:
+        n_files (int): The number of image paths.
+        shuffle_images (bool): Whether to shuffle the image paths.
+        seed (int): Random seed.
+
+    Returns:
+        (list of int): The index of each image path, in order.
+    """
+    order = list(range(n_files))
     if shuffle_images:
         if seed: 
             random.seed(seed)
-        random.shuffle(files)
-    print(colored('Finished getting the image paths.', 'green'))
-    return files
+        random.shuffle(order)
+    return order
 
     
-def _flatten_dir(path, files):
+def _flatten_dir(path, files, skipped):
     """ Recursively gets the paths of ALL images within a directory and its subdirectories.
 
     Args:
         path (str): A path to some directory.
         files (list of str): A list of paths to images.
+        skipped (list of str): A list of paths to non-image files.
     """
     for item in os.listdir(os.path.abspath(path)):
         full_path = os.path.join(path, item)
         if os.path.isfile(full_path):
-            if full_path.endswith((".png", ".jpg", ".jpeg", ".tiff", ".csv")):
+            if full_path.endswith(IMAGE_EXTENSIONS):
                 files.append(full_path)
             else:
-                print(colored(f"Warning: Non-image file detected: '{full_path}'"))
+                skipped.append(full_path)
         else:
-            _flatten_dir(full_path, files)
+            _flatten_dir(full_path, files, skipped)
  
\ No newline at end of file
@@ -1,3 +1,4 @@
+from training.training_modules.image_processing.volume_converter import read_volume
 from abc import ABC, abstractmethod
 from termcolor import colored
 import tensorflow as tf
@@ -194,4 +195,84 @@ class ImageReaderCSV(ImageReader):
             image = tf.image.crop_to_bounding_box(image, offset_height, offset_width, target_height, target_width)
         
         return image, tf.argmax(label_bool)
-    
\ No newline at end of file
+    
+    
+class ImageReaderNpy(ImageReader):
+    """ Handles reading and parsing of .npy volumes
+
+        These are written by the volume converter, from .csv or .tiff volumes.
+        They are memory-mapped, so only the parts of a volume that are used are read from disk.
+    """
+    def __init__(self):
+        ImageReader.__init__(self)
+        return
+
+    def io_read(self, filename):
+        if isinstance(filename, tf.Tensor):
+            filename = filename.numpy()
+        return read_volume(filename)
+
+    def parse_image(self, filename, class_names, channels, do_cropping, offset_height, offset_width, target_height, target_width, label_position=None, use_labels=True): 
+        # Split to get only the image name
+        image_path = tf.strings.split(filename, "/")[-1]
+        
+        # Remove the file extention
+        path_substring = tf.strings.regex_replace(
+            image_path,
+            ".png|.jpg|.jpeg|.tiff|.csv|.npy", 
+            ""
+        )
+        
+        # Find the label
+        label = tf.strings.split(path_substring, "_")[label_position]
+        label_bool = (label == class_names)
+
+        image = self.io_read(filename)
+
+        # Crop the image
+        if do_cropping == 'true':
+            image = tf.image.crop_to_bounding_box(image, offset_height, offset_width, target_height, target_width)
+        
+        return image, tf.argmax(label_bool)
+
+    def create_dataset(self, files, labels, do_cropping, offset_height, offset_width, target_height, target_width):
+        """ Creates a dataset of volume-label pairs, reading each volume as a memory-mapped view.
+            The view is cropped before it is read, so only the used part of a volume is read from disk and copied.
+
+        Args:
+            files (list of str): The .npy volume paths.
+            labels (list of int): The label index of each volume.
+            do_cropping (bool): Whether to crop the volumes.
+            offset_height (int): Volume height offset.
+            offset_width (int): Volume width offset.
+            target_height (int): Volume height target.
+            target_width (int): Volume width target.
+
+        Raises:
+            ValueError: When the cropping bounds do not fit the volumes.
+
+        Returns:
+            (tf.data.Dataset): A dataset of volume-label pairs.
+        """
+        def _get_view(volume):
+            if volume.ndim == 2:
+                volume = volume[..., np.newaxis]
+            if do_cropping:
+                volume = volume[offset_height:offset_height + target_height, offset_width:offset_width + target_width]
+            return volume
+
+        # Every volume must have the shape of the first to be batched together
+        image_shape = _get_view(read_volume(files[0])).shape
+        if do_cropping and image_shape[:2] != (target_height, target_width):
+            raise ValueError(colored('Cropping bounds are invalid. Please review target size and cropping position values.', 'red'))
+
+        def _read(filename):
+            return np.asarray(_get_view(read_volume(filename)), dtype=np.float32)
+
+        def _map(filename, label):
+            image = tf.numpy_function(_read, [filename], tf.float32)
+            image.set_shape(image_shape)
+            return image, label
+
+        ds = tf.data.Dataset.from_tensor_slices((files, np.asarray(labels, dtype=np.int64)))
+        return ds.map(_map, num_parallel_calls=tf.data.AUTOTUNE, deterministic=True)
@@ -0,0 +1,330 @@
+from training.training_modules.data_processing.index_getter import get_indexes
+from concurrent.futures import ThreadPoolExecutor
+from termcolor import colored
+import numpy as np
+import fasteners
+import hashlib
+import json
+import os
+
+
+# The file types that are considered images
+IMAGE_EXTENSIONS = (".png", ".jpg", ".jpeg", ".tiff", ".csv", ".npy")
+
+
+class DatasetManifest:
+    def __init__(self, manifest_path, input_path, class_names=None, subject_list=None, n_workers=16):
+        """ A persistent list of the images within a directory, with their labels and subjects.
+            The manifest is written to disk once, and revalidated by the modification times of its directories.
+            Only directories that have changed since are scanned again.
+            The labels and subjects are stored for each set of class and subject names, so callers with different names share the manifest.
+            Only new or changed images are parsed for their labels.
+
+        Args:
+            manifest_path (str): Where the manifest is stored. (.npz)
+            input_path (str): The directory of images.
+            class_names (list of str): A list of class names. If given, the label of each image is stored. (Optional)
+            subject_list (list of str): A list of subject names. Must be given with the class names. (Optional)
+            n_workers (int): The number of threads scanning directories. Default is 16. (Optional)
+        """
+        if not os.path.isdir(input_path):
+            raise Exception(colored(f"Error: '{input_path}' is not a valid input path.", 'red'))
+        self.manifest_path = manifest_path
+        self.given_path = input_path
+        self.input_path = os.path.abspath(input_path)
+        self.class_names = list(class_names) if class_names else []
+        self.subject_list = list(subject_list) if subject_list else []
+        self.n_workers = n_workers
+
+        # The manifest contents
+        self.paths = []
+        self.sizes = np.zeros(0, dtype=np.int64)
+        self.mtimes = np.zeros(0, dtype=np.int64)
+        self.label_idx = np.zeros(0, dtype=np.int32)
+        self.subject_idx = np.zeros(0, dtype=np.int32)
+        self.label_position = -1
+        self.dir_mtimes = {}
+        
+        # The labels and subjects of each set of names, by the hash of the names
+        self.label_key = _get_label_key(self.class_names, self.subject_list) if self.class_names else None
+        self.label_tables = {}
+
+
+    def load(self):
+        """ Loads the manifest, updating it if the directory has changed.
+
+        Returns:
+            (DatasetManifest): This manifest.
+        """
+        if self._read() and not self._changed_directories() and not self._missing_labels():
+            self._set_labels()
+            return self
+
+        # Only one process should update the manifest at a time
+        os.makedirs(os.path.dirname(os.path.abspath(self.manifest_path)), exist_ok=True)
+        with fasteners.InterProcessLock(f'{self.manifest_path}.lock'):
+            if not self._read():
+                print(colored(f"Creating the dataset manifest for '{self.input_path}'.", 'cyan'))
+                self._update(self._scan([self.input_path]))
+                self._write()
+            else:
+                changed = self._changed_directories()
+                if changed:
+                    print(colored(f"Updating the dataset manifest for {len(changed)} changed directories.", 'cyan'))
+                    self._update(self._scan(changed))
+                    self._write()
+                    
+            # Parse the names of the images without labels for the given names
+            if self._missing_labels():
+                self._find_labels()
+                self._write()
+        self._set_labels()
+        return self
+
+
+    def get_paths(self):
+        """ Gets the image paths, in the same form as the image getter would give them.
+
+        Returns:
+            (list of str): The sorted image paths.
+        """
+        prefix_length = len(self.input_path) + 1
+        return [os.path.join(self.given_path, path[prefix_length:]) for path in self.paths]
+    
+    
+    def get_indexes(self):
+        """ Gets the class and subject indexes of the images, in the same form as the index getter would give them.
+
+        Returns:
+            (dict of arrays): A dictionary containing the class index ('idx') and subject index ('subject_idx') of each image.
+        """
+        return {'idx': self.label_idx, 'subject_idx': self.subject_idx}
+
+
+    def _missing_labels(self):
+        """ Checks if any image has no stored label for the given names.
+
+        Returns:
+            (bool): If labels are missing. Always false when no class names are given.
+        """
+        if self.label_key is None:
+            return False
+        return self.label_key not in self.label_tables or bool((self.label_tables[self.label_key]['idx'] < 0).any())
+
+
+    def _find_labels(self):
+        """ Finds the class and subject of the images without a stored label, from their names. """
+        table = self.label_tables.setdefault(self.label_key, {
+            'idx': np.full(len(self.paths), -1, dtype=np.int32),
+            'subject_idx': np.full(len(self.paths), -1, dtype=np.int32),
+            'label_position': -1
+        })
+        missing = np.flatnonzero(table['idx'] < 0)
+        indexes, label_position = get_indexes([self.paths[i] for i in missing], self.class_names, self.subject_list)
+        table['idx'][missing] = indexes['idx']
+        table['subject_idx'][missing] = indexes['subject_idx']
+        if table['label_position'] < 0 and label_position is not None:
+            table['label_position'] = label_position
+
+
+    def _set_labels(self):
+        """ Sets the labels and subjects of the given names, if the class names are given. """
+        if self.label_key is None:
+            return
+        table = self.label_tables[self.label_key]
+        self.label_idx = table['idx']
+        self.subject_idx = table['subject_idx']
+        self.label_position = table['label_position']
+
+
+    def _read(self):
+        """ Reads the manifest from disk, if it exists and matches the given directory.
+
+        Returns:
+            (bool): If a valid manifest was read.
+        """
+        if not os.path.exists(self.manifest_path):
+            return False
+        try:
+            with np.load(self.manifest_path) as data:
+                if str(data['input_path']) != self.input_path:
+                    return False
+                self.paths = data['paths'].tolist()
+                self.sizes = data['sizes']
+                self.mtimes = data['mtimes']
+                self.dir_mtimes = dict(zip(data['dirs'].tolist(), data['dir_mtimes'].tolist()))
+                self.label_tables = {
+                    key: {
+                        'idx': data[f'idx_{key}'],
+                        'subject_idx': data[f'subject_idx_{key}'],
+                        'label_position': int(label_position)
+                    } for key, label_position in zip(data['label_keys'].tolist(), data['label_positions'].tolist())
+                }
+        except (OSError, ValueError, KeyError):
+            print(colored(f"Warning: Unable to read the manifest '{self.manifest_path}'. It will be created again.", 'yellow'))
+            return False
+        return True
+
+
+    def _write(self):
+        """ Writes the manifest to disk. """
+        tmp_path = f'{self.manifest_path}.{os.getpid()}.tmp'
+        with open(tmp_path, 'wb') as fp:
+            np.savez(
+                fp,
+                input_path=np.array(self.input_path),
+                paths=np.array(self.paths, dtype=str),
+                sizes=self.sizes,
+                mtimes=self.mtimes,
+                dirs=np.array(list(self.dir_mtimes.keys()), dtype=str),
+                dir_mtimes=np.array(list(self.dir_mtimes.values()), dtype=np.int64),
+                label_keys=np.array(list(self.label_tables.keys()), dtype=str),
+                label_positions=np.array([table['label_position'] for table in self.label_tables.values()], dtype=np.int64),
+                **{f'idx_{key}': table['idx'] for key, table in self.label_tables.items()},
+                **{f'subject_idx_{key}': table['subject_idx'] for key, table in self.label_tables.items()}
+            )
+        os.replace(tmp_path, self.manifest_path)
+
+
+    def _changed_directories(self):
+        """ Finds the directories that were changed or removed since the manifest was written.
+
+        Returns:
+            (list of str): The changed directories.
+        """
+        directories = list(self.dir_mtimes.keys())
+        with ThreadPoolExecutor(self.n_workers) as executor:
+            mtimes = list(executor.map(_get_mtime, directories))
+        return [d for d, mtime in zip(directories, mtimes) if mtime != self.dir_mtimes[d]]
+
+
+    def _scan(self, directories):
+        """ Scans directories, and any new subdirectories, in parallel.
+
+        Args:
+            directories (list of str): The directories to scan.
+
+        Returns:
+            (dict): The contents of every scanned directory. Removed directories are None.
+        """
+        scanned = {}
+        pending = list(directories)
+        with ThreadPoolExecutor(self.n_workers) as executor:
+            while pending:
+                results = list(executor.map(_scan_directory, pending))
+                next_pending = []
+                for directory, result in zip(pending, results):
+                    scanned[directory] = result
+                    
+                    # Known subdirectories are revalidated by their own modification times
+                    if result is not None:
+                        next_pending.extend(d for d in result['subdirs'] if d not in self.dir_mtimes and d not in scanned)
+                pending = next_pending
+                
+        # Warn once for all non-image files
+        skipped = [f for result in scanned.values() if result is not None for f in result['skipped']]
+        if skipped:
+            print(colored(f"Warning: {len(skipped)} non-image files were skipped. For example: '{skipped[0]}'", 'yellow'))
+        return scanned
+
+
+    def _update(self, scanned):
+        """ Replaces the entries of the scanned directories with their new contents.
+
+        Args:
+            scanned (dict): The scanned directories.
+        """
+        # Keep the entries of the directories that were not scanned
+        keep = [i for i, path in enumerate(self.paths) if os.path.dirname(path) not in scanned]
+        paths = [self.paths[i] for i in keep]
+        sizes = [self.sizes[keep]]
+        mtimes = [self.mtimes[keep]]
+        label_tables = {
+            key: {'idx': [table['idx'][keep]], 'subject_idx': [table['subject_idx'][keep]]} for key, table in self.label_tables.items()
+        }
+        
+        # Add the entries of the scanned directories
+        new_files = []
+        for directory, result in scanned.items():
+            if result is None:
+                self.dir_mtimes.pop(directory, None)
+            else:
+                self.dir_mtimes[directory] = result['mtime']
+                new_files.extend(result['files'])
+        paths.extend(file[0] for file in new_files)
+        sizes.append(np.array([file[1] for file in new_files], dtype=np.int64))
+        mtimes.append(np.array([file[2] for file in new_files], dtype=np.int64))
+        
+        # The new and changed images are labelled when they are next loaded with each set of names
+        for arrays in label_tables.values():
+            arrays['idx'].append(np.full(len(new_files), -1, dtype=np.int32))
+            arrays['subject_idx'].append(np.full(len(new_files), -1, dtype=np.int32))
+            
+        # Keep the entries sorted by path
+        order = np.argsort(np.array(paths, dtype=str), kind='stable')
+        self.paths = [paths[i] for i in order]
+        self.sizes = np.concatenate(sizes)[order]
+        self.mtimes = np.concatenate(mtimes)[order]
+        for key, arrays in label_tables.items():
+            self.label_tables[key]['idx'] = np.concatenate(arrays['idx'])[order]
+            self.label_tables[key]['subject_idx'] = np.concatenate(arrays['subject_idx'])[order]
+
+
+
+def _get_label_key(class_names, subject_list):
+    """ Gets the key of the labels stored for a set of names.
+
+    Args:
+        class_names (list of str): A list of class names.
+        subject_list (list of str): A list of subject names.
+
+    Returns:
+        (str): The hash of the names.
+    """
+    return hashlib.sha1(json.dumps([class_names, subject_list]).encode()).hexdigest()[:16]
+
+
+def _get_mtime(directory):
+    """ Gets the modification time of a directory.
+
+    Args:
+        directory (str): A directory path.
+
+    Returns:
+        (int): The modification time in nanoseconds, or None if it no longer exists.
+    """
+    try:
+        return os.stat(directory).st_mtime_ns
+    except OSError:
+        return None
+
+
+def _scan_directory(directory):
+    """ Lists the images and subdirectories within a single directory.
+
+    Args:
+        directory (str): A directory path.
+
+    Returns:
+        (dict): The directory's modification time, images (path, size, mtime), subdirectories, and skipped files.
+            None if the directory no longer exists.
+    """
+    # Get the time before listing, so changes made while scanning are found later
+    mtime = _get_mtime(directory)
+    if mtime is None:
+        return None
+    
+    result = {'mtime': mtime, 'files': [], 'subdirs': [], 'skipped': []}
+    try:
+        with os.scandir(directory) as entries:
+            for entry in entries:
+                if entry.is_dir():
+                    result['subdirs'].append(entry.path)
+                elif entry.name.endswith(IMAGE_EXTENSIONS):
+                    stat = entry.stat()
+                    result['files'].append((entry.path, stat.st_size, stat.st_mtime_ns))
+                else:
+                    result['skipped'].append(entry.path)
+    except FileNotFoundError:
+        return None
+    return result
@@ -0,0 +1,250 @@
+from termcolor import colored
+import tensorflow as tf
+import numpy as np
+import fasteners
+import hashlib
+import json
+import os
+
+
+class SubjectShardCache:
+    # The type of the stored rows
+    shard_dtype = np.uint8
+
+
+    def __init__(self, cache_directory, data_input_directory, channels, do_cropping, offset_height, offset_width, target_height, target_width):
+        """ A store of decoded images, with one memory-mappable uint8 shard per subject.
+            Every fold, rotation, and trial that uses the same dataset and image settings shares the same shards.
+
+        Args:
+            cache_directory (str): Where the shards are stored.
+            data_input_directory (str): Where the input images are located.
+
+            channels (int): Channels in which to decode image.
+            do_cropping (bool): Whether to crop the image.
+            offset_height (int): Image height offset.
+
+            offset_width (int): Image width offset.
+            target_height (int): Image height target.
+            target_width (int): Image width target.
+        """
+        self.channels = channels
+        self.do_cropping = do_cropping
+        self.offset_height = offset_height
+        self.offset_width = offset_width
+        self.target_height = target_height
+        self.target_width = target_width
+
+        # Shards are only valid for the same data and decoding parameters
+        self.key = get_shard_key(data_input_directory, channels, do_cropping, offset_height, offset_width, target_height, target_width)
+        self.path = os.path.join(cache_directory, self.key)
+        os.makedirs(self.path, exist_ok=True)
+
+        # Shards opened by this process
+        self._shards = {}
+
+
+    def get_shard(self, subject, files):
+        """ Gets the shard of a subject, decoding its images if the shard is missing or out of date.
+
+        Args:
+            subject (str): The subject name.
+            files (list of str): The image paths of the subject.
+
+        Returns:
+            (np.memmap): The decoded images, one row per image.
+            (dict): The row of each image path within the shard.
+        """
+        files = sorted(files)
+        if subject in self._shards and self._shards[subject][1].keys() == set(files):
+            return self._shards[subject]
+
+        # Rebuild the shard if it is invalid. Lock it so other processes do not decode it at the same time.
+        signature = _get_signature(files)
+        if not self._is_valid(subject, signature):
+            with fasteners.InterProcessLock(os.path.join(self.path, f'{subject}.lock')):
+                if not self._is_valid(subject, signature):
+                    self._build_shard(subject, files, signature)
+
+        shard = np.load(self._data_path(subject), mmap_mode='r')
+        rows = {file: row for row, file in enumerate(files)}
+        self._shards[subject] = (shard, rows)
+        return shard, rows
+
+
+    def create_dataset(self, files, subjects, labels):
+        """ Creates a dataset of the given images from the subject shards.
+            The images are gathered from the shards in the same order as the given file list.
+
+        Args:
+            files (list of str): The image paths.
+            subjects (list of str): The subject of each image.
+            labels (list of int): The label index of each image.
+
+        Returns:
+            (tf.data.Dataset): A dataset of image-label pairs.
+        """
+        # Group the files by subject
+        subject_files = {}
+        for file, subject in zip(files, subjects):
+            subject_files.setdefault(subject, []).append(file)
+
+        # Get the shard and row of every image
+        shards = []
+        shard_ids = {}
+        for subject in subject_files:
+            shard, rows = self.get_shard(subject, subject_files[subject])
+            shard_ids[subject] = len(shards)
+            shards.append((shard, rows))
+        shard_index = np.array([shard_ids[subject] for subject in subjects], dtype=np.int32)
+        row_index = np.array([shards[shard_ids[subject]][1][file] for file, subject in zip(files, subjects)], dtype=np.int64)
+
+        # All shards must have the same image shape to be batched together
+        image_shapes = {shard.shape[1:] for shard, _ in shards}
+        if len(image_shapes) != 1:
+            raise ValueError(colored(f"Error: The subject shards have different image shapes: {image_shapes}", 'red'))
+        image_shape = image_shapes.pop()
+
+        def _gather(shard_id, row):
+            return np.asarray(shards[shard_id][0][row])
+
+        def _read(shard_id, row, label):
+            image = tf.numpy_function(_gather, [shard_id, row], tf.as_dtype(self.shard_dtype))
+            image.set_shape(image_shape)
+            return tf.image.convert_image_dtype(image, tf.float32), label
+
+        ds = tf.data.Dataset.from_tensor_slices((shard_index, row_index, np.asarray(labels, dtype=np.int64)))
+        return ds.map(_read, num_parallel_calls=tf.data.AUTOTUNE, deterministic=True)
+
+
+    def _is_valid(self, subject, signature):
+        """ Checks if a shard exists and matches the current files.
+
+        Args:
+            subject (str): The subject name.
+            signature (dict): The file paths, sizes, and modification times.
+
+        Returns:
+            (bool): If the shard can be used.
+        """
+        if not os.path.exists(self._data_path(subject)) or not os.path.exists(self._meta_path(subject)):
+            return False
+        try:
+            with open(self._meta_path(subject)) as fp:
+                meta = json.load(fp)
+        except (OSError, ValueError):
+            return False
+        return meta.get('signature') == signature
+
+
+    def _build_shard(self, subject, files, signature):
+        """ Decodes every image of a subject into a shard.
+
+        Args:
+            subject (str): The subject name.
+            files (list of str): The sorted image paths of the subject.
+            signature (dict): The file paths, sizes, and modification times.
+        """
+        print(colored(f"Decoding {len(files)} images into the shard cache for subject {subject}.", 'cyan'))
+
+        # Write into a temporary file, row by row, so the whole subject is never in memory
+        tmp_data_path = f'{self._data_path(subject)}.{os.getpid()}.tmp'
+        shard = None
+        try:
+            for row, file in enumerate(files):
+                image = self._decode(file)
+                if shard is None:
+                    shard = np.lib.format.open_memmap(tmp_data_path, mode='w+', dtype=np.uint8, shape=(len(files),) + image.shape)
+                elif image.shape != shard.shape[1:]:
+                    raise ValueError(colored(f"Error: '{file}' has the shape {image.shape}, expected {shard.shape[1:]}.", 'red'))
+                shard[row] = image
+            shard.flush()
+        
+        # Do not leave a partly written shard behind
+        except BaseException:
+            del shard
+            if os.path.exists(tmp_data_path):
+                os.remove(tmp_data_path)
+            raise
+        del shard
+        self._replace_shard(subject, tmp_data_path, signature)
+
+
+    def _replace_shard(self, subject, tmp_data_path, signature):
+        """ Replaces the old shard of a subject and its metadata atomically.
+
+        Args:
+            subject (str): The subject name.
+            tmp_data_path (str): The temporary file of the new shard.
+            signature (dict): The file paths, sizes, and modification times.
+        """
+        tmp_meta_path = f'{self._meta_path(subject)}.{os.getpid()}.tmp'
+        with open(tmp_meta_path, 'w') as fp:
+            json.dump({'subject': subject, 'signature': signature}, fp)
+        os.replace(tmp_data_path, self._data_path(subject))
+        os.replace(tmp_meta_path, self._meta_path(subject))
+
+
+    def _decode(self, file):
+        """ Decodes a single image as uint8.
+
+        Args:
+            file (str): The image path.
+
+        Returns:
+            (np.ndarray): The decoded, and possibly cropped, image.
+        """
+        image = tf.io.decode_image(tf.io.read_file(file), channels=self.channels, dtype=tf.uint8, expand_animations=False)
+        if self.do_cropping:
+            try:
+                image = tf.image.crop_to_bounding_box(image, self.offset_height, self.offset_width, self.target_height, self.target_width)
+            except:
+                raise ValueError(colored('Cropping bounds are invalid. Please review target size and cropping position values.', 'red'))
+        return image.numpy()
+
+
+    def _data_path(self, subject):
+        return os.path.join(self.path, f'{subject}.npy')
+
+
+    def _meta_path(self, subject):
+        return os.path.join(self.path, f'{subject}.json')
+
+
+
+def get_shard_key(data_input_directory, channels, do_cropping, offset_height, offset_width, target_height, target_width):
+    """ Gets the cache key for a dataset and its decoding parameters.
+
+    Args:
+        data_input_directory (str): Where the input images are located.
+        channels (int): Channels in which to decode image.
+        do_cropping (bool): Whether to crop the image.
+        offset_height (int): Image height offset.
+        offset_width (int): Image width offset.
+        target_height (int): Image height target.
+        target_width (int): Image width target.
+
+    Returns:
+        (str): A key, unique to the given parameters.
+    """
+    params = [os.path.abspath(data_input_directory), channels, bool(do_cropping)]
+    if do_cropping:
+        params.extend([offset_height, offset_width, target_height, target_width])
+    return hashlib.sha1(json.dumps(params).encode()).hexdigest()[:16]
+
+
+def _get_signature(files):
+    """ Gets the paths, sizes, and modification times of some files.
+
+    Args:
+        files (list of str): A list of file paths.
+
+    Returns:
+        (dict): The signature of the files.
+    """
+    stats = [os.stat(file) for file in files]
+    return {
+        'files': list(files),
+        'sizes': [stat.st_size for stat in stats],
+        'mtimes': [stat.st_mtime_ns for stat in stats]
+    }
@@ -0,0 +1,101 @@
+from util.get_config import parse_json
+from termcolor import colored
+from skimage import io
+import numpy as np
+import os
+
+
+# The volume file types that can be converted
+VOLUME_EXTENSIONS = (".csv", ".tiff")
+
+
+def convert_volume(input_path, output_path, shape, dtype='float32'):
+    """ Converts a CSV or TIFF volume into a binary .npy file.
+        The .npy header stores the shape and type, so it can be memory-mapped without parsing.
+
+    Args:
+        input_path (str): The path to the CSV or TIFF volume.
+        output_path (str): The path of the .npy file to write.
+        shape (list of int): The shape of the volume.
+        dtype (str): The data type to store the volume as. Default is float32. (Optional)
+    """
+    if input_path.endswith(".csv"):
+        volume = np.genfromtxt(input_path)
+    else:
+        volume = io.imread(input_path)
+    volume = volume.reshape(shape).astype(dtype)
+
+    # Write to a temporary file first, so a cancelled job never leaves a partial volume
+    tmp_path = f'{output_path}.{os.getpid()}.tmp'
+    with open(tmp_path, 'wb') as fp:
+        np.save(fp, volume)
+    os.replace(tmp_path, output_path)
+
+
+def convert_directory(input_directory, output_directory, shape, dtype='float32'):
+    """ Converts every CSV and TIFF volume within a directory and its subdirectories.
+        The directory structure and file names are kept, so the labels and subjects can still be parsed.
+        Volumes that were already converted, and have not changed since, are skipped.
+
+    Args:
+        input_directory (str): Where the volumes are located.
+        output_directory (str): Where to write the .npy volumes.
+        shape (list of int): The shape of the volumes.
+        dtype (str): The data type to store the volumes as. Default is float32. (Optional)
+
+    Returns:
+        (int): The number of converted volumes.
+    """
+    if not os.path.isdir(input_directory):
+        raise Exception(colored(f"Error: '{input_directory}' is not a valid input path.", 'red'))
+
+    n_converted = 0
+    for root, _, files in os.walk(input_directory):
+        for file in files:
+            if not file.endswith(VOLUME_EXTENSIONS):
+                continue
+            input_path = os.path.join(root, file)
+            output_dir = os.path.join(output_directory, os.path.relpath(root, input_directory))
+            output_path = os.path.join(output_dir, f"{os.path.splitext(file)[0]}.npy")
+
+            # Skip volumes that are up to date
+            if os.path.exists(output_path) and os.path.getmtime(output_path) >= os.path.getmtime(input_path):
+                continue
+            os.makedirs(output_dir, exist_ok=True)
+            convert_volume(input_path, output_path, shape, dtype)
+            n_converted += 1
+    print(colored(f"Finished converting {n_converted} volumes into '{output_directory}'.", 'green'))
+    return n_converted
+
+
+def read_volume(filename):
+    """ Reads a converted volume as a memory-mapped, read-only view.
+        The data is only loaded from disk when it is accessed.
+
+    Args:
+        filename (str or bytes): The path to a .npy volume.
+
+    Returns:
+        (np.memmap): The volume.
+    """
+    if isinstance(filename, bytes):
+        filename = filename.decode()
+    return np.load(filename, mmap_mode='r')
+
+
+def main(config=None):
+    """ The main body of the program """
+    # Obtain a dictionary of configurations
+    if config is None:
+        config = parse_json('./training/training_modules/image_processing/volume_converter_config.json')
+
+    convert_directory(
+        config['input_directory'],
+        config['output_directory'],
+        config['csv_shape'],
+        config.get('dtype', 'float32')
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -1,4 +1,5 @@
-from . import model_creator
+from . import model_creator, fused_model
 __all__ = [
-    'model_creator'
+    'model_creator',
+    'fused_model'
 ]
@@ -0,0 +1,163 @@
+from training.training_modules.model_processing.model_creator import TrainingModel
+from tensorflow import keras
+import tensorflow as tf
+
+
+class FusedModel(keras.Model):
+    def __init__(self, replicas):
+        """ Trains several models side by side in one train step, each on the same batch, with its own optimizer.
+            A replica can be stopped, after which the train and test steps are rebuilt without it.
+
+        Args:
+            replicas (list of keras.Model): The compiled models. They must take the same input.
+        """
+        super().__init__()
+        self.replicas = replicas
+        self.active = [True] * len(replicas)
+        self.loss_fn = keras.losses.SparseCategoricalCrossentropy()
+
+        # The running mean loss of the active replicas, and the loss and accuracy of each replica
+        self.loss_tracker = keras.metrics.Mean(name='loss')
+        self.replica_loss_trackers = [keras.metrics.Mean(name=f'loss_{i}') for i in range(len(replicas))]
+        self.replica_accuracy_trackers = [keras.metrics.SparseCategoricalAccuracy(name=f'accuracy_{i}') for i in range(len(replicas))]
+
+
+    @property
+    def metrics(self):
+        # Listed so Keras resets them every epoch
+        return [self.loss_tracker] + self.replica_loss_trackers + self.replica_accuracy_trackers
+
+
+    def call(self, inputs, training=False):
+        return [replica(inputs, training=training) for replica, active in zip(self.replicas, self.active) if active]
+
+
+    def train_step(self, data):
+        images, labels = data
+        losses = []
+        for i, replica in enumerate(self.replicas):
+            if not self.active[i]:
+                continue
+            with tf.GradientTape() as tape:
+                probabilities = replica(images, training=True)
+                loss = self.loss_fn(labels, probabilities)
+                if replica.losses:
+                    loss += tf.add_n(replica.losses)
+            gradients = tape.gradient(loss, replica.trainable_variables)
+            replica.optimizer.apply_gradients(zip(gradients, replica.trainable_variables))
+            self.replica_loss_trackers[i].update_state(loss)
+            self.replica_accuracy_trackers[i].update_state(labels, probabilities)
+            losses.append(loss)
+        self.loss_tracker.update_state(tf.add_n(losses) / len(losses))
+        return self._get_logs()
+
+
+    def test_step(self, data):
+        images, labels = data
+        losses = []
+        for i, replica in enumerate(self.replicas):
+            if not self.active[i]:
+                continue
+            probabilities = replica(images, training=False)
+            loss = self.loss_fn(labels, probabilities)
+            self.replica_loss_trackers[i].update_state(loss)
+            self.replica_accuracy_trackers[i].update_state(labels, probabilities)
+            losses.append(loss)
+        self.loss_tracker.update_state(tf.add_n(losses) / len(losses))
+        return self._get_logs()
+
+
+    def stop_replica(self, index):
+        """ Stops training a replica. The train and test steps are rebuilt without it from the next step on.
+
+        Args:
+            index (int): The replica index.
+        """
+        self.active[index] = False
+        self.test_function = None
+        self.train_function = None
+        if any(self.active):
+            self.train_function = self.make_train_function()
+        else:
+            self.stop_training = True
+
+
+    def get_replica_weights(self):
+        """ Gets the weights of every replica, in order.
+
+        Returns:
+            (list of np.ndarray): The weights.
+        """
+        return [weight for replica in self.replicas for weight in replica.get_weights()]
+
+
+    def get_optimizer_weights(self):
+        """ Gets the optimizer state of every replica, in order.
+
+        Returns:
+            (list of np.ndarray): The optimizer weights.
+        """
+        return [weight for replica in self.replicas for weight in replica.optimizer.get_weights()]
+
+
+    def set_replica_weights(self, weights, optimizer_weights):
+        """ Sets the weights and optimizer state of every replica, as given by get_replica_weights and get_optimizer_weights.
+
+        Args:
+            weights (list of np.ndarray): The weights.
+            optimizer_weights (list of np.ndarray): The optimizer weights. May be empty.
+        """
+        position = 0
+        for replica in self.replicas:
+            n_weights = len(replica.weights)
+            replica.set_weights(weights[position:position + n_weights])
+            position += n_weights
+
+        # The optimizer slots only exist after they are created
+        position = 0
+        for replica in self.replicas if optimizer_weights else []:
+            replica.optimizer._create_all_weights(replica.trainable_variables)
+            n_weights = len(replica.optimizer.weights)
+            replica.optimizer.set_weights(optimizer_weights[position:position + n_weights])
+            position += n_weights
+
+
+    def _get_logs(self):
+        """ Gets the metrics of the active replicas, named by replica index.
+
+        Returns:
+            (dict): The metric values.
+        """
+        logs = {'loss': self.loss_tracker.result()}
+        for i, active in enumerate(self.active):
+            if active:
+                logs[f'loss_{i}'] = self.replica_loss_trackers[i].result()
+                logs[f'accuracy_{i}'] = self.replica_accuracy_trackers[i].result()
+        return logs
+
+
+
+class FusedTrainingModel:
+    def __init__(self, replica_configs):
+        """ Creates a model for each configuration, each with its own optimizer, and fuses them for training.
+            Each replica is created from its configuration's seed, as a reused model would be.
+
+        Args:
+            replica_configs (list of dict): The training configuration of each replica.
+                They must have the same model type, input shape, and classes.
+        """
+        self.model_type = replica_configs[0]['selected_model_name']
+        self.replicas = []
+        for config in replica_configs:
+            tf.random.set_seed(config['seed'])
+            self.replicas.append(TrainingModel(
+                config['hyperparameters'],
+                config['selected_model_name'],
+                config['target_height'],
+                config['target_width'],
+                config['class_names']
+            ))
+        self.model = FusedModel([replica.model for replica in self.replicas])
+
+        # The first replica's optimizer is the one the step telemetry reads
+        self.model.compile(optimizer=self.replicas[0].model.optimizer)
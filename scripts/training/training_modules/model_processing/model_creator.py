@@ -1,5 +1,7 @@
 from termcolor import colored
 from tensorflow import keras
+import tensorflow as tf
+import gc
 
 
 # This is a list of all possible models to create
@@ -15,6 +17,9 @@ custom_models = {
     "3dcnn": ""
 }
 
+# The models built by this process, with their initial weights. Reused by folds of the same architecture and seed.
+_model_cache = {}
+
 class TrainingModel:
     def __init__(self, hyperparameters, model_type, target_height, target_width, class_names):
         """ Creates and prepares a model for training.
@@ -55,7 +60,15 @@ class TrainingModel:
         avg = keras.layers.GlobalAveragePooling2D()(base_model.output)
         out = keras.layers.Dense(len(class_names), activation="softmax")(avg)
         self.model = keras.models.Model(inputs=base_model.input, outputs=out)
+        self.compile(hyperparameters)
+        
         
+    def compile(self, hyperparameters):
+        """ Creates a new optimizer and compiles the model with it.
+
+        Args:
+            hyperparameters (dict): The configuration's hyperparameters.
+        """
         # Create optimizer and add to model
         # optimizer = keras.optimizers.legacy.SGD(
         #     learning_rate=hyperparameters['learning_rate'], 
@@ -76,3 +89,54 @@ class TrainingModel:
             optimizer=optimizer,
             metrics=["accuracy"]
         )
+
+
+
+class HeadTrainingModel(TrainingModel):
+    def __init__(self, hyperparameters, model_type, n_features, class_names):
+        """ Creates and prepares the dense head of a model, to train on the pooled features of a frozen backbone.
+
+        Args:
+            hyperparameters (dict): The configuration's hyperparameters.
+            model_type (str): Type of model the backbone is of.
+            n_features (int): The length of a feature vector.
+            class_names (list of str): A list of classes.
+        """
+        self.model_type = model_type
+        features = keras.Input(shape=(n_features,))
+        out = keras.layers.Dense(len(class_names), activation="softmax")(features)
+        self.model = keras.models.Model(inputs=features, outputs=out)
+        self.compile(hyperparameters)
+
+
+def get_training_model(hyperparameters, model_type, target_height, target_width, class_names, seed):
+    """ Gets a model for training, reusing the one built by this process if it has the same architecture and seed.
+        A reused model has its initial weights restored and a new optimizer, so it trains as a newly built one would.
+        
+    Args:
+        hyperparameters (dict): The configuration's hyperparameters.
+        model_type (str): Type of model to create.
+        target_height (int): Height of input.
+        target_width (int): Width of input.
+        class_names (list of str): A list of classes.
+        seed (int): The random seed of the initial weights.
+        
+    Returns:
+        (TrainingModel): The prepared model.
+    """
+    key = (model_type, target_height, target_width, hyperparameters['channels'], len(class_names), seed)
+    if key in _model_cache:
+        model_obj, initial_weights = _model_cache[key]
+        model_obj.model.set_weights(initial_weights)
+        model_obj.compile(hyperparameters)
+        return model_obj
+    
+    # Release the previous model and the Keras state before building another
+    _model_cache.clear()
+    keras.backend.clear_session()
+    gc.collect()
+    
+    tf.random.set_seed(seed)
+    model_obj = TrainingModel(hyperparameters, model_type, target_height, target_width, class_names)
+    _model_cache[key] = (model_obj, model_obj.model.get_weights())
+    return model_obj
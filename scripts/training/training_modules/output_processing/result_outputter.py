@@ -1,4 +1,6 @@
 from termcolor import colored
+from tensorflow import keras
+import numpy as np
 import fasteners
 import pandas as pd
 import json
@@ -19,7 +21,7 @@ def output_results(output_path, testing_subject, rotation_subject, rotation, mod
         history (keras History): The history outputted by the fitting function.
         
         time_elapsed (double): The elapsed time from the fitting phase.
-        datasets (dict): A dictionary of various values for the data-splits.
+        datasets (dict): The file paths, label indexes, and dataset of each data-split.
         class_names (list of str): The class names of the data.
         
         job_name (str): The name of this config's job name.
@@ -72,16 +74,16 @@ def output_results(output_path, testing_subject, rotation_subject, rotation, mod
     
     # Inner loop file names
     if not is_outer:
-        # Predicted probability results
-        metrics[f"prediction/{file_prefix}_val_predicted.csv"] = model_obj.model.predict(datasets['validation']['ds'])
+        # Predicted probability results, from a single pass over the validation data
+        _evaluate(model_obj.model, datasets['validation']['ds'], f"prediction/{file_prefix}_val_predicted.csv", class_names, path_prefix)
         
         # True labels
-        metrics[f"true_label/{file_prefix}_test_true_label.csv"] = datasets['testing']['labels']
-        metrics[f"true_label/{file_prefix}_val_true_label.csv"] = datasets['validation']['labels']
+        metrics[f"true_label/{file_prefix}_test_true_label.csv"] = [class_names[l] for l in datasets['testing']['labels']]
+        metrics[f"true_label/{file_prefix}_val_true_label.csv"] = [class_names[l] for l in datasets['validation']['labels']]
         
         # True index 
-        metrics[f'true_label/{file_prefix}_true_label_index.csv'] = [class_output[l] for l in datasets['testing']['labels']]
-        metrics[f'true_label/{file_prefix}_val_true_label_index.csv'] = [class_output[l] for l in datasets['validation']['labels']]
+        metrics[f'true_label/{file_prefix}_true_label_index.csv'] = datasets['testing']['labels']
+        metrics[f'true_label/{file_prefix}_val_true_label_index.csv'] = datasets['validation']['labels']
         
         # Input file name
         metrics[f'file_name/{file_prefix}_test_file.csv'] = datasets['testing']['files']
@@ -89,14 +91,11 @@ def output_results(output_path, testing_subject, rotation_subject, rotation, mod
     
     # Outer loop file names
     else:
-        # Predicted probability results
-        metrics[f"prediction/{file_prefix}_predicted.csv"] = model_obj.model.predict(datasets['testing']['ds'])
-        
         # True labels
-        metrics[f"true_label/{file_prefix}_true_label.csv"] = datasets['testing']['labels']
+        metrics[f"true_label/{file_prefix}_true_label.csv"] = [class_names[l] for l in datasets['testing']['labels']]
         
         # True index 
-        metrics[f'true_label/{file_prefix}_label_index.csv'] = [class_output[l] for l in datasets['testing']['labels']]
+        metrics[f'true_label/{file_prefix}_label_index.csv'] = datasets['testing']['labels']
         
         # Input file name
         metrics[f'file_name/{file_prefix}_file.csv'] = datasets['testing']['files']
@@ -110,9 +109,9 @@ def output_results(output_path, testing_subject, rotation_subject, rotation, mod
             'yellow'
         ))
     else:
-        metrics[f"{file_prefix}_test_evaluation.csv"] =  model_obj.model.evaluate(datasets['testing']['ds'])              # The evaluation results
-        if not is_outer:
-            metrics[f"prediction/{file_prefix}_test_predicted.csv"] =  model_obj.model.predict(datasets['testing']['ds']) # Predictions using the testing dataset
+        # The evaluation results and predictions, from a single pass over the testing data
+        prediction_file = f"prediction/{file_prefix}_predicted.csv" if is_outer else f"prediction/{file_prefix}_test_predicted.csv"
+        metrics[f"{file_prefix}_test_evaluation.csv"] = _evaluate(model_obj.model, datasets['testing']['ds'], prediction_file, class_names, path_prefix)
     
     # Write all metrics to file
     for metric in metrics:
@@ -120,6 +119,60 @@ def output_results(output_path, testing_subject, rotation_subject, rotation, mod
     print(colored(f"Finished writing results to file for {model_obj.model_type}'s testing subject {testing_subject} and validation subject {rotation_subject}.\n", 'green'))
 
 
+def _evaluate(model, ds, prediction_file, class_names, path_prefix):
+    """ Runs the model once over a dataset, streaming the predictions to file batch by batch.
+        The loss, accuracy, predicted indexes, and class counts all come from the same pass.
+
+    Args:
+        model (keras.Model): The trained model.
+        ds (tf.data.Dataset): A batched dataset of image-label pairs.
+        prediction_file (str): The predicted probabilities file, ending in '_predicted.csv'.
+        class_names (list of str): The class names of the data.
+        path_prefix (str): The prefix of the file name and directory.
+
+    Returns:
+        list: The loss and accuracy, as given by model.evaluate.
+    """
+    total_loss = 0.0
+    n_correct = 0
+    n_items = 0
+    counts = np.zeros((len(class_names), 3), dtype=np.int64)
+    
+    index_file = prediction_file[:-len('.csv')] + '_index.csv'
+    with open(f"{path_prefix}/{prediction_file}", 'w', encoding='utf-8') as prediction_fp, \
+         open(f"{path_prefix}/{index_file}", 'w', encoding='utf-8') as index_fp:
+        prediction_writer = csv.writer(prediction_fp)
+        for images, labels in ds:
+            probabilities = model.predict_on_batch(images)
+            labels = labels.numpy()
+            predicted = np.argmax(probabilities, axis=1)
+            
+            # Accumulate the metrics
+            total_loss += float(np.sum(keras.losses.sparse_categorical_crossentropy(labels, probabilities)))
+            n_correct += int(np.sum(predicted == labels))
+            n_items += len(labels)
+            np.add.at(counts[:, 0], labels, 1)
+            np.add.at(counts[:, 1], predicted, 1)
+            np.add.at(counts[:, 2], labels[predicted == labels], 1)
+            
+            # Write the batch
+            for row in probabilities:
+                prediction_writer.writerow(row)
+            index_fp.writelines(f"{i}\n" for i in predicted)
+            
+    # Write the number of true, predicted, and correct images of each class, outside of the prediction folder
+    counts_file = os.path.basename(prediction_file)[:-len('_predicted.csv')] + '_class_counts.csv'
+    with open(f"{path_prefix}/{counts_file}", 'w', encoding='utf-8') as fp:
+        writer = csv.writer(fp)
+        writer.writerow(['class', 'true', 'predicted', 'correct'])
+        for name, row in zip(class_names, counts):
+            writer.writerow([name, *row])
+    
+    if n_items == 0:
+        return [float('nan'), float('nan')]
+    return [total_loss / n_items, n_correct / n_items]
+
+
 def _create_folders(path, names=None):
     """ Creates folder(s) if they do not exist.
 
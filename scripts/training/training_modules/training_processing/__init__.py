@@ -1,5 +1,7 @@
-from . import training_fold, training_loop
+from . import training_fold, training_loop, fused_fold, head_fold
 __all__ = [
     'training_fold',
-    'training_loop'
+    'training_loop',
+    'fused_fold',
+    'head_fold'
 ]
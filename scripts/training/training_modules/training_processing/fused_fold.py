@@ -0,0 +1,241 @@
+from training.training_modules.training_processing.training_fold import Fold, _FoldTrainingInfo
+from training.training_modules.output_processing.result_outputter import output_results
+from training.training_modules.model_processing.fused_model import FusedTrainingModel
+from training.training_checkpointing_logging.checkpointer import FusedCheckpointer
+from training.training_checkpointing_logging.logger import StepTelemetryLogger
+from termcolor import colored
+from tensorflow import keras
+import numpy as np
+import json
+import os
+
+
+# The hyperparameters that may differ between the replicas of a fused model
+REPLICA_HYPERPARAMETERS = ('learning_rate', 'momentum', 'bool_nesterov', 'decay', 'patience')
+
+
+def get_fusion_key(config):
+    """ Gets what a configuration must share with others to train in the same fused model:
+        everything but its job name, output path, and optimizer and early stopping settings.
+
+    Args:
+        config (dict): The training configuration.
+
+    Returns:
+        (str): The key.
+    """
+    shared = {key: value for key, value in config.items() if key not in ('job_name', 'output_path')}
+    shared['hyperparameters'] = {key: value for key, value in config['hyperparameters'].items() if key not in REPLICA_HYPERPARAMETERS}
+    return json.dumps(shared, sort_keys=True, default=str)
+
+
+def fuse_configs(configs):
+    """ Groups the configurations with a 'fused_replicas' setting that can train as replicas of one model.
+        Each group of up to 'fused_replicas' becomes one configuration, named after its first,
+        which holds the group in 'fused_configs'. Other configurations are kept as they are.
+
+    Args:
+        configs (list of dict): The training configurations.
+
+    Returns:
+        (list of dict): The configurations to train.
+    """
+    groups = []
+    open_groups = {}
+    for config in configs:
+        n_replicas = config.get('fused_replicas', 1)
+        if n_replicas < 2:
+            groups.append([config])
+            continue
+
+        # ASHA promotes each configuration on its own, and a head on a feature bank has no backbone to share
+        if 'asha' in config or 'feature_bank' in config:
+            print(colored(f"Warning: The configuration {config['job_name']} uses {'ASHA' if 'asha' in config else 'a feature bank'}, so it will not be fused with others.", 'yellow'))
+            groups.append([config])
+            continue
+        key = get_fusion_key(config)
+        if key not in open_groups or len(open_groups[key]) >= n_replicas:
+            open_groups[key] = []
+            groups.append(open_groups[key])
+        open_groups[key].append(config)
+
+    fused_configs = [
+        group[0] if len(group) == 1 else dict(group[0], job_name=f"{group[0]['job_name']}_fused_{len(group)}", fused_configs=group)
+        for group in groups
+    ]
+    if len(fused_configs) < len(configs):
+        print(colored(f"Fused {len(configs)} configurations into {len(fused_configs)} trainings.", 'cyan'))
+    return fused_configs
+
+
+class ReplicaEarlyStopping(keras.callbacks.Callback):
+    def __init__(self, patiences):
+        """ Stops each replica of a fused model once its validation loss has not improved for its patience,
+            and restores the replica's weights of its best epoch, as early stopping does for a single model.
+            Training ends when every replica has stopped.
+
+        Args:
+            patiences (list of int): The patience of each replica.
+        """
+        super().__init__()
+        self.patiences = patiences
+        self.best = None
+        self.wait = None
+        self.best_weights = None
+
+
+    def on_train_begin(self, logs=None):
+        self.best = [np.inf] * len(self.patiences)
+        self.wait = [0] * len(self.patiences)
+        self.best_weights = [None] * len(self.patiences)
+
+
+    def on_epoch_end(self, epoch, logs=None):
+        logs = logs or {}
+        for i, replica in enumerate(self.model.replicas):
+            if not self.model.active[i] or f'val_loss_{i}' not in logs:
+                continue
+            val_loss = float(logs[f'val_loss_{i}'])
+            if val_loss < self.best[i]:
+                self.best[i] = val_loss
+                self.wait[i] = 0
+                self.best_weights[i] = replica.get_weights()
+                continue
+
+            self.wait[i] += 1
+            if self.wait[i] >= self.patiences[i]:
+                print(colored(f"Replica {i} stopped early at epoch {epoch+1}.", 'cyan'))
+
+                # No best epoch if the validation loss was never finite
+                if self.best_weights[i] is not None:
+                    replica.set_weights(self.best_weights[i])
+                self.model.stop_replica(i)
+
+
+
+class _FusedFoldTrainingInfo(_FoldTrainingInfo):
+    def __init__(self, fold_index, config, testing_subject, rotation_subject, files, folds, indexes, label_position, n_epochs, rank=None, is_outer=False):
+        """ Initializes the training fold info of a fused configuration. See _FoldTrainingInfo. """
+        super().__init__(fold_index, config, testing_subject, rotation_subject, files, folds, indexes, label_position, n_epochs, rank, is_outer)
+
+        # Each replica writes its results under its own job name
+        self.replica_configs = [dict(replica_config) for replica_config in config['fused_configs']]
+        if self.rank:
+            for replica_config in self.replica_configs:
+                replica_config['job_name'] = f"{replica_config['job_name']}_test_{testing_subject}" \
+                if is_outer else f"{replica_config['job_name']}_test_{testing_subject}_val_{rotation_subject}"
+
+
+    def create_model(self):
+        """ Create a model for each replica, fused to train on the same batches. """
+        self.model = FusedTrainingModel(self.replica_configs)
+
+
+    def create_callbacks(self):
+        """ Create the training callbacks.
+            This includes the early stopping of each replica, and checkpoints of every replica.
+        """
+        # Get the job name for saving
+        if self.is_outer:
+            self.checkpoint_prefix = f"{self.config['job_name']}_test_{self.testing_subject}_config_{self.config['selected_model_name']}"
+        else:
+            self.checkpoint_prefix = f"{self.config['job_name']}_test_{self.testing_subject}_val_{self.rotation_subject}_config_{self.config['selected_model_name']}"
+
+        # The replicas are checkpointed together from a background thread
+        if 'resume_checkpoint' in self.config:
+            print(colored("Warning: resume_checkpoint is not used with fused replicas. Checkpoints are written at the end of epochs.", 'yellow'))
+        async_checkpoint = self.config.get('async_checkpoint', {})
+        self.checkpoints = FusedCheckpointer(
+            self.n_epochs,
+            self.config['k_epoch_checkpoint_frequency'],
+            self.checkpoint_prefix,
+            self.rank,
+            os.path.join(self.config['output_path'], 'checkpoints'),
+            async_checkpoint.get('queue_size', 2),
+            async_checkpoint.get('max_overhead', 0.05)
+        )
+
+        # Sample the step metrics and learning rate into a per-fold file
+        telemetry = self.config.get('telemetry', {})
+        step_lr_logger = StepTelemetryLogger(
+            os.path.join(self.config['output_path'], 'telemetry', f"{self.checkpoint_prefix}_telemetry.csv"),
+            telemetry.get('sample_steps', 50),
+            telemetry.get('console_seconds', 30)
+        )
+
+        # Early stopping of each replica
+        if not self.is_outer:
+            early_stopping = ReplicaEarlyStopping([config['hyperparameters']['patience'] for config in self.replica_configs])
+            self.callbacks = (step_lr_logger, early_stopping, self.checkpoints)
+        else:
+            self.callbacks = (step_lr_logger, self.checkpoints)
+
+
+
+class FusedFold(Fold):
+    """ A training fold that trains the replicas of a fused configuration side by side.
+        They read the same decoded batches, so the input pipeline runs once for all of them.
+        Each replica's results are written under its own job name and output path, as if it was trained alone.
+    """
+    info_class = _FusedFoldTrainingInfo
+
+
+    def get_validation_loss(self):
+        """ Gets the best validation loss of any replica.
+
+        Returns:
+            (float): The lowest validation loss. None if no epoch was validated.
+        """
+        if self.history is None:
+            return None
+        val_losses = [min(values) for key, values in self.history.history.items() if key.startswith('val_loss_') and values]
+        return float(min(val_losses)) if val_losses else None
+
+
+    def get_replica_history(self, index):
+        """ Gets the history of one replica, with the metric names of a single model.
+
+        Args:
+            index (int): The replica index.
+
+        Returns:
+            (keras.callbacks.History): The replica's history. None if there was no training.
+        """
+        if self.history is None:
+            return None
+        history = keras.callbacks.History()
+        history.history = {
+            key[:-len(f'_{index}')]: values for key, values in self.history.history.items() if key.endswith(f'_{index}')
+        }
+        return history
+
+
+    def output_results(self):
+        """ Output the training results of each replica to file. Each is given its share of the training time. """
+        print(colored(f"Finished training for testing subject {self.fold_info.testing_subject} and subject {self.fold_info.rotation_subject}.", 'green'))
+
+        # Only the written splits need their file paths and labels
+        datasets = {
+            dataset: {
+                'files': self.fold_info.get_files(dataset),
+                'labels': self.fold_info.get_labels(dataset),
+                'ds': self.fold_info.datasets[dataset]['ds']
+            } for dataset in self.fold_info.datasets
+        }
+        n_replicas = len(self.fold_info.replica_configs)
+        for index, (config, replica) in enumerate(zip(self.fold_info.replica_configs, self.fold_info.model.replicas)):
+            output_results(
+                os.path.join(config['output_path'], 'training_results'),
+                self.fold_info.testing_subject,
+                self.fold_info.rotation_subject,
+                self.fold_info.fold_index,
+                replica,
+                self.get_replica_history(index),
+                self.time_elapsed / n_replicas if self.time_elapsed is not None else None,
+                datasets,
+                config['class_names'],
+                config['job_name'],
+                config['selected_model_name'],
+                self.is_outer,
+                self.fold_info.rank
+            )
@@ -0,0 +1,47 @@
+from training.training_modules.training_processing.training_fold import Fold, _FoldTrainingInfo
+from training.training_modules.image_processing.feature_bank import get_feature_bank
+from training.training_modules.model_processing.model_creator import HeadTrainingModel
+
+
+class _HeadFoldTrainingInfo(_FoldTrainingInfo):
+    def __init__(self, fold_index, config, testing_subject, rotation_subject, files, folds, indexes, label_position, n_epochs, rank=None, is_outer=False):
+        """ Initializes the training fold info of a head trained on a feature bank. See _FoldTrainingInfo. """
+        super().__init__(fold_index, config, testing_subject, rotation_subject, files, folds, indexes, label_position, n_epochs, rank, is_outer)
+        self.feature_bank = None
+
+
+    def create_model(self):
+        """ Create the dense head, sized by the features of the backbone. """
+        self.feature_bank = get_feature_bank(self.config)
+        self.model = HeadTrainingModel(
+            self.config['hyperparameters'],
+            self.config['selected_model_name'],
+            self.feature_bank.get_n_features(),
+            self.config['class_names']
+        )
+
+
+
+class HeadFold(Fold):
+    """ A training fold that only trains the dense head of a model, on the pooled features of a frozen backbone.
+        The features are read from the feature bank, which runs the backbone once per image for every fold and trial.
+    """
+    info_class = _HeadFoldTrainingInfo
+
+
+    def get_shard_cache(self):
+        """ Gets the feature bank to read the features from.
+
+        Returns:
+            (FeatureBank): The feature bank.
+        """
+        return self.fold_info.feature_bank
+
+
+    def get_item_bytes(self):
+        """ Gets the size of one feature vector, for the dataset cache budget.
+
+        Returns:
+            (int): The size in bytes.
+        """
+        return self.fold_info.feature_bank.get_n_features() * 4
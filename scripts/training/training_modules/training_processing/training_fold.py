@@ -1,12 +1,16 @@
 from training.training_modules.output_processing.result_outputter import output_results
-from training.training_modules.model_processing.model_creator import TrainingModel
+from training.training_modules.model_processing.model_creator import TrainingModel, get_training_model
 from training.training_modules.image_processing.image_parser import *
+from training.training_modules.image_processing.shard_cache import SubjectShardCache
+from training.training_modules.image_processing.dataset_cache import DatasetCache
 from training.training_checkpointing_logging.checkpointer import *
 from training.training_checkpointing_logging.logger import *
+from training.training_checkpointing_logging.resume_state import ResumeState, ResumeCheckpointer
 from termcolor import colored
 from time import perf_counter
 from tensorflow import keras
 import tensorflow as tf
+import numpy as np
 import fasteners
 from pathlib import Path
 import datetime
@@ -21,18 +25,18 @@ class _FoldTrainingInfo():
             config (dict): The training configuration.
             test_subject (str): The test subject name.
             rotation_subject (str): The rotation subject name.
-            files (list of str): A list of filepaths to images.
+            files (np.ndarray of str): The table of filepaths to images, shared by every fold.
             folds (list of dict): A list of fold partitions
-            indexes (dict of lists): A list of true indexes.
+            indexes (dict of arrays): The class and subject indexes of each file.
             label_position (int): Location in the filename of the label.
             
             rank (int): An optional value of some MPI rank. Default is none. (Optional)
             is_outer (bool): If this is of the outer loop. Default is none. (Optional)
         """ 
         self.datasets = {
-            'testing':    {'files': [], 'indexes': [], 'labels': [], 'ds': None},
-            'training':   {'files': [], 'indexes': [], 'labels': [], 'ds': None},
-            'validation': {'files': [], 'indexes': [], 'labels': [], 'ds': None}
+            'testing':    {'indexes': np.zeros(0, dtype=np.int64), 'ds': None},
+            'training':   {'indexes': np.zeros(0, dtype=np.int64), 'ds': None},
+            'validation': {'indexes': np.zeros(0, dtype=np.int64), 'ds': None}
         }
         self.testing_subject = testing_subject
         self.rotation_subject = rotation_subject
@@ -50,6 +54,8 @@ class _FoldTrainingInfo():
         self.model = None
         self.callbacks = None
         self.checkpoint_name = None
+        self.resume_state = None
+        self.checkpoints = None
         
         # If MPI, specify the job name by task
         if self.rank:
@@ -66,42 +72,71 @@ class _FoldTrainingInfo():
         
     def get_dataset_info(self):
         """ Get the basic data to create the datasets from.
-            This includes the testing and rotation_subjects, file paths,
-            label indexes, and labels.
+            Each dataset is an array of indexes into the shared file table,
+            gathered from the file ranges of its subjects.
         """
-        # Loop through all image files and determine which dataset they belong to
-        for index, file_path in enumerate(self.files):            
-            dataset = ''
-            subject_name = self.indexes['subjects'][index]
+        subject_list = self.config['subject_list']
+        
+        # Outer loop
+        if self.is_outer:
+            split_subjects = {
+                'testing': [self.testing_subject],
+                'training': [s for s in subject_list if s != self.testing_subject]
+            }
             
-            # Outer loop
-            if self.is_outer:
-                if subject_name == self.testing_subject:
-                    dataset = 'testing'
-                elif subject_name in self.config['subject_list']:
-                    dataset = 'training'
-                else:
-                    continue
-                
-            # Inner loop
-            else:
-                if subject_name == self.testing_subject:
-                    dataset = 'testing'
-                elif subject_name == self.rotation_subject:
-                    dataset = 'validation'
-                elif subject_name in self.config['subject_list']:
-                    dataset = 'training'
-                else:
-                    continue
-                
-            # Append dataset item
-            self.datasets[dataset]['files'].append(file_path)
-            self.datasets[dataset]['indexes'].append(index)
-            self.datasets[dataset]['labels'].append(self.indexes['labels'][index])
+        # Inner loop
+        else:
+            split_subjects = {
+                'testing': [self.testing_subject],
+                'validation': [self.rotation_subject] if self.rotation_subject != self.testing_subject else [],
+                'training': [s for s in subject_list if s not in (self.testing_subject, self.rotation_subject)]
+            }
+        
+        # Gather the file ranges of each subject, keeping the original file order
+        order = self.indexes['subject_order']
+        offsets = self.indexes['subject_offsets']
+        for dataset, subjects in split_subjects.items():
+            ranges = [order[offsets[i]:offsets[i + 1]] for i, s in enumerate(subject_list) if s in subjects]
+            if ranges:
+                self.datasets[dataset]['indexes'] = np.sort(np.concatenate(ranges))
+            
+            
+    def get_files(self, dataset):
+        """ Gets the file paths of a dataset.
+
+        Args:
+            dataset (str): The dataset name. Either training, validation, or testing.
+
+        Returns:
+            (np.ndarray of str): The file paths.
+        """
+        return self.files[self.datasets[dataset]['indexes']]
+    
+    
+    def get_labels(self, dataset):
+        """ Gets the label indexes of a dataset.
+
+        Args:
+            dataset (str): The dataset name. Either training, validation, or testing.
+
+        Returns:
+            (np.ndarray of int): The label indexes.
+        """
+        return self.indexes['idx'][self.datasets[dataset]['indexes']]
             
             
     def create_model(self):  
-        """ Create the initial model for training. """
+        """ Create the initial model for training. Reuse the model of a previous fold, if configured. """
+        if self.config.get('reuse_models', False):
+            self.model = get_training_model(
+                self.config['hyperparameters'],
+                self.config['selected_model_name'], 
+                self.config['target_height'], 
+                self.config['target_width'], 
+                self.config['class_names'],
+                self.config['seed']
+            )
+            return
         self.model = TrainingModel(
             self.config['hyperparameters'],
             self.config['selected_model_name'], 
@@ -122,16 +157,46 @@ class _FoldTrainingInfo():
             self.checkpoint_prefix = f"{self.config['job_name']}_test_{self.testing_subject}_val_{self.rotation_subject}_config_{self.config['selected_model_name']}"
            
             
-        # Training checkpoints
-        checkpoints = Checkpointer(
-            self.n_epochs,
-            self.config['k_epoch_checkpoint_frequency'], 
-            self.checkpoint_prefix, 
-            self.rank,
-            os.path.join(self.config['output_path'], 'checkpoints')
-        )
+        # Training checkpoints. Save the step-level resumable state, or write them from a background thread, if configured.
+        if 'resume_checkpoint' in self.config:
+            self.resume_state = ResumeState(
+                os.path.join(self.config['output_path'], 'checkpoints', self.checkpoint_prefix),
+                self.model.model
+            )
+            checkpoints = ResumeCheckpointer(
+                self.resume_state,
+                self.n_epochs,
+                self.config['resume_checkpoint'].get('save_seconds', 600),
+                self.config['resume_checkpoint'].get('save_steps', None)
+            )
+        elif 'async_checkpoint' in self.config:
+            checkpoints = AsyncCheckpointer(
+                self.n_epochs,
+                self.config['k_epoch_checkpoint_frequency'], 
+                self.checkpoint_prefix, 
+                self.rank,
+                os.path.join(self.config['output_path'], 'checkpoints'),
+                self.config['async_checkpoint'].get('queue_size', 2),
+                self.config['async_checkpoint'].get('max_overhead', 0.05)
+            )
+        else:
+            checkpoints = Checkpointer(
+                self.n_epochs,
+                self.config['k_epoch_checkpoint_frequency'], 
+                self.checkpoint_prefix, 
+                self.rank,
+                os.path.join(self.config['output_path'], 'checkpoints')
+            )
+        
+        self.checkpoints = checkpoints
         
-        step_lr_logger = StepLearningRateLogger()
+        # Sample the step metrics and learning rate into a per-fold file
+        telemetry = self.config.get('telemetry', {})
+        step_lr_logger = StepTelemetryLogger(
+            os.path.join(self.config['output_path'], 'telemetry', f"{self.checkpoint_prefix}_telemetry.csv"),
+            telemetry.get('sample_steps', 50),
+            telemetry.get('console_seconds', 30)
+        )
         
         # Early stopping
         if not self.is_outer:
@@ -147,6 +212,10 @@ class _FoldTrainingInfo():
 
 
 class Fold():
+    # The fold info class, which builds the model and callbacks
+    info_class = _FoldTrainingInfo
+
+
     def __init__(self, fold_index, config, testing_subject, rotation_subject, files, folds, indexes, label_position, n_epochs, rank=None, is_outer=False):
         """ Initializes a training fold object.
 
@@ -155,15 +224,15 @@ class Fold():
             config (dict): The training configuration.
             test_subject (str): The test subject name.
             rotation_subject (str): The rotation_subject name.
-            files (list of str): A list of filepaths to images.
+            files (np.ndarray of str): The table of filepaths to images, shared by every fold.
             folds (list of dict): A list of fold partitionss
-            indexes (dict of lists): A list of true indexes.
+            indexes (dict of arrays): The class and subject indexes of each file.
             label_position (int): Location in the filename of the label.
             
             rank (int): An optional value of some MPI rank. Default is none. (Optional)
             is_outer (bool): If this is of the outer loop. Default is none. (Optional)
         """ 
-        self.fold_info = _FoldTrainingInfo(
+        self.fold_info = self.info_class(
             fold_index, 
             config, 
             testing_subject, 
@@ -178,7 +247,9 @@ class Fold():
         )
         self.history = None
         self.time_elapsed = None
+        self.dataset_cache = None
         self.checkpoint_epoch = 0
+        self.checkpoint_step = 0
         self.rank = rank
         self.is_outer = is_outer
         
@@ -188,65 +259,127 @@ class Fold():
             Training itself depends on the state of the training fold.
             It checks for insufficient dataset.
         """
-        # Load in the previously saved fold info. Check if valid. If so, use it.
-        prev_info = self.load_state()
-        # prev_info = None
-        if prev_info is not None and \
-        self.fold_info.testing_subject == prev_info.testing_subject and \
-        self.fold_info.rotation_subject == prev_info.rotation_subject:
-            self.fold_info = prev_info
+        # Load in the previously saved fold state. Check if valid. If so, rebuild the fold info and resume from its checkpoint.
+        prev_state = self.load_state()
+        self.fold_info.run_all_steps()
+        if prev_state is not None and \
+        self.fold_info.testing_subject == prev_state['testing_subject'] and \
+        self.fold_info.rotation_subject == prev_state['rotation_subject']:
             self.load_checkpoint()
-            # Conditional if there is no checkpoint
             
             print(colored("Loaded previous existing state for testing subject " + 
-                          f"{prev_info.testing_subject} and subject {prev_info.rotation_subject}.", 'cyan'))
+                          f"{prev_state['testing_subject']} and subject {prev_state['rotation_subject']}.", 'cyan'))
 
-        # Compute everything if no checkpoint
+        # Save the state if there is none
         else:
-            self.fold_info.run_all_steps()
             self.save_state()
             
         # Create the datasets and train. (Datasets cannot be logged.)
         if self.create_dataset():
             self.train_model()
             self.output_results()
+            self.dataset_cache.report()
+        self.dataset_cache.cleanup()
+        
+    
+    def get_validation_loss(self):
+        """ Gets the best validation loss of the training.
+
+        Returns:
+            (float): The lowest validation loss. None if no epoch was validated.
+        """
+        if self.history is None or not self.history.history.get('val_loss'):
+            return None
+        return float(min(self.history.history['val_loss']))
         
     
     def load_state(self):
-        """ Loads the latest training state. """
+        """ Loads the latest training state.
+
+        Returns:
+            (dict): The identifiers of the logged fold. None if there is no state.
+        """
         log = read_log_items(
             self.fold_info.config['output_path'],
             self.fold_info.config['job_name'], 
-            ['fold_info']
+            ['fold_state', 'fold_info']
         )
-        if log is None or 'fold_info' not in log:
+        if log is None:
             return None
-        return log['fold_info']
+        if 'fold_state' in log:
+            return log['fold_state']
+        
+        # Older logs stored the whole fold info
+        if 'fold_info' in log:
+            return {'testing_subject': log['fold_info'].testing_subject, 'rotation_subject': log['fold_info'].rotation_subject}
+        return None
             
     
     def save_state(self):
-        """ Saves the state of the fold to a log. """
+        """ Saves the identifiers of the fold to a log. Everything else is rebuilt from the configuration. """
         write_log(
             self.fold_info.config['output_path'], 
             self.fold_info.config['job_name'], 
-            {'fold_info': self.fold_info},
+            {'fold_state': {
+                'fold_index': self.fold_info.fold_index,
+                'testing_subject': self.fold_info.testing_subject,
+                'rotation_subject': self.fold_info.rotation_subject,
+                'checkpoint_prefix': self.fold_info.checkpoint_prefix
+            }},
             use_lock=self.fold_info.rank!=None
         )
     
     
     def load_checkpoint(self):
         """ Loads the latest checkpoint to start from. """
+        # The resumable state also gives the step within the epoch
+        if self.fold_info.resume_state is not None:
+            results = self.fold_info.resume_state.restore()
+            if results is not None:
+                print(colored(f"Loaded the training state of epoch {results[0]+1}, step {results[1]}.", 'cyan'))
+                self.checkpoint_epoch, self.checkpoint_step = results
+                self.fold_info.checkpoints.step_offset = self.checkpoint_step
+            return
+        
         results = get_most_recent_checkpoint(
             os.path.join(self.fold_info.config['output_path'], 'checkpoints'),
-            self.fold_info.checkpoint_prefix
+            self.fold_info.checkpoint_prefix,
+            model=self.fold_info.model.model
         )
         if results is not None:
             print(colored(f"Loaded most recent checkpoint of epoch: {results[1]}.", 'cyan'))
             self.fold_info.model.model = results[0]
             self.checkpoint_epoch = results[1]
-        else:
-            # Create model if not checkpoint
-            self.fold_info.create_model()
+        
+        
+    def get_shard_cache(self):
+        """ Gets the store of decoded subject shards to read the images from.
+
+        Returns:
+            (SubjectShardCache): The shard cache. None if the images are decoded from their files.
+        """
+        if 'shard_cache_directory' not in self.fold_info.config:
+            return None
+        return SubjectShardCache(
+            self.fold_info.config['shard_cache_directory'],
+            self.fold_info.config['data_input_directory'],
+            self.fold_info.config['hyperparameters']['channels'],
+            self.fold_info.config['hyperparameters']['do_cropping'],
+            self.fold_info.config['hyperparameters']['cropping_position'][0],
+            self.fold_info.config['hyperparameters']['cropping_position'][1],
+            self.fold_info.config['target_height'],
+            self.fold_info.config['target_width']
+        )
+        
+        
+    def get_item_bytes(self):
+        """ Gets the size of one decoded image, for the dataset cache budget.
+
+        Returns:
+            (int): The size in bytes.
+        """
+        return self.fold_info.config['target_height'] * self.fold_info.config['target_width'] * \
+               self.fold_info.config['hyperparameters']['channels'] * 4
         
         
     def create_dataset(self):
@@ -254,10 +387,18 @@ class Fold():
             It will map the image paths into their respective image and label pairs.
             TODO Complete any image-reading changes here for different file types.
         """
+        # The decoded subject shards are shared between every fold using the same images
+        shard_cache = self.get_shard_cache()
+        
+        # Cache and prefetch the datasets, if configured
+        self.dataset_cache = DatasetCache(self.fold_info.config.get('dataset_cache', {}), self.fold_info.checkpoint_prefix)
+        item_bytes = self.get_item_bytes()
+        
         # Get the datasets for each phase
         for dataset in self.fold_info.datasets:
-            if not self.fold_info.datasets[dataset]['files']:
+            if not len(self.fold_info.datasets[dataset]['indexes']):
                 continue
+            files = self.fold_info.get_files(dataset)
             
             # Create the special image type readers
             csvreader = ImageReaderCSV(configs=self.fold_info.config)
@@ -267,7 +408,7 @@ class Fold():
             b_drop_remainder = False 
             
             if dataset == "training":
-                residual = len(self.fold_info.datasets[dataset]['files']) % self.fold_info.config['hyperparameters']['batch_size']
+                residual = len(files) % self.fold_info.config['hyperparameters']['batch_size']
                 print("Residual for Batch training  =", residual)
                 
                 if residual < (self.fold_info.config['hyperparameters']['batch_size']/2):
@@ -279,45 +420,70 @@ class Fold():
             
             # ds = tf.data.Dataset.from_tensor_slices(self.fold_info.datasets[dataset]['files'])
             
+            # Read the images from the decoded subject shards, if a shard cache is given
+            if shard_cache is not None:
+                file_indexes = self.fold_info.datasets[dataset]['indexes']
+                ds_map = shard_cache.create_dataset(
+                    files.tolist(),
+                    [self.fold_info.config['subject_list'][i] for i in self.fold_info.indexes['subject_idx'][file_indexes]],
+                    self.fold_info.get_labels(dataset)
+                )
             
-            # Parse images here
-            ds = tf.data.Dataset.from_tensor_slices(self.fold_info.datasets[dataset]['files'])
+            # Read converted volumes as memory-mapped views
+            elif np.char.endswith(files.astype(str), '.npy').any():
+                if not np.char.endswith(files.astype(str), '.npy').all():
+                    raise ValueError(colored("Error: The input data mixes .npy volumes with other files. Convert every volume first.", 'red'))
+                ds_map = ImageReaderNpy().create_dataset(
+                    files.tolist(),
+                    self.fold_info.get_labels(dataset),
+                    self.fold_info.config['hyperparameters']['do_cropping'],
+                    self.fold_info.config['hyperparameters']['cropping_position'][0],
+                    self.fold_info.config['hyperparameters']['cropping_position'][1],
+                    self.fold_info.config['target_height'],
+                    self.fold_info.config['target_width']
+                )
+            
+            # Parse images here, otherwise
+            else:
+                ds = tf.data.Dataset.from_tensor_slices(files)
 
-            # Eager mode
-            # ds_map = ds.map(lambda x: tf.py_function(
-            #     func=parse_image,
-            #     inp=[
-            #         x,                                                                 # Filename
-            #         self.fold_info.config['class_names'],                              # Class Names
-            #         self.fold_info.config['hyperparameters']['channels'],              # Channels
-            #         self.fold_info.config['hyperparameters']['do_cropping'],           # Do Cropping
-            #         self.fold_info.config['hyperparameters']['cropping_position'][0],  # Offset Height
-            #         self.fold_info.config['hyperparameters']['cropping_position'][1],  # Offset Width
-            #         self.fold_info.config['target_height'],                            # Target Height
-            #         self.fold_info.config['target_width'],                             # Target Width
-            #         self.fold_info.label_position,                                     # Label Position
-            #     ],
-            #     Tout=[tf.float32, tf.int64]                
-            # ))
+                # Eager mode
+                # ds_map = ds.map(lambda x: tf.py_function(
+                #     func=parse_image,
+                #     inp=[
+                #         x,                                                                 # Filename
+                #         self.fold_info.config['class_names'],                              # Class Names
+                #         self.fold_info.config['hyperparameters']['channels'],              # Channels
+                #         self.fold_info.config['hyperparameters']['do_cropping'],           # Do Cropping
+                #         self.fold_info.config['hyperparameters']['cropping_position'][0],  # Offset Height
+                #         self.fold_info.config['hyperparameters']['cropping_position'][1],  # Offset Width
+                #         self.fold_info.config['target_height'],                            # Target Height
+                #         self.fold_info.config['target_width'],                             # Target Width
+                #         self.fold_info.label_position,                                     # Label Position
+                #     ],
+                #     Tout=[tf.float32, tf.int64]                
+                # ))
             
-            # Non eager version
-            ds_map =ds.map(lambda x: parse_image(
-                        x,                                                                 # Filename
-                        self.fold_info.config['class_names'],                              # Class Names
-                        self.fold_info.config['hyperparameters']['channels'],              # Channels
-                        self.fold_info.config['hyperparameters']['do_cropping'],           # Do Cropping
-                        self.fold_info.config['hyperparameters']['cropping_position'][0],  # Offset Height
-                        self.fold_info.config['hyperparameters']['cropping_position'][1],  # Offset Width
-                        self.fold_info.config['target_height'],                            # Target Height
-                        self.fold_info.config['target_width'],                             # Target Width
-                        self.fold_info.label_position
-                        ),
-                        num_parallel_calls=tf.data.AUTOTUNE,
-                        deterministic=True )
+                # Non eager version
+                ds_map =ds.map(lambda x: parse_image(
+                            x,                                                                 # Filename
+                            self.fold_info.config['class_names'],                              # Class Names
+                            self.fold_info.config['hyperparameters']['channels'],              # Channels
+                            self.fold_info.config['hyperparameters']['do_cropping'],           # Do Cropping
+                            self.fold_info.config['hyperparameters']['cropping_position'][0],  # Offset Height
+                            self.fold_info.config['hyperparameters']['cropping_position'][1],  # Offset Width
+                            self.fold_info.config['target_height'],                            # Target Height
+                            self.fold_info.config['target_width'],                             # Target Width
+                            self.fold_info.label_position
+                            ),
+                            num_parallel_calls=tf.data.AUTOTUNE,
+                            deterministic=True )
             
-             
+            # Cache the decoded images, so they are not decoded again every epoch
+            ds_map = self.dataset_cache.cache(dataset, ds_map, len(files), item_bytes)
                       
-            self.fold_info.datasets[dataset]['ds'] = ds_map.batch(self.fold_info.config['hyperparameters']['batch_size'], drop_remainder=b_drop_remainder)
+            ds_batch = ds_map.batch(self.fold_info.config['hyperparameters']['batch_size'], drop_remainder=b_drop_remainder)
+            self.fold_info.datasets[dataset]['ds'] = self.dataset_cache.prefetch(ds_batch)
             
         # If the datasets are empty, cannot train
         if self.fold_info.datasets['training']['ds'] is None or \
@@ -334,7 +500,7 @@ class Fold():
     def train_model(self):
         """ Train the model, assuming the given dataset is valid. """  
         if self.checkpoint_epoch != 0 and \
-           self.checkpoint_epoch == self.fold_info.n_epochs:
+           self.checkpoint_epoch >= self.fold_info.n_epochs:
             print(colored("Maximum number of epochs reached from checkpoint.", 'yellow'))
             return
         
@@ -367,13 +533,40 @@ class Fold():
         print("tf.executing_eagerly() =", tf.executing_eagerly())
             
         time_start = perf_counter()
-        self.history = self.fold_info.model.model.fit(
-            self.fold_info.datasets['training']['ds'],
-            validation_data=validation_data,
-            epochs=self.fold_info.n_epochs,
-            initial_epoch=self.checkpoint_epoch,
-            callbacks=[self.fold_info.callbacks]
-        )
+        
+        # The step telemetry reports progress, so Keras only prints each epoch instead of syncing every step for a progress bar
+        verbose = 2
+        
+        # Finish a partly trained epoch first, skipping the steps that were already done
+        initial_epoch = self.checkpoint_epoch
+        partial_history = None
+        if self.checkpoint_step:
+            partial_history = self.fold_info.model.model.fit(
+                self.fold_info.datasets['training']['ds'].skip(self.checkpoint_step),
+                validation_data=validation_data,
+                epochs=initial_epoch+1,
+                initial_epoch=initial_epoch,
+                callbacks=[self.fold_info.callbacks],
+                verbose=verbose
+            )
+            initial_epoch += 1
+        
+        if initial_epoch < self.fold_info.n_epochs:
+            self.history = self.fold_info.model.model.fit(
+                self.fold_info.datasets['training']['ds'],
+                validation_data=validation_data,
+                epochs=self.fold_info.n_epochs,
+                initial_epoch=initial_epoch,
+                callbacks=[self.fold_info.callbacks],
+                verbose=verbose
+            )
+            
+            # Keep the history of the partly trained epoch
+            if partial_history is not None:
+                for key in partial_history.history:
+                    self.history.history[key] = partial_history.history[key] + self.history.history.get(key, [])
+        else:
+            self.history = partial_history
         self.time_elapsed = perf_counter() - time_start
         
         
@@ -381,6 +574,15 @@ class Fold():
     def output_results(self):
         """ Output the training results to file. """
         print(colored(f"Finished training for testing subject {self.fold_info.testing_subject} and subject {self.fold_info.rotation_subject}.", 'green'))
+        
+        # Only the written splits need their file paths and labels
+        datasets = {
+            dataset: {
+                'files': self.fold_info.get_files(dataset),
+                'labels': self.fold_info.get_labels(dataset),
+                'ds': self.fold_info.datasets[dataset]['ds']
+            } for dataset in self.fold_info.datasets
+        }
         output_results(
             os.path.join(self.fold_info.config['output_path'], 'training_results'), 
             self.fold_info.testing_subject, 
@@ -389,7 +591,7 @@ class Fold():
             self.fold_info.model, 
             self.history, 
             self.time_elapsed, 
-            self.fold_info.datasets, 
+            datasets, 
             self.fold_info.config['class_names'],
             self.fold_info.config['job_name'],
             self.fold_info.config['selected_model_name'],
@@ -1,4 +1,6 @@
 from training.training_modules.training_processing.training_fold import Fold
+from training.training_modules.training_processing.fused_fold import FusedFold
+from training.training_modules.training_processing.head_fold import HeadFold
 from training.training_checkpointing_logging.logger import *
 from termcolor import colored
 
@@ -10,15 +12,18 @@ def training_loop(config, testing_subject, files, folds, rotations, indexes, lab
         config (dict): The input configuration.
         
         testing_subject (str): The name of the testing subject.
-        files (list of str): A list of filepaths to images.
+        files (np.ndarray of str): The table of filepaths to images, shared by every fold.
         folds (list of dict): A list of fold partitions.
         
         rotations (int): the number of rotations to perform.
-        indexes (dict of lists): A list of true indexes.
+        indexes (dict of arrays): The class and subject indexes of each file.
         label_position (int): Location in the filename of the label.
         
         is_outer (bool): If this is of the outer loop. Default is false. (Optional)
         rank (int): The process rank. Default is none. (Optional)
+        
+    Returns:
+        (list of float): The validation loss of each trained fold. None for folds without one.
     """
     print(colored(f'Beginning the training loop for {testing_subject}.', 'green'))
        
@@ -37,6 +42,7 @@ def training_loop(config, testing_subject, files, folds, rotations, indexes, lab
         print(colored(f'Starting off from rotation {rotation+1} for testing subject {testing_subject}.', 'cyan'))
     
     # Train for every rotation specified
+    val_losses = []
     for rot in range(rotation, rotations):
         if is_outer:
             rotation_subject = folds[rot]['training'][0]
@@ -47,9 +53,17 @@ def training_loop(config, testing_subject, files, folds, rotations, indexes, lab
             rotation_subject = folds[rot]['validation'][0]
             print(colored(f'--- Rotation {rot+1}/{rotations} for test subject {testing_subject} and val subject {rotation_subject} ---', 'magenta'))
         
-        # Create and run the training fold for this subject pair
-        training_fold = Fold(rot, config, testing_subject, rotation_subject, files, folds, indexes, label_position, n_epochs, rank, is_outer)
+        # Create and run the training fold for this subject pair. Fused configurations train their replicas together,
+        # and those with a feature bank only train the head.
+        if 'fused_configs' in config:
+            fold_class = FusedFold
+        elif 'feature_bank' in config:
+            fold_class = HeadFold
+        else:
+            fold_class = Fold
+        training_fold = fold_class(rot, config, testing_subject, rotation_subject, files, folds, indexes, label_position, n_epochs, rank, is_outer)
         training_fold.run_all_steps()
+        val_losses.append(training_fold.get_validation_loss())
         
         # Write the index to log
         if not log_rotations:
@@ -67,3 +81,4 @@ def training_loop(config, testing_subject, files, folds, rotations, indexes, lab
             {'current_rotation': rotation_dict},
             use_lock=rank!=None
         )
+    return val_losses
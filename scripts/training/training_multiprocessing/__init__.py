@@ -1,7 +1,15 @@
-from . import loop_inner, loop_outer, mpi_init, mpi_processing
+from . import loop_inner, loop_outer, hierarchical_dispatch, mpi_init, mpi_processing, mpi_worker, placement, pool_processing, task_affinity, task_ledger, task_runner, work_queue
 __all__ = [
     'loop_inner', 
-    'loop_outer'
+    'loop_outer',
+    'hierarchical_dispatch',
     'mpi_init',
-    'mpi_processing'
+    'mpi_processing',
+    'mpi_worker',
+    'placement',
+    'pool_processing',
+    'task_affinity',
+    'task_ledger',
+    'task_runner',
+    'work_queue'
 ]
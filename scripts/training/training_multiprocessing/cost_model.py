@@ -0,0 +1,206 @@
+from training.training_modules.data_processing.fold_generator import generate_folds
+from training.training_modules.data_processing.index_getter import get_indexes
+from training.training_modules.image_processing.image_getter import get_files
+from training.training_modules.image_processing.manifest import DatasetManifest
+from termcolor import colored
+import numpy as np
+import glob
+import re
+import os
+
+
+# The relative compute of each model for one 224x224 image, in GFLOPs. Models that are not listed count as 5.
+MODEL_WEIGHTS = {
+    "resnet_50": 4.1,
+    "resnet_VGG16": 15.5,
+    "InceptionV3": 5.7,
+    "ResNet50V2": 4.1,
+    "Xception": 8.4
+}
+
+# The result folders of the inner and outer loop, '<model>_<rotation>_test_<subject>[_val_<subject>]'
+INNER_RESULT_PATTERN = re.compile(r'^(?P<model>.+)_\d+_test_(?P<test>.+)_val_(?P<val>.+)$')
+OUTER_RESULT_PATTERN = re.compile(r'^(?P<model>.+)_\d+_test_(?P<test>.+)$')
+
+
+class CostModel:
+    def __init__(self, configs, is_outer):
+        """ Predicts the training time of each task, as its epochs × training images × the model's cost per image.
+            The cost per image is calibrated from the '_time-total.csv' and '_history.csv' results of earlier runs,
+            found within the output paths of the configurations. Until a model is calibrated, its compute relative
+            to the calibrated models is used instead. Without any results, the costs are only relative.
+
+        Args:
+            configs (list of dict): The training configurations.
+            is_outer (bool): If this is of the outer loop or not.
+        """
+        self.is_outer = is_outer
+        self.subject_counts = {}
+
+        # The seconds per unit of compute, for each model and over all models
+        self.seconds_per_unit = {}
+        self.default_seconds = None
+        self._calibrate(configs)
+
+
+    def predict(self, task):
+        """ Predicts the training time of a task.
+
+        Args:
+            task (tuple): A (config, n_epochs, test subject, validation subject) tuple.
+
+        Returns:
+            (float): The predicted seconds, or relative units if nothing was calibrated.
+        """
+        config, n_epochs, test_subject, validation_subject = task
+        units = n_epochs * self._get_training_images(config, test_subject, validation_subject) * \
+            self._get_image_units(config, config['selected_model_name'])
+
+        # A fused configuration trains each of its replicas on every batch
+        units *= len(config.get('fused_configs', [config]))
+        return units * self.seconds_per_unit.get(config['selected_model_name'], self.default_seconds or 1.0)
+
+
+    def is_calibrated(self):
+        """ Checks if predictions are in seconds.
+
+        Returns:
+            (bool): If any earlier results were found.
+        """
+        return self.default_seconds is not None
+
+
+    def _calibrate(self, configs):
+        """ Finds the seconds per unit of each model, from the results of earlier runs.
+
+        Args:
+            configs (list of dict): The training configurations.
+        """
+        pattern = OUTER_RESULT_PATTERN if self.is_outer else INNER_RESULT_PATTERN
+        seconds = {}
+        units = {}
+        searched = set()
+        for config in configs:
+            self._get_subject_counts(config)
+            results_path = os.path.join(config['output_path'], 'training_results')
+            if results_path in searched:
+                continue
+            searched.add(results_path)
+            for time_file in glob.glob(os.path.join(results_path, 'Test_subject_*', 'config_*', '*', '*_time-total.csv')):
+                match = pattern.match(os.path.basename(os.path.dirname(time_file)))
+                history_file = time_file.replace('_time-total.csv', '_history.csv')
+                if match is None or not os.path.exists(history_file):
+                    continue
+                try:
+                    elapsed = float(np.loadtxt(time_file, delimiter=',', ndmin=1)[-1])
+                    with open(history_file) as fp:
+                        n_epochs = sum(1 for _ in fp) - 1
+                except (OSError, ValueError, IndexError):
+                    continue
+                n_images = self._get_training_images(config, match['test'], None if self.is_outer else match['val'])
+                if not n_epochs or not n_images:
+                    continue
+                model = match['model']
+                seconds[model] = seconds.get(model, 0.0) + elapsed
+                units[model] = units.get(model, 0.0) + n_epochs * n_images * self._get_image_units(config, model)
+
+        for model in seconds:
+            self.seconds_per_unit[model] = seconds[model] / units[model]
+        if seconds:
+            self.default_seconds = sum(seconds.values()) / sum(units.values())
+            print(colored(f"Calibrated the task costs of {len(seconds)} models from earlier results.", 'cyan'))
+
+
+    def _get_image_units(self, config, model):
+        """ Gets the relative compute of one training image for one epoch.
+
+        Args:
+            config (dict): The training configuration.
+            model (str): The model name.
+
+        Returns:
+            (float): The compute units.
+        """
+        return MODEL_WEIGHTS.get(model, 5.0) * config['target_height'] * config['target_width'] / 224**2
+
+
+    def _get_training_images(self, config, test_subject, validation_subject):
+        """ Gets the number of training images of a fold.
+
+        Args:
+            config (dict): The training configuration.
+            test_subject (str): The test subject name.
+            validation_subject (str): The validation subject name. None for the outer loop.
+
+        Returns:
+            (int): The number of training images.
+        """
+        counts = self._get_subject_counts(config)
+        folds, _ = generate_folds(
+            config['test_subjects'],
+            None if self.is_outer else config['validation_subjects'],
+            config['subject_list'],
+            test_subject,
+            False,
+            validation_subject=validation_subject
+        )
+        return sum(counts.get(subject, 0) for subject in folds[0]['training'])
+
+
+    def _get_subject_counts(self, config):
+        """ Counts the images of each subject. Configurations with the same data share the counts.
+
+        Args:
+            config (dict): The training configuration.
+
+        Returns:
+            (dict): The number of images of each subject.
+        """
+        key = (config['data_input_directory'], config.get('manifest_path'), tuple(config['class_names']), tuple(config['subject_list']))
+        if key not in self.subject_counts:
+            if 'manifest_path' in config:
+                manifest = DatasetManifest(config['manifest_path'], config['data_input_directory'], config['class_names'], config['subject_list']).load()
+                subject_idx = manifest.get_indexes()['subject_idx']
+            else:
+                files = get_files(config['data_input_directory'], False, config['seed'])
+                subject_idx = get_indexes(files, config['class_names'], config['subject_list'])[0]['subject_idx']
+            counts = np.bincount(subject_idx, minlength=len(config['subject_list']))
+            self.subject_counts[key] = dict(zip(config['subject_list'], counts.tolist()))
+        return self.subject_counts[key]
+
+
+
+def get_cost_model(configs, is_outer):
+    """ Creates the cost model of the given configurations. Task ordering is optional, so any error only gives a warning.
+
+    Args:
+        configs (list of dict): The training configurations.
+        is_outer (bool): If this is of the outer loop or not.
+
+    Returns:
+        (CostModel): The cost model. None if it could not be created.
+    """
+    try:
+        return CostModel(configs, is_outer)
+    except Exception as e:
+        print(colored(f"Warning: The task costs could not be predicted, the tasks will be given in their original order. {e}", 'yellow'))
+        return None
+
+
+def get_makespan(costs, n_workers):
+    """ Simulates the given order of tasks on some workers, each taking the next task when it is free.
+
+    Args:
+        costs (list of float): The cost of each task, in the order they are given out.
+        n_workers (int): The number of workers.
+
+    Returns:
+        (float): The time until every task is finished.
+    """
+    if not costs or n_workers < 1:
+        return 0.0
+    finish_times = np.zeros(n_workers)
+    for cost in costs:
+        worker = np.argmin(finish_times)
+        finish_times[worker] += cost
+    return float(finish_times.max())
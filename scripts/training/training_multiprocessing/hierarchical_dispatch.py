@@ -0,0 +1,533 @@
+import datetime
+import time
+import argparse
+from collections import deque
+from termcolor import colored
+from training.training_multiprocessing.task_runner import create_run_scheduler, get_next_task, write_task_times, write_failed_tasks
+from training.training_multiprocessing.task_scheduler import TaskScheduler
+from training.training_multiprocessing.task_ledger import get_task_ledger
+from training.training_multiprocessing.placement import print_placements
+from training.training_multiprocessing.mpi_worker import MPI, TASK_TAG, HEARTBEAT_TAG, run_worker
+from util.get_config import parse_training_configs
+
+
+def parse_hierarchical():
+    """ Parses the settings of the two level dispatch. """
+    parser = argparse.ArgumentParser()
+
+    parser.add_argument("--hierarchical", action="store_true",
+                        help="Give batches of tasks to one leader process per server, which gives them to the server's processes")
+    parser.add_argument("--prefetch", type=int, default=None,
+                        help="Tasks each leader keeps beyond those running. Default is the number of training processes of its server")
+
+    # This functions allows to not produce an error when extra arguments are present
+    args = parser.parse_known_args()
+    return args[0].hierarchical, args[0].prefetch
+
+
+class _LeaderLink:
+    def __init__(self, leader_comm):
+        """ The link of a node leader to the global dispatcher, over the leaders' communicator.
+
+        Args:
+            leader_comm (MPI.Comm): The communicator of the node leaders. The global dispatcher is its rank 0.
+        """
+        self.leader_comm = leader_comm
+
+
+    def send(self, message):
+        self.leader_comm.send(message, dest=0, tag=TASK_TAG)
+
+
+    def poll(self):
+        if self.leader_comm.Iprobe(source=0, tag=TASK_TAG):
+            return self.leader_comm.recv(source=0, tag=TASK_TAG)
+        return None
+
+
+
+class _LocalLink:
+    def __init__(self):
+        """ The link of the global dispatcher's own node, within the same process. """
+        self.to_leader = deque()
+        self.to_global = deque()
+
+
+    def send(self, message):
+        self.to_global.append(message)
+
+
+    def poll(self):
+        return self.to_leader.popleft() if self.to_leader else None
+
+
+
+class NodeDispatcher:
+    def __init__(self, node_comm, link, workers, heartbeat_seconds, lease_seconds, prefetch=None):
+        """ Gives the tasks of one node to its training processes, over the node's communicator.
+            Tasks come from the global dispatcher in batches. The results, starts and lost tasks of the node are sent back
+            together as events, with how many more tasks the node wants, so the messages between nodes
+            grow with the number of nodes instead of the number of processes.
+
+        Args:
+            node_comm (MPI.Comm): The communicator of the node. This process is its rank 0.
+            link (object): The link to the global dispatcher, with send and poll.
+            workers (dict): The world rank of each training process, by its rank within the node.
+            heartbeat_seconds (float): The longest time between two messages to the global dispatcher.
+            lease_seconds (float): The time without a heartbeat before a training process is considered dead.
+            prefetch (int): The tasks kept beyond those running. Default is the number of training processes. (Optional)
+        """
+        self.node_comm = node_comm
+        self.link = link
+        self.workers = workers
+        self.heartbeat_seconds = heartbeat_seconds
+        self.lease_seconds = lease_seconds
+        self.prefetch = len(workers) if prefetch is None else prefetch
+
+        # The queued (task id, task) pairs, and the task id and start time of each running process
+        self.queue = []
+        self.running = {}
+        self.leases = {}
+        self.started = set()
+        self.waiting = []
+        self.exited = []
+        self.dead = []
+        self.events = []
+        self.stopping = False
+        self.last_report = None
+        self.last_sent = 0.0
+        self.status = MPI.Status()
+
+
+    def is_finished(self):
+        """ Checks if every training process of the node was terminated.
+
+        Returns:
+            (bool): If this dispatcher can stop.
+        """
+        return self.stopping and all(node_rank in self.exited or node_rank in self.dead for node_rank in self.workers)
+
+
+    def step(self):
+        """ Handles the messages of the node and of the global dispatcher, and gives out the queued tasks.
+
+        Returns:
+            (bool): If anything was received.
+        """
+        received = False
+
+        # The training processes ask for tasks with the result of their last, and send heartbeats
+        while self.node_comm.Iprobe(source=MPI.ANY_SOURCE, tag=MPI.ANY_TAG, status=self.status):
+            received = True
+            tag = self.status.Get_tag()
+            message = self.node_comm.recv(source=self.status.Get_source(), tag=tag)
+            if tag == HEARTBEAT_TAG:
+                if message in self.leases:
+                    self.leases[message] = time.perf_counter() + self.lease_seconds
+                    if message not in self.started:
+                        self.started.add(message)
+                        self.events.append(('started', self.running[message][0], self.workers[message]))
+                continue
+
+            node_rank, val_loss = message
+            if node_rank in self.dead:
+                self.node_comm.send(False, dest=node_rank)
+                continue
+            if node_rank in self.running:
+                task_id, start_time = self.running.pop(node_rank)
+                del self.leases[node_rank]
+                self.started.discard(node_rank)
+                self.events.append(('finished', task_id, self.workers[node_rank], val_loss, time.perf_counter() - start_time))
+            self.waiting.append(node_rank)
+
+        # The task of a process without a heartbeat is lost, the global dispatcher decides if it is given again
+        now = time.perf_counter()
+        for node_rank in [node_rank for node_rank, deadline in self.leases.items() if deadline < now]:
+            task_id, _ = self.running.pop(node_rank)
+            del self.leases[node_rank]
+            self.started.discard(node_rank)
+            self.dead.append(node_rank)
+            print(colored(f"Rank {self.workers[node_rank]} has no heartbeat. Its task is returned.", 'red'))
+            self.events.append(('lost', task_id, self.workers[node_rank]))
+
+        # The global dispatcher sends batches of tasks, asks for queued tasks back for other nodes, and stops the node
+        message = self.link.poll()
+        while message is not None:
+            received = True
+            if message[0] == 'tasks':
+                self.queue.extend(message[1])
+                self._give_tasks(now)
+            elif message[0] == 'steal':
+                n_stolen = min(message[1], len(self.queue))
+                stolen = self.queue[len(self.queue) - n_stolen:]
+                del self.queue[len(self.queue) - n_stolen:]
+                self.events.append(('returned', [task_id for task_id, _ in stolen]))
+            elif message[0] == 'stop':
+                self.stopping = True
+            message = self.link.poll()
+
+        self._give_tasks(now)
+
+        # Without live processes, the queued tasks are returned for other nodes
+        live = [node_rank for node_rank in self.workers if node_rank not in self.exited and node_rank not in self.dead]
+        if not live and self.queue:
+            self.events.append(('returned', [task_id for task_id, _ in self.queue]))
+            self.queue = []
+
+        if self.stopping:
+            for node_rank in self.waiting:
+                self.node_comm.send(False, dest=node_rank)
+                self.exited.append(node_rank)
+            self.waiting = []
+
+        # Report the events and the wanted tasks, and at least every heartbeat interval so the node is known to be alive
+        want = 0 if self.stopping else max(0, len(live) + self.prefetch - len(self.queue) - len(self.running))
+        report = (want, len(self.queue), len(self.waiting), len(live))
+        if self.events or report != self.last_report or now - self.last_sent >= self.heartbeat_seconds:
+            self.link.send({'events': self.events, 'want': want, 'queued': len(self.queue), 'idle': len(self.waiting), 'workers': len(live)})
+            self.events = []
+            self.last_report = report
+            self.last_sent = now
+        return received
+
+
+    def _give_tasks(self, now):
+        """ Gives the queued tasks to the waiting processes, before any can be taken by another node.
+
+        Args:
+            now (float): The current time.
+        """
+        while self.waiting and self.queue:
+            node_rank = self.waiting.pop(0)
+            task_id, task = self.queue.pop(0)
+            self.node_comm.send(task, dest=node_rank)
+            self.running[node_rank] = (task_id, now)
+            self.leases[node_rank] = now + self.lease_seconds
+
+
+
+class GlobalDispatcher:
+    def __init__(self, leader_comm, local_link, hosts, scheduler, ledger, cost_model, lease_seconds, max_retries):
+        """ Gives batches of tasks to the node leaders, as many as each wants. Near the end of the run, a node with idle
+            processes and no queued tasks takes half of the largest queue of another node.
+            The task results, retries and ledger are handled here as with the single level dispatch.
+
+        Args:
+            leader_comm (MPI.Comm): The communicator of the node leaders. This process is its rank 0.
+            local_link (_LocalLink): The link to this process's own node dispatcher.
+            hosts (list of str): The host of each leader.
+            scheduler (TaskScheduler): The scheduler.
+            ledger (TaskLedger): The task ledger. May be None.
+            cost_model (CostModel): The cost model. May be None.
+            lease_seconds (float): The time without a message before a leader is considered dead.
+            max_retries (int): The times a lost task is given again before it is recorded as failed.
+        """
+        self.leader_comm = leader_comm
+        self.local_link = local_link
+        self.hosts = hosts
+        self.scheduler = scheduler
+        self.ledger = ledger
+        self.cost_model = cost_model
+        self.lease_seconds = lease_seconds
+        self.max_retries = max_retries
+
+        now = time.perf_counter()
+        self.leaders = {
+            leader: {'want': 0, 'queued': 0, 'idle': 0, 'workers': None, 'deadline': now + lease_seconds}
+            for leader in range(leader_comm.Get_size())
+        }
+        self.dead = []
+        self.stopped = []
+
+        # The tasks given to the leaders by their id, and the leader that has each
+        self.tasks = {}
+        self.owners = {}
+        self.next_task_id = 0
+        self.steal_from = None
+        self.steal_for = None
+        self.retry_tasks = []
+        self.attempts = {}
+        self.failed_tasks = []
+        self.task_times = []
+        self.status = MPI.Status()
+
+
+    def is_finished(self):
+        """ Checks if every leader was stopped.
+
+        Returns:
+            (bool): If this dispatcher can stop.
+        """
+        return all(leader in self.stopped or leader in self.dead for leader in self.leaders)
+
+
+    def step(self):
+        """ Handles the messages of the leaders, and gives out tasks.
+
+        Returns:
+            (bool): If anything was received.
+        """
+        received = False
+        while True:
+            if self.local_link.to_global:
+                leader, message = 0, self.local_link.to_global.popleft()
+            elif self.leader_comm.Iprobe(source=MPI.ANY_SOURCE, tag=TASK_TAG, status=self.status):
+                leader = self.status.Get_source()
+                message = self.leader_comm.recv(source=leader, tag=TASK_TAG)
+            else:
+                break
+            received = True
+            self._handle(leader, message)
+
+        # A leader without messages is considered dead, with all of its tasks
+        now = time.perf_counter()
+        for leader, info in self.leaders.items():
+            if leader != 0 and leader not in self.dead and leader not in self.stopped and info['deadline'] < now:
+                print(colored(f"The leader of {self.hosts[leader]} sent nothing for {self.lease_seconds} seconds. Its tasks will be given again.", 'red'))
+                self.dead.append(leader)
+                for task_id in [task_id for task_id, owner in self.owners.items() if owner == leader]:
+                    self._retry(self._pop_task(task_id), f"The leader of {self.hosts[leader]} had no heartbeat", None)
+
+        self._assign()
+
+        # Stop the leaders once no task remains, or no process is left to train them
+        live = [leader for leader, info in self.leaders.items() if leader not in self.dead and info['workers'] != 0]
+        if self.is_finished():
+            return received
+        if (self.scheduler.is_finished() and not self.retry_tasks and not self.owners) or (not live and not self.owners):
+            for task in self.retry_tasks:
+                self.failed_tasks.append([task[0]['job_name'], task[2], task[3], task[1], self.attempts.get(id(task), 0), None])
+                if self.ledger is not None:
+                    self.ledger.fail(task, "No processes were left")
+            self.retry_tasks = []
+            if not self.scheduler.is_finished():
+                print(colored("Rank 0 has no processes left to train the remaining tasks.", 'red'))
+            for leader in self.leaders:
+                if leader not in self.stopped and leader not in self.dead:
+                    self._send(leader, ('stop',))
+                    self.stopped.append(leader)
+        return received
+
+
+    def _handle(self, leader, message):
+        """ Handles the report of a leader.
+
+        Args:
+            leader (int): The leader.
+            message (dict): Its events, wanted tasks, queued tasks, idle processes and live processes.
+        """
+        # A leader considered dead already had its tasks given again
+        if leader in self.dead:
+            if leader not in self.stopped:
+                print(colored(f"Rank 0 received a late message from the leader of {self.hosts[leader]}, which was considered dead. Stopping it.", 'yellow'))
+                self._send(leader, ('stop',))
+                self.stopped.append(leader)
+            return
+
+        info = self.leaders[leader]
+        info.update(want=message['want'], queued=message['queued'], idle=message['idle'], workers=message['workers'])
+        info['deadline'] = time.perf_counter() + self.lease_seconds
+        for event in message['events']:
+            if event[0] == 'returned':
+                returned = [task_id for task_id in event[1] if task_id in self.tasks]
+
+                # Stolen tasks go to the node that asked for them, other returned tasks are given first
+                if self.steal_from == leader:
+                    thief = self.steal_for
+                    self.steal_from = self.steal_for = None
+                    if returned and thief not in self.dead and thief not in self.stopped:
+                        for task_id in returned:
+                            self.owners[task_id] = thief
+                            if self.ledger is not None:
+                                self.ledger.lease(self.tasks[task_id], None, self.hosts[thief])
+                        self._send(thief, ('tasks', [(task_id, self.tasks[task_id]) for task_id in returned]))
+                        self.leaders[thief]['queued'] += len(returned)
+                        self.leaders[thief]['idle'] = max(0, self.leaders[thief]['idle'] - len(returned))
+                        continue
+                self.retry_tasks[:0] = [self._pop_task(task_id) for task_id in returned]
+                continue
+
+            task_id, rank = event[1], event[2]
+            if task_id not in self.tasks:
+                continue
+            if event[0] == 'started':
+                if self.ledger is not None:
+                    self.ledger.start(self.tasks[task_id], rank)
+            elif event[0] == 'finished':
+                task = self._pop_task(task_id)
+                val_loss, seconds = event[3], event[4]
+                if self.ledger is not None:
+                    self.ledger.finish(task, val_loss, seconds, rank)
+                self.scheduler.report(task, val_loss)
+                self.task_times.append([
+                    task[0]['job_name'], task[2], task[3], task[1],
+                    self.cost_model.predict(task) if self.cost_model is not None else None,
+                    seconds
+                ])
+            elif event[0] == 'lost':
+                self._retry(self._pop_task(task_id), f"Rank {rank} had no heartbeat", rank)
+
+
+    def _assign(self):
+        """ Gives each leader the tasks it wants, and takes queued tasks back for idle nodes when none are left. """
+        for leader, info in self.leaders.items():
+            if leader in self.dead or leader in self.stopped:
+                continue
+            batch = []
+            while len(batch) < info['want']:
+                task = get_next_task(self.scheduler, self.retry_tasks, self.ledger, self.hosts[leader])
+                if task is None:
+                    break
+                batch.append((self.next_task_id, task))
+                self.tasks[self.next_task_id] = task
+                self.owners[self.next_task_id] = leader
+                if self.ledger is not None:
+                    self.ledger.lease(task, None, self.hosts[leader])
+                self.next_task_id += 1
+            if batch:
+                self._send(leader, ('tasks', batch))
+                info['want'] -= len(batch)
+                info['queued'] += len(batch)
+                info['idle'] = max(0, info['idle'] - len(batch))
+
+            # A node whose processes are idle takes half of the largest queue of another node
+            elif info['idle'] and not info['queued'] and self.steal_from is None:
+                victims = [
+                    other for other, other_info in self.leaders.items()
+                    if other != leader and other not in self.dead and other not in self.stopped and other_info['queued']
+                ]
+                if victims:
+                    victim = max(victims, key=lambda other: self.leaders[other]['queued'])
+                    n_stolen = max(1, self.leaders[victim]['queued'] // 2)
+                    self._send(victim, ('steal', n_stolen))
+                    self.leaders[victim]['queued'] -= n_stolen
+                    self.steal_from = victim
+                    self.steal_for = leader
+
+
+    def _retry(self, task, error, rank):
+        """ Gives a lost task again, until its retries run out.
+
+        Args:
+            task (tuple): The task.
+            error (str): Why it was lost.
+            rank (int): The rank that had it. May be None.
+        """
+        self.attempts[id(task)] = self.attempts.get(id(task), 0) + 1
+        if self.attempts[id(task)] > self.max_retries:
+            print(colored(f"The task for test {task[2]}, validation {task[3]} failed {self.attempts[id(task)]} times, and will not be given again.", 'red'))
+            self.failed_tasks.append([task[0]['job_name'], task[2], task[3], task[1], self.attempts[id(task)], rank])
+            if self.ledger is not None:
+                self.ledger.fail(task, error)
+            self.scheduler.report(task, None)
+        else:
+            if self.ledger is not None:
+                self.ledger.release(task, error)
+            self.retry_tasks.append(task)
+
+
+    def _pop_task(self, task_id):
+        del self.owners[task_id]
+        return self.tasks.pop(task_id)
+
+
+    def _send(self, leader, message):
+        if leader == 0:
+            self.local_link.to_leader.append(message)
+        else:
+            self.leader_comm.send(message, dest=leader, tag=TASK_TAG)
+
+
+
+def run_hierarchical(comm, placement, placements, config_loc, is_outer, heartbeat_seconds, lease_seconds, max_retries, prefetch=None):
+    """ Runs the training with a two level dispatch. The lowest rank of each node is its leader, and does not train.
+        Rank 0 leads its own node, and gives batches of tasks to every leader. Every rank must call this.
+
+    Args:
+        comm (MPI.Comm): The communicator of all ranks.
+        placement (dict): The placement of this rank.
+        placements (list of dict): The placement of every rank, on rank 0. None on the others.
+        config_loc (str): The location of the configuration.
+        is_outer (bool): Whether this is of the outer loop.
+        heartbeat_seconds (float): The time between heartbeats.
+        lease_seconds (float): The time without a heartbeat before a process is considered dead.
+        max_retries (int): The times a lost task is given again before it is recorded as failed.
+        prefetch (int): The tasks each leader keeps beyond those running. Default is its number of processes. (Optional)
+    """
+    rank = comm.Get_rank()
+    node_comm = comm.Split_type(MPI.COMM_TYPE_SHARED, key=rank)
+    is_leader = node_comm.Get_rank() == 0
+    leader_comm = comm.Split(0 if is_leader else MPI.UNDEFINED, key=rank)
+    node_placements = node_comm.gather(placement, root=0)
+
+    # The training processes ask their node's leader for tasks
+    if not is_leader:
+        if placement['is_used']:
+            if placement['gpu'] is None:
+                print(colored(f"Warning: No GPU is available. Rank {rank} will train on the CPU.", 'yellow'))
+            run_worker(node_comm, node_comm.Get_rank(), heartbeat_seconds, is_outer, training_rank=rank)
+        node_comm.Free()
+        return
+
+    workers = {node_rank: p['rank'] for node_rank, p in enumerate(node_placements) if p['is_used']}
+    hosts = leader_comm.allgather(placement['host'])
+
+    # The other leaders only dispatch their node
+    if rank != 0:
+        dispatcher = NodeDispatcher(node_comm, _LeaderLink(leader_comm), workers, heartbeat_seconds, lease_seconds, prefetch)
+        while not dispatcher.is_finished():
+            if not dispatcher.step():
+                time.sleep(0.05)
+        print(colored(f"The leader of {placement['host']} terminated. All processes of its node are finished.", 'yellow'))
+        leader_comm.Free()
+        node_comm.Free()
+        return
+
+    # Get start time
+    start_time_name = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    start_perf = time.perf_counter()
+    print_placements(placements)
+    print(colored(f"Rank 0 leads {leader_comm.Get_size()} nodes: {', '.join(hosts)}", 'cyan'))
+
+    # Get the configurations. Without any, the leaders are stopped at once.
+    configs = parse_training_configs(config_loc)
+    if configs:
+        tasks, cost_model, scheduler = create_run_scheduler(configs, is_outer)
+    else:
+        print(colored("No configurations given.", 'yellow'))
+        tasks, cost_model, scheduler = [], None, TaskScheduler([])
+
+    # The ledger records the state of every task. Tasks it has as done are not given again.
+    ledger = get_task_ledger(tasks) if configs else None
+    predicted_makespan = scheduler.get_predicted_makespan(sum(p['is_used'] for p in placements))
+    if predicted_makespan is not None:
+        unit = "seconds" if cost_model.is_calibrated() else "relative units"
+        print(colored(f"Rank 0 predicts a makespan of {predicted_makespan:.1f} {unit}.", 'cyan'))
+
+    # Rank 0 dispatches its own node and the leaders in turn
+    local_link = _LocalLink()
+    node_dispatcher = NodeDispatcher(node_comm, local_link, workers, heartbeat_seconds, lease_seconds, prefetch)
+    global_dispatcher = GlobalDispatcher(leader_comm, local_link, hosts, scheduler, ledger, cost_model, lease_seconds, max_retries)
+    while not (node_dispatcher.is_finished() and global_dispatcher.is_finished()):
+        received = node_dispatcher.step()
+        received = global_dispatcher.step() or received
+        if not received:
+            time.sleep(0.05)
+
+    # Write the processing time, the time of each task, and the failed tasks
+    elapsed_time = time.perf_counter() - start_perf
+    if predicted_makespan is not None:
+        print(colored(f"Predicted makespan: {predicted_makespan:.1f} {unit}. Actual makespan: {elapsed_time:.1f} seconds.", 'cyan'))
+    if configs:
+        outfile = f'_TIME_MPI_OUTER_{start_time_name}.txt' if is_outer else f'_TIME_MPI_INNER_{start_time_name}.txt'
+        write_task_times("../results/training_timings", outfile, elapsed_time, global_dispatcher.task_times, predicted_makespan)
+        if global_dispatcher.failed_tasks:
+            print(colored(f"{len(global_dispatcher.failed_tasks)} tasks failed.", 'red'))
+            write_failed_tasks("../results/training_timings", outfile, global_dispatcher.failed_tasks)
+    if scheduler.affinity is not None:
+        scheduler.affinity.print_summary()
+    if ledger is not None:
+        ledger.close()
+    leader_comm.Free()
+    node_comm.Free()
+    print(colored(f'Rank {rank} terminated. All other processes are finished.', 'yellow'))
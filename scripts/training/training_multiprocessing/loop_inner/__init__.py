@@ -1,4 +1,5 @@
-from . import multiprocessed_training_inner_loop
+from . import multiprocessed_training_inner_loop, pooled_training_inner_loop
 __all__ = [
-    'multiprocessed_training_inner_loop'
+    'multiprocessed_training_inner_loop',
+    'pooled_training_inner_loop'
 ]
@@ -1,4 +1,5 @@
-from . import multiprocessed_training_outer_loop
+from . import multiprocessed_training_outer_loop, pooled_training_outer_loop
 __all__ = [
-    'multiprocessed_training_outer_loop'
+    'multiprocessed_training_outer_loop',
+    'pooled_training_outer_loop'
 ]
@@ -0,0 +1,12 @@
+from training.training_multiprocessing import pool_processing
+
+# Location of the configurations
+CONFIG_LOC = './training/training_config_files/loop_outer'
+
+# Outer loop with a local process pool
+if __name__ == "__main__":
+    """ Called when this file is run. """   
+    pool_processing.main(
+        config_loc=CONFIG_LOC, 
+        is_outer=True
+    )
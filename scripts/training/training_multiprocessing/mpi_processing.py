@@ -6,140 +6,51 @@ import sys
 from datetime import date
 import tensorflow as tf
 from termcolor import colored
-from mpi4py import MPI
-from training.training_modules.data_processing import training_preparation, fold_generator
 from training.training_modules.output_processing import console_printing
-from training.training_modules.training_processing import training_loop
+from training.training_multiprocessing.task_runner import create_run_scheduler, get_next_task, write_task_times, write_failed_tasks
+from training.training_multiprocessing.mpi_worker import MPI, HEARTBEAT_TAG, run_worker
+from training.training_multiprocessing.hierarchical_dispatch import parse_hierarchical, run_hierarchical
+from training.training_multiprocessing.placement import get_rank_placement, apply_placement, print_placements
+from training.training_multiprocessing.task_ledger import get_task_ledger
+from training.training_multiprocessing import work_queue
 from training.training_checkpointing_logging.logger import *
 from util.get_config import parse_training_configs
 import argparse
+
 # Location of the configurations
 CONFIG_LOC = './training/training_config_files'
 
-def parse_n_gpus():
+def parse_placement():
+    """ Parses the device settings of the training processes. """
     parser = argparse.ArgumentParser()
 
-    parser.add_argument("-ng", "--ngpus",
-                        help=" Number of gpus per server",
-                        required=False)
+    parser.add_argument("-ng", "--ngpus", type=int, default=None,
+                        help="Number of gpus per server. Default is the number of GPUs found on each server")
+    parser.add_argument("--ranks_per_gpu", type=int, default=1,
+                        help="Training processes that share each GPU. Processes beyond these do not train")
+    parser.add_argument('--dummy', action="store_true",
+                        help="No longer needed, processes beyond the GPUs of a server do not train")
     
     # This functions allows to not produce an error when extra arguments are present
     args = parser.parse_known_args()
-    # print("args =", args)
-    n_gpus = int(args[0].ngpus)
-    # print("n_gpus =", n_gpus)
-    
-    return n_gpus
+    if args[0].dummy:
+        print(colored("Warning: --dummy is no longer needed. Processes beyond the GPUs of a server do not train.", 'yellow'))
+    return args[0].ngpus, args[0].ranks_per_gpu
 
 
-def parse_dummy_node():
+def parse_fault_tolerance():
+    """ Parses the heartbeat and lease settings of the training processes. """
     parser = argparse.ArgumentParser()
 
-    parser.add_argument('--dummy', action="store_true")
-        
-    args = parser.parse_known_args()
+    parser.add_argument("--heartbeat_seconds", type=float, default=30,
+                        help="Time between the heartbeats of a training process")
+    parser.add_argument("--lease_seconds", type=float, default=600,
+                        help="Time without a heartbeat before a process is considered dead and its task is given again")
+    parser.add_argument("--max_retries", type=int, default=2,
+                        help="Times a task is given again before it is recorded as failed")
     
-    b_dummy = args[0].dummy
-    
-    print("b_dummy =", b_dummy)
-    
-    return b_dummy
- 
-
-def split_tasks(configs, is_outer):
-    """ Generates config-fold tuples for training.
-
-    Args:
-        configs (list of dict): List of configurations.
-        is_outer (bool): If this is of the outer loop or not.
-        
-    Returns:
-        (list tuples): A list of config-fold tuples.
-    """
-    # Create a list of (config, test subject, validation subject) tuples
-    tasks = []
-    for config in configs:
-        
-        # Generate all fold-pairs
-        test_subjects = config['test_subjects']
-        validation_subjects = None if is_outer else config['validation_subjects']
-        folds = fold_generator.generate_pairs(test_subject_list=test_subjects,
-                                              validation_subject_list=validation_subjects,
-                                              subject_list=config['subject_list'],
-                                              do_shuffle=config['shuffle_the_folds'],
-                                              param_epoch=config["hyperparameters"]['epochs'],
-                                              is_outer=is_outer)
-        print(folds)
-        # Add folds to task list
-        tasks.extend([(config, n_epochs, test_subject, validation_subject) for n_epochs, test_subject, validation_subject in folds])
-    return tasks
-        
-            
-def run_training(rank, config, n_epochs, test_subject, validation_subject, is_outer):
-    """ Run the training loop for some task.
-    Args:
-        rank (int): The rank of the process.
-        config (dict): The given training configuration for the task.
-        test_subject (str): The task's testing subject name.
-        validation_subject (str): The task's training/validation subject name. May be None.
-        is_outer (bool): If this task is of the outer loop.
-    """    
-    # Read in the log, if it exists
-    job_name = f"{config['job_name']}_test_{test_subject}" if is_outer else f"{config['job_name']}_test_{test_subject}_sub_{validation_subject}"
-    log = read_log_items(
-        config['output_path'], 
-        job_name, 
-        ['is_finished']
-    )
-    
-    # If this fold has finished training, return
-    if log and log['is_finished']:
-        return
-    
-    # Run the subject pair
-    if is_outer:
-        print(colored(f"Rank {rank} is starting training for {test_subject}.", 'green'))
-    else:
-        print(colored(f"Rank {rank} is starting training for {test_subject} and validation subject {validation_subject}.", 'green'))
-        
-    subject_loop(rank, config, is_outer, n_epochs, test_subject, validation_subject=validation_subject)
-    write_log(
-        config['output_path'], 
-        job_name, 
-        {'is_finished': True},
-        use_lock=True
-    )
-        
-        
-def subject_loop(rank, config, is_outer, n_epochs, test_subject, validation_subject=None):
-    """ Executes the training loop for the given test subject.
-
-    Args:
-        rank (int): The rank of the process.
-        config (dict): The training configuration.
-        is_outer (bool): If this task is of the outer loop.
-        test_subject (str): The task's test subject name.
-        validation_subject (str): The task's training/validation subject name. May be None. (Optional)
-    """
-    print(colored(
-        f"\n\n===========================================================\n" + 
-        f"Rank {rank} is starting training for {test_subject} in {config['selected_model_name']}\n"
-        , 'magenta'
-    ))
-    training_vars = training_preparation.TrainingVars(config, is_outer, test_subject, validation_subject=validation_subject)
-    # training_loop(config, testing_subject, files, folds, rotations, indexes, label_position, n_epochs, is_outer, rank=None)
-    training_loop.training_loop(
-        config=config, 
-        testing_subject=test_subject, 
-        files=training_vars.files, 
-        folds=training_vars.folds, 
-        rotations=training_vars.n_folds, 
-        indexes=training_vars.indexes, 
-        label_position=training_vars.label_position,
-        n_epochs=n_epochs,
-        is_outer=is_outer,
-        rank=rank
-    )
+    args = parser.parse_known_args()
+    return args[0].heartbeat_seconds, args[0].lease_seconds, args[0].max_retries
 
 
 def main(config_loc, is_outer):
@@ -150,44 +61,36 @@ def main(config_loc, is_outer):
     """
        
     # Initialize MPI
+    if MPI is None:
+        raise Exception(colored("Error: mpi4py is not installed. Install it, or use the process pool training instead.", 'red'))
     comm = MPI.COMM_WORLD
     rank = comm.Get_rank()
     n_proc = comm.Get_size()
     
-    n_gpus = parse_n_gpus()
-    b_dummy = parse_dummy_node()
+    n_gpus, ranks_per_gpu = parse_placement()
+    heartbeat_seconds, lease_seconds, max_retries = parse_fault_tolerance()
+    hierarchical, prefetch = parse_hierarchical()
     print("python location", os.path.dirname(sys.executable))
     
-    # Initalize TF, set the visible GPU to rank%2 for rank > 0
-    # tf_config = tf.compat.v1.ConfigProto()
-    if rank == 0:
-        tf.config.set_visible_devices([], 'GPU')
-    else:
-        physical_devices = tf.config.list_physical_devices('GPU')
-
-        print(colored(f'Rank {rank}', 'cyan'))
-        print("Num GPUs Available: ", len(physical_devices))
-        print("GPUs Available: ", physical_devices)        
-       
-        index_gpu = -100
-       
-        if b_dummy:
-           
-            # Assuming we discard one process
-            # Assunming # gpus 2
-            # mod number is (# gpus +1)
-            # Rank 0 Rank 1  Rank 2
-            #        0       1  
-            # Rank 3 Rank 4  Rank 5
-            # 2      0       1
-            # Rank 6 Rank 7  Rank 8 
-            # 2      0       1      
-            
-            # The value 2 will do nothing 
-            index_gpu = (rank-1) % (n_gpus+1)
-            print("index_gpu =", index_gpu)
-        else:
-            index_gpu = (rank-1) % n_gpus
+    # Place each rank on its node's devices and CPUs before TF starts. Rank 0 does not train, so it takes no GPU.
+    physical_devices = tf.config.list_physical_devices('GPU')
+    if n_gpus is None:
+        n_gpus = len(physical_devices)
+    placement = get_rank_placement(comm, n_gpus, ranks_per_gpu, node_leaders=hierarchical)
+    apply_placement(placement, physical_devices)
+    placements = comm.gather(placement, root=0)
+    
+    # With a work queue, each training rank pulls from the shared task pool on its own, as do other jobs
+    if work_queue.parse_queue_args()[0] is not None:
+        if placement['is_used']:
+            work_queue.main(config_loc, is_outer, rank)
+        comm.Barrier()
+        return
+    
+    # With many nodes, each node's leader gives out its tasks, and rank 0 only gives batches to the leaders
+    if hierarchical:
+        run_hierarchical(comm, placement, placements, config_loc, is_outer, heartbeat_seconds, lease_seconds, max_retries, prefetch)
+        return
         
     # Rank 0 initializes the program and runs the configuration loops
     if rank == 0:  
@@ -209,67 +112,156 @@ def main(config_loc, is_outer):
                 comm.send(False, dest=subrank)
             exit(-1)
         
-        # Get the tasks for each process
-        tasks = split_tasks(configs, is_outer)
-        # tasks is a list of tuples
-        # where tuple has 4 elements
-        # 0: dictionary of configuration of hyperparameters
-        # 1: number of epochs
-        # 2: test_fold
-        # 3: validation_fold
-        print("len(tasks(top3)) = ", len(tasks[:3]))
-        print("tasks(top3) = ", tasks[:3])
-
-        n_tasks = len(tasks)
+        # The scheduler decides which task to give next, and how long to train it. The longest tasks are given first.
+        tasks, cost_model, scheduler = create_run_scheduler(configs, is_outer)
+        
+        # The ledger records the state of every task. Tasks it has as done are not given again.
+        ledger = get_task_ledger(tasks)
         
         # Listen for process messages while running
         exited = []
-        # add manually when b_dummy is used 
-        # to avoid problems later
-        if b_dummy:
-            
-            # r: rank
-            # 2 GPUs
-            #       | r0 r1 r2 | r3 r4 r5 | r6 r7 r8 | r9 r10 r11 |
-            # index_gpu   0  1 |  2  0  1 |  2  0  1 |  2   0   1 |
-            #                     ^          ^          ^           
-            # ranks with index_gpu are not used
-            # r3, r6, r9 
-            
-            n_not_used_ranks = int(n_proc/(n_gpus+1) - 1)
-            
-            exited.extend([(n_gpus+1)*i for i in range(1, n_not_used_ranks+1)])
+        running = {}
+        waiting = []
+        
+        # The ranks without a device do not train
+        print_placements(placements)
+        exited.extend(p['rank'] for p in placements if p['rank'] != 0 and not p['is_used'])
             
         print("exited =", exited)
+        
+        # The predicted time of the whole run, and of each task
+        predicted_makespan = scheduler.get_predicted_makespan(n_proc - 1 - len(exited))
+        if predicted_makespan is not None:
+            unit = "seconds" if cost_model.is_calibrated() else "relative units"
+            print(colored(f"Rank 0 predicts a makespan of {predicted_makespan:.1f} {unit}.", 'cyan'))
+        task_times = []
+        start_times = {}
+
+        # The time each running process must send a heartbeat by, the tasks to give again, and the failed tasks
+        leases = {}
+        started = set()
+        dead = []
+        retry_tasks = []
+        attempts = {}
+        failed_tasks = []
+        status = MPI.Status()
 
         while True:
-            # it received rank from other processes
-            subrank = comm.recv(source=MPI.ANY_SOURCE)
+            # it received rank, and the validation loss of its last task, or a heartbeat from other processes
+            if comm.Iprobe(source=MPI.ANY_SOURCE, tag=MPI.ANY_TAG, status=status):
+                tag = status.Get_tag()
+                message = comm.recv(source=status.Get_source(), tag=tag)
+                
+                # A heartbeat extends the lease of the process's task
+                if tag == HEARTBEAT_TAG:
+                    if message in leases:
+                        leases[message] = time.perf_counter() + lease_seconds
+                        if ledger is not None and message not in started:
+                            ledger.start(running[message])
+                        started.add(message)
+                    continue
+                
+                # A process that was considered dead is released, its task was already given to another
+                subrank, val_loss = message
+                if subrank in dead:
+                    print(colored(f"Rank 0 received a late reply from rank {subrank}, which was considered dead. Terminating it.", 'yellow'))
+                    comm.send(False, dest=subrank)
+                    continue
+                
+                if subrank in running:
+                    task = running.pop(subrank)
+                    del leases[subrank]
+                    started.discard(subrank)
+                    seconds = time.perf_counter() - start_times.pop(subrank)
+                    if ledger is not None:
+                        ledger.finish(task, val_loss, seconds)
+                    scheduler.report(task, val_loss)
+                    task_times.append([
+                        task[0]['job_name'], task[2], task[3], task[1],
+                        cost_model.predict(task) if cost_model is not None else None,
+                        seconds
+                    ])
+                waiting.append(subrank)
+                
+            else:
+                # Give the tasks of processes without a heartbeat to others, until their retries run out
+                now = time.perf_counter()
+                expired = [subrank for subrank, deadline in leases.items() if deadline < now]
+                if not expired:
+                    time.sleep(0.05)
+                    continue
+                for subrank in expired:
+                    task = running.pop(subrank)
+                    del leases[subrank]
+                    started.discard(subrank)
+                    start_times.pop(subrank)
+                    dead.append(subrank)
+                    attempts[id(task)] = attempts.get(id(task), 0) + 1
+                    if attempts[id(task)] > max_retries:
+                        print(colored(f"Rank {subrank} has no heartbeat. Its task for test {task[2]}, validation {task[3]} failed {attempts[id(task)]} times, and will not be given again.", 'red'))
+                        failed_tasks.append([task[0]['job_name'], task[2], task[3], task[1], attempts[id(task)], subrank])
+                        if ledger is not None:
+                            ledger.fail(task, f"Rank {subrank} had no heartbeat")
+                        scheduler.report(task, None)
+                    else:
+                        print(colored(f"Rank {subrank} has no heartbeat. Its task for test {task[2]}, validation {task[3]} will be given again.", 'red'))
+                        if ledger is not None:
+                            ledger.release(task, f"Rank {subrank} had no heartbeat")
+                        retry_tasks.append(task)
             
-            # Send task if the process is ready
-            if tasks:
-                print(colored(f"Rank 0 is sending rank {subrank} its task {len(tasks)}/{n_tasks}.", 'green'))
-                comm.send(tasks.pop(), dest=subrank)
+            # Send tasks to the ready processes. A report may allow tasks for the others that are waiting.
+            while waiting:
+                task = get_next_task(scheduler, retry_tasks, ledger, placements[waiting[0]]['host'])
+                if task is None:
+                    break
+                subrank = waiting.pop(0)
+                print(colored(f"Rank 0 is sending rank {subrank} the task for test {task[2]}, validation {task[3]}, {task[1]} epochs.", 'green'))
+                comm.send(task, dest=subrank)
+                if ledger is not None:
+                    ledger.lease(task, subrank, placements[subrank]['host'])
+                running[subrank] = task
+                start_times[subrank] = time.perf_counter()
+                leases[subrank] = start_times[subrank] + lease_seconds
                 next_task_index += 1
                     
-            # If no task remains, terminate process
-            else:
-                print(colored(f"Rank 0 is terminating rank {subrank}, no tasks to give.", 'red'))
-                comm.send(False, dest=subrank)
-                exited += [subrank]
+            # If no task remains, terminate the waiting processes. Running tasks may still need to be given again.
+            live = [subrank for subrank in range(1, n_proc) if subrank not in exited and subrank not in dead]
+            if (scheduler.is_finished() and not retry_tasks and not running) or not live:
+                for subrank in waiting:
+                    print(colored(f"Rank 0 is terminating rank {subrank}, no tasks to give.", 'red'))
+                    comm.send(False, dest=subrank)
+                    exited += [subrank]
+                waiting = []
                 
                 # Check if any processes are left, end this process if so
-                if all(subrank in exited for subrank in range(1, n_proc)):
+                if all(subrank in exited or subrank in dead for subrank in range(1, n_proc)):
+                    
+                    # The tasks left when every process is dead are failed
+                    for task in retry_tasks:
+                        failed_tasks.append([task[0]['job_name'], task[2], task[3], task[1], attempts[id(task)], None])
+                        if ledger is not None:
+                            ledger.fail(task, "No processes were left")
+                    if ledger is not None:
+                        ledger.close()
+                    if not scheduler.is_finished():
+                        print(colored("Rank 0 has no processes left to train the remaining tasks.", 'red'))
+                    if scheduler.affinity is not None:
+                        scheduler.affinity.print_summary()
                     
                     # Get end time and print
                     print(colored(f"Rank 0 is printing the processing time.", 'red'))
                     elapsed_time = time.perf_counter() - start_perf
 
-                    if not os.path.exists("../results/training_timings"):
-                        os.makedirs("../results/training_timings")
+                    # Compare the predicted and actual times
+                    if predicted_makespan is not None:
+                        print(colored(f"Predicted makespan: {predicted_makespan:.1f} {unit}. Actual makespan: {elapsed_time:.1f} seconds.", 'cyan'))
                     outfile = f'_TIME_MPI_OUTER_{start_time_name}.txt' if is_outer else f'_TIME_MPI_INNER_{start_time_name}.txt'
-                    with open(os.path.join("../results/training_timings", outfile), 'w') as fp:
-                        fp.write(f"{elapsed_time}")
+                    write_task_times("../results/training_timings", outfile, elapsed_time, task_times, predicted_makespan)
+                    
+                    # Record the failed tasks
+                    if failed_tasks:
+                        print(colored(f"{len(failed_tasks)} tasks failed, and {len(dead)} processes died: {dead}", 'red'))
+                        write_failed_tasks("../results/training_timings", outfile, failed_tasks)
                     print(colored(f'Rank {rank} terminated. All other processes are finished.', 'yellow'))
                     break
             
@@ -278,31 +270,8 @@ def main(config_loc, is_outer):
         # tf.config.run_functions_eagerly(True)
         
         # Listen for the first task
-        print("n_gpus:", n_gpus)
-        print(f"rank: {rank}, index_gpu: {index_gpu}")
-        print("b_dummy:", b_dummy)
-        
-        if not b_dummy or ( b_dummy and index_gpu != n_gpus):
-
-            print(f"physical_devices[{index_gpu}]=", physical_devices[index_gpu])
-            tf.config.set_visible_devices(physical_devices[index_gpu], 'GPU')
-            tf.config.experimental.set_memory_growth(physical_devices[index_gpu], True)
-
-            comm.send(rank, dest=0)
+        if placement['is_used']:
+            if placement['gpu'] is None:
+                print(colored(f"Warning: No GPU is available. Rank {rank} will train on the CPU.", 'yellow'))
 
-            print(colored(f'Rank {rank} is listening for process 0.', 'cyan'))
-            task = comm.recv(source=0)
-            
-            # While there are tasks to run, train
-            while task:
-                        
-                # Training loop
-                config, n_epochs, test_subject, validation_subject = task
-                print(colored(f"rank {rank}: test {test_subject}, validation {validation_subject}", 'cyan'))         
-                
-                run_training(rank, config, n_epochs, test_subject, validation_subject, is_outer)
-                comm.send(rank, dest=0)
-                task = comm.recv(source=0)
-                
-            # Nothing more to run.
-            print(colored(f'Rank {rank} terminated. All jobs finished for this process.', 'yellow'))
+            run_worker(comm, rank, heartbeat_seconds, is_outer)
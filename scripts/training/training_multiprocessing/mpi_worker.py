@@ -0,0 +1,85 @@
+import threading
+from termcolor import colored
+from training.training_multiprocessing.task_runner import run_training
+
+# MPI is only needed when this is run with mpirun
+try:
+    from mpi4py import MPI
+except ImportError:
+    MPI = None
+
+# The message tags of the task requests and the heartbeats of training processes
+TASK_TAG = 0
+HEARTBEAT_TAG = 1
+
+
+class Heartbeat:
+    def __init__(self, comm, rank, interval):
+        """ Sends heartbeats to process 0 from a background thread while a task is trained,
+            so process 0 can tell a slow task from a dead process. Use it as a context manager around the training.
+
+        Args:
+            comm (MPI.Comm): The communicator.
+            rank (int): The rank of this process.
+            interval (float): The time between heartbeats.
+        """
+        self.comm = comm
+        self.rank = rank
+        self.interval = interval
+        self.stopped = threading.Event()
+        self.thread = None
+        
+        
+    def __enter__(self):
+        # The heartbeats are sent from another thread, which MPI must allow
+        if MPI.Query_thread() < MPI.THREAD_SERIALIZED:
+            print(colored(f"Warning: MPI does not allow threads to communicate. Rank {self.rank} will not send heartbeats.", 'yellow'))
+            return self
+        self.stopped.clear()
+        self.thread = threading.Thread(target=self._beat, daemon=True)
+        self.thread.start()
+        return self
+    
+    
+    def __exit__(self, *args):
+        # Stop before the main thread communicates again
+        if self.thread is not None:
+            self.stopped.set()
+            self.thread.join()
+            self.thread = None
+            
+            
+    def _beat(self):
+        while not self.stopped.wait(self.interval):
+            self.comm.send(self.rank, dest=0, tag=HEARTBEAT_TAG)
+
+
+def run_worker(comm, rank, heartbeat_seconds, is_outer, training_rank=None):
+    """ Asks process 0 of the communicator for tasks, and trains them until it sends False.
+
+    Args:
+        comm (MPI.Comm): The communicator of the process that gives out the tasks.
+        rank (int): The rank of this process within the communicator.
+        heartbeat_seconds (float): The time between heartbeats.
+        is_outer (bool): If this is of the outer loop.
+        training_rank (int): The rank that names this process's logs. Default is the rank. (Optional)
+    """
+    comm.send((rank, None), dest=0)
+
+    print(colored(f'Rank {training_rank or rank} is listening for its dispatcher.', 'cyan'))
+    task = comm.recv(source=0)
+    
+    # While there are tasks to run, train
+    while task:
+                
+        # Training loop
+        config, n_epochs, test_subject, validation_subject = task
+        print(colored(f"rank {training_rank or rank}: test {test_subject}, validation {validation_subject}", 'cyan'))         
+        
+        with Heartbeat(comm, rank, heartbeat_seconds):
+            val_loss = run_training(training_rank or rank, config, n_epochs, test_subject, validation_subject, is_outer)
+        comm.send((rank, val_loss), dest=0)
+        task = comm.recv(source=0)
+        
+    # Nothing more to run.
+    print(colored(f'Rank {training_rank or rank} terminated. All jobs finished for this process.', 'yellow'))
@@ -0,0 +1,139 @@
+import os
+import socket
+import tensorflow as tf
+from termcolor import colored
+
+# MPI is only needed to find the ranks of a node
+try:
+    from mpi4py import MPI
+except ImportError:
+    MPI = None
+
+
+def get_available_cpus():
+    """ Gets the CPUs this process may run on.
+
+    Returns:
+        (list of int): The CPU indexes.
+    """
+    if hasattr(os, 'sched_getaffinity'):
+        return sorted(os.sched_getaffinity(0))
+    return list(range(os.cpu_count()))
+
+
+def split_cpus(cpus, n_parts, index):
+    """ Gets one contiguous share of some CPUs. When there are fewer CPUs than parts, the parts share them.
+
+    Args:
+        cpus (list of int): The CPU indexes.
+        n_parts (int): The number of shares.
+        index (int): The index of the share.
+
+    Returns:
+        (list of int): The CPU indexes of the share.
+    """
+    return cpus[index * len(cpus) // n_parts:(index + 1) * len(cpus) // n_parts] or [cpus[index % len(cpus)]]
+
+
+def plan_placement(rank, node_ranks, cpus, n_gpus, ranks_per_gpu=1, scheduler_rank=0):
+    """ Plans the device, CPUs and TensorFlow threads of a rank, from the ranks that share its node.
+        The scheduler rank only gives out tasks, so it takes no device, and one CPU if the node has one to spare.
+        The training ranks of the node split the other CPUs, and take the GPUs in turn.
+        Ranks beyond the node's GPUs × ranks_per_gpu are left unused. Without GPUs, every training rank uses the CPU.
+
+    Args:
+        rank (int): The rank to place.
+        node_ranks (list of int): The ranks on the same node, including this one.
+        cpus (list of int): The CPUs of the node.
+        n_gpus (int): The number of GPUs of the node.
+        ranks_per_gpu (int): The training ranks that share each GPU. Default is 1. (Optional)
+        scheduler_rank (int): The rank that gives out the tasks. Default is 0. (Optional)
+
+    Returns:
+        (dict): The rank, its index among the node's training ranks ('local_index'), its GPU index ('gpu', None for the CPU),
+            its CPUs ('cpus'), its 'intra_op_threads' and 'inter_op_threads', and if it trains ('is_used').
+    """
+    trainers = [r for r in sorted(node_ranks) if r != scheduler_rank]
+    reserved = cpus[:1] if scheduler_rank in node_ranks and len(cpus) > len(trainers) else []
+    if rank == scheduler_rank:
+        return {'rank': rank, 'local_index': None, 'gpu': None, 'cpus': reserved or cpus,
+                'intra_op_threads': 1, 'inter_op_threads': 1, 'is_used': False}
+
+    free_cpus = cpus[len(reserved):]
+    used = trainers[:n_gpus * ranks_per_gpu] if n_gpus else trainers
+    if rank not in used:
+        return {'rank': rank, 'local_index': None, 'gpu': None, 'cpus': free_cpus,
+                'intra_op_threads': 1, 'inter_op_threads': 1, 'is_used': False}
+
+    index = used.index(rank)
+    rank_cpus = split_cpus(free_cpus, len(used), index)
+    return {
+        'rank': rank,
+        'local_index': index,
+        'gpu': index % n_gpus if n_gpus else None,
+        'cpus': rank_cpus,
+        'intra_op_threads': len(rank_cpus),
+        'inter_op_threads': min(2, len(rank_cpus)),
+        'is_used': True
+    }
+
+
+def get_rank_placement(comm, n_gpus, ranks_per_gpu=1, node_leaders=False):
+    """ Finds the ranks that share this rank's node, and plans its placement. Every rank must call this.
+
+    Args:
+        comm (MPI.Comm): The communicator.
+        n_gpus (int): The number of GPUs of this node.
+        ranks_per_gpu (int): The training ranks that share each GPU. Default is 1. (Optional)
+        node_leaders (bool): If the lowest rank of each node gives out its tasks, and does not train. Default is False. (Optional)
+
+    Returns:
+        (dict): The placement of this rank, with its 'host'. See plan_placement.
+    """
+    rank = comm.Get_rank()
+    node_comm = comm.Split_type(MPI.COMM_TYPE_SHARED, key=rank)
+    node_ranks = node_comm.allgather(rank)
+
+    # mpirun may bind each rank to a few CPUs, so the node's CPUs are those of all its ranks
+    cpus = sorted(set().union(*node_comm.allgather(get_available_cpus())))
+    node_comm.Free()
+    placement = plan_placement(rank, node_ranks, cpus, n_gpus, ranks_per_gpu, min(node_ranks) if node_leaders else 0)
+    placement['host'] = socket.gethostname()
+    return placement
+
+
+def apply_placement(placement, physical_devices):
+    """ Pins this process to its CPUs, shows it only its GPU, and sizes its TensorFlow thread pools.
+        This must be called before TensorFlow starts its runtime.
+
+    Args:
+        placement (dict): The placement. See plan_placement.
+        physical_devices (list): The GPUs of the node.
+    """
+    if hasattr(os, 'sched_setaffinity'):
+        os.sched_setaffinity(0, placement['cpus'])
+
+    gpu = placement['gpu']
+    if gpu is None or gpu >= len(physical_devices):
+        if gpu is not None:
+            print(colored(f"Warning: GPU {gpu} is not available. Rank {placement['rank']} will train on the CPU.", 'yellow'))
+        tf.config.set_visible_devices([], 'GPU')
+    else:
+        tf.config.set_visible_devices(physical_devices[gpu], 'GPU')
+        tf.config.experimental.set_memory_growth(physical_devices[gpu], True)
+    tf.config.threading.set_intra_op_parallelism_threads(placement['intra_op_threads'])
+    tf.config.threading.set_inter_op_parallelism_threads(placement['inter_op_threads'])
+
+
+def print_placements(placements):
+    """ Prints the placement of every rank.
+
+    Args:
+        placements (list of dict): The placement of each rank.
+    """
+    for placement in placements:
+        if placement['is_used']:
+            device = f"GPU {placement['gpu']}" if placement['gpu'] is not None else "the CPU"
+            print(colored(f"Rank {placement['rank']} trains on {device}, with CPUs {placement['cpus']} and {placement['intra_op_threads']} threads.", 'cyan'))
+        else:
+            print(colored(f"Rank {placement['rank']} does not train.", 'cyan'))
@@ -0,0 +1,251 @@
+import datetime
+import socket
+import time
+import math
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+from concurrent.futures.process import BrokenProcessPool
+import tensorflow as tf
+from termcolor import colored
+from training.training_multiprocessing.task_runner import run_training, create_run_scheduler, get_next_task, write_task_times, write_failed_tasks
+from training.training_multiprocessing.placement import get_available_cpus, plan_placement, apply_placement, print_placements
+from training.training_multiprocessing.task_ledger import get_task_ledger
+from util.get_config import parse_training_configs
+import argparse
+
+# The rank of this worker process, set when it starts
+_worker_rank = None
+
+
+def parse_pool_args():
+    """ Parses the worker settings of the process pool. """
+    parser = argparse.ArgumentParser()
+
+    parser.add_argument("-nw", "--workers", type=int, default=None,
+                        help="Number of worker processes. Default is one per given GPU, or one without GPUs")
+    parser.add_argument("--gpus", type=str, default=None,
+                        help="Comma-separated GPU indexes, given to the workers in turn. Default is none, to train on the CPU")
+    parser.add_argument("--intra_op_threads", type=int, default=None,
+                        help="TensorFlow threads within an operation. Default is the number of CPUs of the worker")
+    parser.add_argument("--inter_op_threads", type=int, default=None,
+                        help="TensorFlow operations run at once. Default is up to 2")
+    parser.add_argument("--max_retries", type=int, default=2,
+                        help="Times a failed task is run again before it is recorded as failed")
+
+    # This functions allows to not produce an error when extra arguments are present
+    args = parser.parse_known_args()[0]
+    gpus = [int(gpu) for gpu in args.gpus.split(',')] if args.gpus else []
+    n_workers = args.workers or max(len(gpus), 1)
+    return n_workers, gpus, args.intra_op_threads, args.inter_op_threads, args.max_retries
+
+
+def get_worker_placements(n_workers, gpus, intra_op_threads=None, inter_op_threads=None):
+    """ Plans the CPUs, GPU and threads of each worker, as for the ranks of one MPI node. This process is the scheduler.
+
+    Args:
+        n_workers (int): The number of worker processes.
+        gpus (list of int): The GPU indexes, given to the workers in turn. May be empty.
+        intra_op_threads (int): TensorFlow threads within an operation. Default is the worker's CPU count. (Optional)
+        inter_op_threads (int): TensorFlow operations run at once. Default is up to 2. (Optional)
+
+    Returns:
+        (list of dict): The placement of each worker. See plan_placement.
+    """
+    cpus = get_available_cpus()
+    if n_workers > len(cpus):
+        print(colored(f"Warning: There are more workers ({n_workers}) than CPUs ({len(cpus)}). Workers will share CPUs.", 'yellow'))
+    ranks = list(range(n_workers + 1))
+    ranks_per_gpu = math.ceil(n_workers / len(gpus)) if gpus else 1
+    placements = []
+    for rank in ranks[1:]:
+        placement = plan_placement(rank, ranks, cpus, len(gpus), ranks_per_gpu)
+        if placement['gpu'] is not None:
+            placement['gpu'] = gpus[placement['gpu']]
+        placement['intra_op_threads'] = intra_op_threads or placement['intra_op_threads']
+        placement['inter_op_threads'] = inter_op_threads or placement['inter_op_threads']
+        placements.append(placement)
+    return placements
+
+
+def _init_worker(placements, slots):
+    """ Places a new worker process on its CPUs and device, before TensorFlow starts its runtime.
+
+    Args:
+        placements (list of dict): The placement of each worker.
+        slots (multiprocessing.Queue): The unused worker indexes.
+    """
+    global _worker_rank
+    placement = placements[slots.get()]
+    apply_placement(placement, tf.config.list_physical_devices('GPU'))
+
+    # Ranks start from 1, as with MPI, so each task keeps its own logs
+    _worker_rank = placement['rank']
+    print_placements([placement])
+
+
+def _run_task(task, is_outer):
+    """ Runs a task within a worker process.
+
+    Args:
+        task (tuple): A (config, n_epochs, test subject, validation subject) tuple.
+        is_outer (bool): If this task is of the outer loop.
+
+    Returns:
+        (tuple): The worker's rank, and the mean validation loss of the task's folds, None if there is none.
+    """
+    config, n_epochs, test_subject, validation_subject = task
+    return _worker_rank, run_training(_worker_rank, config, n_epochs, test_subject, validation_subject, is_outer)
+
+
+def _create_executor(placements):
+    """ Starts a pool of spawned worker processes, one for each placement.
+
+    Args:
+        placements (list of dict): The placement of each worker.
+
+    Returns:
+        (ProcessPoolExecutor): The pool.
+    """
+    context = multiprocessing.get_context('spawn')
+    slots = context.Queue()
+    for slot in range(len(placements)):
+        slots.put(slot)
+    return ProcessPoolExecutor(
+        max_workers=len(placements),
+        mp_context=context,
+        initializer=_init_worker,
+        initargs=(placements, slots)
+    )
+
+
+def main(config_loc, is_outer):
+    """ Runs the training process for each configuration and test subject, with a pool of local worker processes.
+        This is an alternative to MPI for a single machine. The tasks are given out as with MPI.
+
+    Args:
+        config_loc (str): The location of the configuration.
+        is_outer (bool): Whether this is of the outer loop.
+    """
+    n_workers, gpus, intra_op_threads, inter_op_threads, max_retries = parse_pool_args()
+
+    # Get start time
+    start_time_name = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    start_perf = time.perf_counter()
+
+    # Get the configurations
+    configs = parse_training_configs(config_loc)
+    if not configs:
+        print(colored("No configurations given.", 'yellow'))
+        return
+
+    # The scheduler decides which task to give next, and how long to train it. The longest tasks are given first.
+    tasks, cost_model, scheduler = create_run_scheduler(configs, is_outer)
+
+    # The ledger records the state of every task. Tasks it has as done are not given again.
+    ledger = get_task_ledger(tasks)
+
+    predicted_makespan = scheduler.get_predicted_makespan(n_workers)
+    if predicted_makespan is not None:
+        unit = "seconds" if cost_model.is_calibrated() else "relative units"
+        print(colored(f"Predicted makespan: {predicted_makespan:.1f} {unit}.", 'cyan'))
+
+    # Start the workers
+    placements = get_worker_placements(n_workers, gpus, intra_op_threads, inter_op_threads)
+    executor = _create_executor(placements)
+    running = {}
+    retry_tasks = []
+    suspect_tasks = []
+    broken_counts = {}
+    attempts = {}
+    failed_tasks = []
+    task_times = []
+
+    while True:
+        # Give tasks to the free workers
+        while len(running) < n_workers:
+            
+            # Tasks that were running when a worker died are run alone, so a crash can be put down to one of them
+            if suspect_tasks or any(is_suspect for _, _, _, is_suspect in running.values()):
+                if running:
+                    break
+                task = suspect_tasks.pop(0)
+                is_suspect = True
+            else:
+                task = get_next_task(scheduler, retry_tasks, ledger, socket.gethostname())
+                if task is None:
+                    break
+                is_suspect = False
+            print(colored(f"Giving out the task for test {task[2]}, validation {task[3]}, {task[1]} epochs.", 'green'))
+
+            # A free worker starts the task at once, but which one is only known from its result
+            if ledger is not None:
+                ledger.lease(task, None)
+                ledger.start(task)
+            running[executor.submit(_run_task, task, is_outer)] = (task, time.perf_counter(), executor, is_suspect)
+
+        # Nothing is running and nothing can be given, so every task is finished
+        if not running:
+            break
+
+        done, _ = wait(running, return_when=FIRST_COMPLETED)
+        for future in done:
+            task, start_time, task_executor, _ = running.pop(future)
+            try:
+                worker_rank, val_loss = future.result()
+            except Exception as e:
+                if isinstance(e, BrokenProcessPool):
+                    
+                    # A dead worker breaks the whole pool, so it is started again. Its other tasks fail with it.
+                    if task_executor is executor:
+                        broken_counts[task_executor] = 1 + sum(
+                            1 for other, (_, _, other_executor, _) in running.items()
+                            if other_executor is task_executor and (not other.done() or isinstance(other.exception(), BrokenProcessPool))
+                        )
+                        executor.shutdown(wait=False)
+                        executor = _create_executor(placements)
+                        
+                    # Which of the tasks died is only known if it ran alone, so the others are not charged an attempt
+                    if broken_counts[task_executor] > 1:
+                        print(colored(f"The task for test {task[2]}, validation {task[3]} was running when a worker died, and will be run again alone.", 'yellow'))
+                        if ledger is not None:
+                            ledger.release(task, repr(e))
+                        suspect_tasks.append(task)
+                        continue
+                attempts[id(task)] = attempts.get(id(task), 0) + 1
+                if attempts[id(task)] > max_retries:
+                    print(colored(f"The task for test {task[2]}, validation {task[3]} failed {attempts[id(task)]} times, and will not be run again. {e!r}", 'red'))
+                    failed_tasks.append([task[0]['job_name'], task[2], task[3], task[1], attempts[id(task)], None])
+                    if ledger is not None:
+                        ledger.fail(task, repr(e))
+                    scheduler.report(task, None)
+                else:
+                    print(colored(f"The task for test {task[2]}, validation {task[3]} failed, and will be run again. {e!r}", 'red'))
+                    if ledger is not None:
+                        ledger.release(task, repr(e))
+                    retry_tasks.append(task)
+                continue
+
+            seconds = time.perf_counter() - start_time
+            if ledger is not None:
+                ledger.finish(task, val_loss, seconds, worker_rank)
+            scheduler.report(task, val_loss)
+            task_times.append([
+                task[0]['job_name'], task[2], task[3], task[1],
+                cost_model.predict(task) if cost_model is not None else None,
+                seconds
+            ])
+    executor.shutdown()
+    if ledger is not None:
+        ledger.close()
+    if scheduler.affinity is not None:
+        scheduler.affinity.print_summary()
+
+    # Write the processing time, the time of each task, and the failed tasks
+    elapsed_time = time.perf_counter() - start_perf
+    if predicted_makespan is not None:
+        print(colored(f"Predicted makespan: {predicted_makespan:.1f} {unit}. Actual makespan: {elapsed_time:.1f} seconds.", 'cyan'))
+    outfile = f'_TIME_POOL_OUTER_{start_time_name}.txt' if is_outer else f'_TIME_POOL_INNER_{start_time_name}.txt'
+    write_task_times("../results/training_timings", outfile, elapsed_time, task_times, predicted_makespan)
+    if failed_tasks:
+        write_failed_tasks("../results/training_timings", outfile, failed_tasks)
+    print(colored("All workers are finished.", 'yellow'))
@@ -0,0 +1,170 @@
+from training.training_modules.image_processing.shard_cache import get_shard_key
+from termcolor import colored
+import argparse
+import os
+
+
+def parse_affinity():
+    """ Parses the cache affinity settings of the task dispatch. """
+    parser = argparse.ArgumentParser()
+
+    parser.add_argument("--affinity_lookahead", type=int, default=8,
+                        help="Next tasks to choose from for the data a node read recently. 0 to give the tasks in order")
+    parser.add_argument("--affinity_window", type=int, default=4,
+                        help="Last tasks of a node whose data is considered still cached")
+    parser.add_argument("--affinity_balance", type=float, default=0.5,
+                        help="Smallest predicted time of a chosen task, as a fraction of the next task's, so long tasks are not left to the end")
+
+    # This functions allows to not produce an error when extra arguments are present
+    args = parser.parse_known_args()[0]
+    return args.affinity_lookahead, args.affinity_window, args.affinity_balance
+
+
+def get_task_data(task):
+    """ Gets the data a task reads: each of its subjects, within the images it is read from.
+        With a shard cache, these are the decoded shards, which are only shared by the same image settings,
+        and with a feature bank, the features of the same backbone.
+
+    Args:
+        task (tuple): A (config, n_epochs, test subject, validation subject) tuple.
+
+    Returns:
+        (set of tuples): The (data key, subject) pairs.
+    """
+    config, n_epochs, test_subject, validation_subject = task
+    if 'shard_cache_directory' in config or 'feature_bank' in config:
+        data_key = get_shard_key(
+            config['data_input_directory'],
+            config['hyperparameters']['channels'],
+            config['hyperparameters']['do_cropping'],
+            config['hyperparameters']['cropping_position'][0],
+            config['hyperparameters']['cropping_position'][1],
+            config['target_height'],
+            config['target_width']
+        )
+
+        # A feature bank only holds the features of one backbone
+        if 'feature_bank' in config:
+            data_key = f"{data_key}_{os.path.abspath(config['feature_bank']['backbone_checkpoint'])}"
+    else:
+        data_key = os.path.abspath(config['data_input_directory'])
+
+    # The inner loop trains on the validation subjects, and the outer loop on every subject
+    subjects = config['subject_list'] if validation_subject is None else list(config['validation_subjects']) + [test_subject]
+    return {(data_key, str(subject)) for subject in subjects}
+
+
+class AffinityTracker:
+    def __init__(self, lookahead=8, window=4, balance=0.5, cost_model=None):
+        """ Remembers the data each node read for its last few tasks, which is likely still in its page cache
+            or node-local shard cache, and chooses for a node the upcoming task that reads the most of it.
+            Only the next few tasks are considered, and with a cost model only those of at least a fraction
+            of the next task's predicted time, so the longest tasks are still given first.
+
+        Args:
+            lookahead (int): The next tasks to choose from. Default is 8. (Optional)
+            window (int): The last tasks of a node whose data is considered cached. Default is 4. (Optional)
+            balance (float): The smallest predicted time of a chosen task, as a fraction of the next task's. Default is 0.5. (Optional)
+            cost_model (CostModel): Predicts the training time of each task. Default is None. (Optional)
+        """
+        self.lookahead = lookahead
+        self.window = window
+        self.balance = balance
+        self.cost_model = cost_model
+
+        # The data of the last tasks of each node
+        self.recent = {}
+
+        # The subjects read, those read while cached, and those that would have been cached without the affinity
+        self.reads = 0
+        self.hits = 0
+        self.ordered_hits = 0
+
+
+    def choose(self, tasks, worker):
+        """ Chooses the task to give a node, from the next tasks.
+
+        Args:
+            tasks (list of tuples): The next tasks, at most the lookahead, with the next one in order last.
+            worker (str): The node that will train it.
+
+        Returns:
+            (int): The index of the chosen task.
+        """
+        cached = self._get_cached(worker)
+        best = len(tasks) - 1
+        if not cached:
+            return best
+        min_cost = self.cost_model.predict(tasks[best]) * self.balance if self.cost_model is not None else None
+        best_overlap = len(get_task_data(tasks[best]) & cached)
+        for index in range(len(tasks) - 2, -1, -1):
+            if min_cost is not None and self.cost_model.predict(tasks[index]) < min_cost:
+                continue
+            overlap = len(get_task_data(tasks[index]) & cached)
+            if overlap > best_overlap:
+                best, best_overlap = index, overlap
+        return best
+
+
+    def record(self, worker, task, ordered_task=None):
+        """ Records that a node was given a task.
+
+        Args:
+            worker (str): The node.
+            task (tuple): The task it was given.
+            ordered_task (tuple): The task it would have been given without the affinity. Default is the given task. (Optional)
+        """
+        cached = self._get_cached(worker)
+        data = get_task_data(task)
+        self.reads += len(data)
+        self.hits += len(data & cached)
+        self.ordered_hits += len(get_task_data(ordered_task or task) & cached)
+        recent = self.recent.setdefault(worker, [])
+        recent.append(data)
+        del recent[:-self.window]
+
+
+    def get_hit_rate(self):
+        """ Gets the fraction of subjects read that were likely cached.
+
+        Returns:
+            (float): The hit rate. None if nothing was read.
+        """
+        return self.hits / self.reads if self.reads else None
+
+
+    def print_summary(self):
+        """ Prints the hit rate of the given tasks, and that of giving them in order. """
+        if not self.reads:
+            return
+        print(colored(
+            f"Cache affinity: {self.hits} of {self.reads} subject reads ({self.hits / self.reads:.0%}) were of data the node read in its last {self.window} tasks. "
+            f"In order, {self.ordered_hits} ({self.ordered_hits / self.reads:.0%}) would have been.", 'cyan'
+        ))
+
+
+    def _get_cached(self, worker):
+        """ Gets the data a node read for its last tasks.
+
+        Args:
+            worker (str): The node.
+
+        Returns:
+            (set of tuples): The (data key, subject) pairs.
+        """
+        return set().union(*self.recent.get(worker, []))
+
+
+def get_affinity_tracker(cost_model=None):
+    """ Creates the affinity tracker given on the command line.
+
+    Args:
+        cost_model (CostModel): Predicts the training time of each task. Default is None. (Optional)
+
+    Returns:
+        (AffinityTracker): The tracker. None if it is turned off.
+    """
+    lookahead, window, balance = parse_affinity()
+    if lookahead < 2 or window < 1:
+        return None
+    return AffinityTracker(lookahead, window, balance, cost_model)
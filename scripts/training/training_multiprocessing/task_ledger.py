@@ -0,0 +1,222 @@
+from termcolor import colored
+import argparse
+import sqlite3
+import socket
+import time
+import os
+
+
+# The states of a task
+PENDING = 'pending'
+LEASED = 'leased'
+RUNNING = 'running'
+DONE = 'done'
+FAILED = 'failed'
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS tasks (
+    output_path TEXT NOT NULL,
+    job_name TEXT NOT NULL,
+    test_subject TEXT NOT NULL,
+    validation_subject TEXT NOT NULL,
+    n_epochs INTEGER NOT NULL,
+    state TEXT NOT NULL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    host TEXT,
+    rank INTEGER,
+    leased_at REAL,
+    started_at REAL,
+    finished_at REAL,
+    seconds REAL,
+    val_loss REAL,
+    error TEXT,
+    PRIMARY KEY (output_path, job_name, test_subject, validation_subject, n_epochs)
+)
+"""
+
+
+def parse_ledger_path():
+    """ Parses the location of the task ledger. """
+    parser = argparse.ArgumentParser()
+
+    parser.add_argument("--ledger", type=str, default="../results/training_ledger.sqlite",
+                        help="The task ledger, which a restarted run resumes from. 'none' to not keep one")
+
+    # This functions allows to not produce an error when extra arguments are present
+    args = parser.parse_known_args()
+    return None if args[0].ledger.lower() == 'none' else args[0].ledger
+
+
+def get_task_key(task):
+    """ Gets the ledger key of a task. The same fold trained for more epochs, as with ASHA, is another task.
+
+    Args:
+        task (tuple): A (config, n_epochs, test subject, validation subject) tuple.
+
+    Returns:
+        (tuple): The output path, job name, test subject, validation subject and epochs.
+    """
+    config, n_epochs, test_subject, validation_subject = task
+    return (config['output_path'], config['job_name'], str(test_subject), str(validation_subject or ''), int(n_epochs))
+
+
+class TaskLedger:
+    def __init__(self, path):
+        """ Records the state of every task in one SQLite file: pending, leased, running, done or failed,
+            with its attempts, host, rank, timing and validation loss. Only the dispatching process writes to it.
+            A restarted run reads the finished tasks with one query, instead of opening every task's logs,
+            and any task that was leased, running or failed when the run stopped is pending again.
+
+        Args:
+            path (str): The location of the ledger file.
+        """
+        self.path = path
+        if os.path.dirname(path) and not os.path.exists(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+        self.connection = sqlite3.connect(path)
+        with self.connection:
+            self.connection.execute(SCHEMA)
+            reset = self.connection.execute(
+                "UPDATE tasks SET state = ?, rank = NULL, leased_at = NULL, started_at = NULL WHERE state IN (?, ?, ?)",
+                (PENDING, LEASED, RUNNING, FAILED)
+            ).rowcount
+
+        # The validation loss of each finished task
+        self.finished = {
+            tuple(row[:5]): row[5] for row in self.connection.execute(
+                "SELECT output_path, job_name, test_subject, validation_subject, n_epochs, val_loss FROM tasks WHERE state = ?", (DONE,)
+            )
+        }
+        if self.finished or reset:
+            print(colored(f"The task ledger {path} has {len(self.finished)} finished tasks. {reset} unfinished tasks will be given again.", 'cyan'))
+
+
+    def add_tasks(self, tasks):
+        """ Adds tasks as pending. Tasks already in the ledger keep their state.
+
+        Args:
+            tasks (list of tuples): The tasks.
+        """
+        with self.connection:
+            self.connection.executemany(
+                "INSERT OR IGNORE INTO tasks (output_path, job_name, test_subject, validation_subject, n_epochs, state) VALUES (?, ?, ?, ?, ?, ?)",
+                [get_task_key(task) + (PENDING,) for task in tasks]
+            )
+
+
+    def is_done(self, task):
+        """ Checks if a task was finished, by this run or an earlier one.
+
+        Args:
+            task (tuple): The task.
+
+        Returns:
+            (bool): If the task is done.
+        """
+        return get_task_key(task) in self.finished
+
+
+    def get_val_loss(self, task):
+        """ Gets the validation loss of a finished task.
+
+        Args:
+            task (tuple): The task.
+
+        Returns:
+            (float): The validation loss. None if there is none.
+        """
+        return self.finished.get(get_task_key(task))
+
+
+    def lease(self, task, rank, host=None):
+        """ Records that a task was given to a process.
+
+        Args:
+            task (tuple): The task.
+            rank (int): The rank of the process.
+            host (str): The host of the process. Default is this host. (Optional)
+        """
+        self.add_tasks([task])
+        self._update(task, "state = ?, attempts = attempts + 1, rank = ?, host = ?, leased_at = ?, started_at = NULL, error = NULL",
+                     (LEASED, rank, host or socket.gethostname(), time.time()))
+
+
+    def start(self, task, rank=None):
+        """ Records that a process began training a task.
+
+        Args:
+            task (tuple): The task.
+            rank (int): The rank training it, if it was not known when it was leased. (Optional)
+        """
+        self._update(task, "state = ?, started_at = ?, rank = COALESCE(?, rank)", (RUNNING, time.time(), rank))
+
+
+    def finish(self, task, val_loss, seconds, rank=None):
+        """ Records that a task is done.
+
+        Args:
+            task (tuple): The task.
+            val_loss (float): The task's validation loss. May be None.
+            seconds (float): The time from giving out the task to its result.
+            rank (int): The rank that trained it, if it was not known when it was leased. (Optional)
+        """
+        self._update(task, "state = ?, finished_at = ?, seconds = ?, val_loss = ?, rank = COALESCE(?, rank)",
+                     (DONE, time.time(), seconds, val_loss, rank))
+        self.finished[get_task_key(task)] = val_loss
+
+
+    def release(self, task, error):
+        """ Records that a task will be given again.
+
+        Args:
+            task (tuple): The task.
+            error (str): Why it did not finish.
+        """
+        self._update(task, "state = ?, rank = NULL, error = ?", (PENDING, error))
+
+
+    def fail(self, task, error):
+        """ Records that a task will not be given again in this run.
+
+        Args:
+            task (tuple): The task.
+            error (str): Why it did not finish.
+        """
+        self._update(task, "state = ?, finished_at = ?, error = ?", (FAILED, time.time(), error))
+
+
+    def close(self):
+        """ Closes the ledger file. """
+        self.connection.close()
+
+
+    def _update(self, task, assignments, values):
+        """ Updates one task in its own transaction.
+
+        Args:
+            task (tuple): The task.
+            assignments (str): The SET clause.
+            values (tuple): The values of the SET clause.
+        """
+        with self.connection:
+            self.connection.execute(
+                f"UPDATE tasks SET {assignments} WHERE output_path = ? AND job_name = ? AND test_subject = ? AND validation_subject = ? AND n_epochs = ?",
+                values + get_task_key(task)
+            )
+
+
+def get_task_ledger(tasks=()):
+    """ Opens the task ledger given on the command line, and adds the known tasks.
+
+    Args:
+        tasks (list of tuples): The tasks of this run. Tasks proposed while running are added when given out. (Optional)
+
+    Returns:
+        (TaskLedger): The ledger. None if it is turned off.
+    """
+    path = parse_ledger_path()
+    if path is None:
+        return None
+    ledger = TaskLedger(path)
+    ledger.add_tasks(tasks)
+    return ledger
@@ -0,0 +1,194 @@
+from training.training_modules.data_processing import training_preparation, fold_generator
+from training.training_modules.training_processing import training_loop
+from training.training_modules.training_processing.fused_fold import fuse_configs
+from training.training_multiprocessing.task_scheduler import create_scheduler, ProposalScheduler
+from training.training_multiprocessing.cost_model import get_cost_model
+from training.training_multiprocessing.task_affinity import get_affinity_tracker
+from training.training_checkpointing_logging.logger import *
+from termcolor import colored
+import csv
+import os
+
+
+def split_tasks(configs, is_outer):
+    """ Generates config-fold tuples for training.
+
+    Args:
+        configs (list of dict): List of configurations.
+        is_outer (bool): If this is of the outer loop or not.
+        
+    Returns:
+        (list tuples): A list of config-fold tuples.
+    """
+    # Create a list of (config, test subject, validation subject) tuples. Configurations set to be fused train as one.
+    tasks = []
+    for config in fuse_configs(configs):
+        
+        # Generate all fold-pairs
+        test_subjects = config['test_subjects']
+        validation_subjects = None if is_outer else config['validation_subjects']
+        folds = fold_generator.generate_pairs(test_subject_list=test_subjects,
+                                              validation_subject_list=validation_subjects,
+                                              subject_list=config['subject_list'],
+                                              do_shuffle=config['shuffle_the_folds'],
+                                              param_epoch=config["hyperparameters"]['epochs'],
+                                              is_outer=is_outer)
+        print(folds)
+        # Add folds to task list
+        tasks.extend([(config, n_epochs, test_subject, validation_subject) for n_epochs, test_subject, validation_subject in folds])
+    return tasks
+        
+            
+def run_training(rank, config, n_epochs, test_subject, validation_subject, is_outer):
+    """ Run the training loop for some task.
+    Args:
+        rank (int): The rank of the process.
+        config (dict): The given training configuration for the task.
+        test_subject (str): The task's testing subject name.
+        validation_subject (str): The task's training/validation subject name. May be None.
+        is_outer (bool): If this task is of the outer loop.
+        
+    Returns:
+        (float): The mean validation loss of the task's folds. None if there is none.
+    """    
+    # Read in the log, if it exists
+    job_name = f"{config['job_name']}_test_{test_subject}" if is_outer else f"{config['job_name']}_test_{test_subject}_sub_{validation_subject}"
+    log = read_log_items(
+        config['output_path'], 
+        job_name, 
+        ['is_finished', 'finished_epochs', 'val_loss']
+    )
+    
+    # If this fold has finished training to the given epochs, return
+    if log and (log.get('is_finished') or log.get('finished_epochs', 0) >= n_epochs):
+        return log.get('val_loss')
+    
+    # Run the subject pair
+    if is_outer:
+        print(colored(f"Rank {rank} is starting training for {test_subject}.", 'green'))
+    else:
+        print(colored(f"Rank {rank} is starting training for {test_subject} and validation subject {validation_subject}.", 'green'))
+        
+    val_losses = subject_loop(rank, config, is_outer, n_epochs, test_subject, validation_subject=validation_subject)
+    val_losses = [val_loss for val_loss in val_losses if val_loss is not None]
+    val_loss = sum(val_losses) / len(val_losses) if val_losses else None
+    write_log(
+        config['output_path'], 
+        job_name, 
+        {'finished_epochs': n_epochs, 'val_loss': val_loss},
+        use_lock=True
+    )
+    return val_loss
+        
+        
+def subject_loop(rank, config, is_outer, n_epochs, test_subject, validation_subject=None):
+    """ Executes the training loop for the given test subject.
+
+    Args:
+        rank (int): The rank of the process.
+        config (dict): The training configuration.
+        is_outer (bool): If this task is of the outer loop.
+        test_subject (str): The task's test subject name.
+        validation_subject (str): The task's training/validation subject name. May be None. (Optional)
+        
+    Returns:
+        (list of float): The validation loss of each trained fold.
+    """
+    print(colored(
+        f"\n\n===========================================================\n" + 
+        f"Rank {rank} is starting training for {test_subject} in {config['selected_model_name']}\n"
+        , 'magenta'
+    ))
+    training_vars = training_preparation.TrainingVars(config, is_outer, test_subject, validation_subject=validation_subject)
+    # training_loop(config, testing_subject, files, folds, rotations, indexes, label_position, n_epochs, is_outer, rank=None)
+    return training_loop.training_loop(
+        config=config, 
+        testing_subject=test_subject, 
+        files=training_vars.files, 
+        folds=training_vars.folds, 
+        rotations=training_vars.n_folds, 
+        indexes=training_vars.indexes, 
+        label_position=training_vars.label_position,
+        n_epochs=n_epochs,
+        is_outer=is_outer,
+        rank=rank
+    )
+
+
+
+def create_run_scheduler(configs, is_outer):
+    """ Creates the scheduler of a run. A random search configuration with a proposer creates its trials while running.
+        Otherwise every task is known at the start, and the longest are given first.
+        Unless it is turned off, the scheduler chooses among the next tasks for the data a node has cached.
+
+    Args:
+        configs (list of dict): The configurations.
+        is_outer (bool): If this is of the outer loop or not.
+
+    Returns:
+        (tuple): The tasks known at the start, the cost model (None if there is none), and the scheduler.
+    """
+    if len(configs) == 1 and 'proposer' in configs[0]:
+        scheduler = ProposalScheduler(configs[0], lambda trial_config: split_tasks([trial_config], is_outer))
+        scheduler.affinity = get_affinity_tracker()
+        return [], None, scheduler
+    tasks = split_tasks(configs, is_outer)
+    cost_model = get_cost_model(configs, is_outer)
+    scheduler = create_scheduler(configs, tasks, is_outer, cost_model)
+    scheduler.affinity = get_affinity_tracker(cost_model)
+    return tasks, cost_model, scheduler
+
+
+def get_next_task(scheduler, retry_tasks, ledger=None, worker=None):
+    """ Gets the next task to give out, a task to retry or else the scheduler's next one.
+        Tasks the ledger has as done are reported to the scheduler with their recorded loss instead of being given.
+
+    Args:
+        scheduler (TaskScheduler): The scheduler.
+        retry_tasks (list of tuples): The tasks to give again. The first is removed.
+        ledger (TaskLedger): The task ledger. Default is None. (Optional)
+        worker (str): The node that will train it, for the cache affinity. Default is None. (Optional)
+
+    Returns:
+        (tuple): The task. None if there is none to give now.
+    """
+    while True:
+        task = retry_tasks.pop(0) if retry_tasks else scheduler.next_task(worker)
+        if task is None or ledger is None or not ledger.is_done(task):
+            return task
+        scheduler.report(task, ledger.get_val_loss(task))
+
+
+def write_task_times(output_dir, outfile, elapsed_time, task_times, predicted_makespan):
+    """ Writes the total processing time, and the predicted and actual time of each task.
+
+    Args:
+        output_dir (str): The timing directory.
+        outfile (str): The name of the total time file. The task times are in a '_TASKS_' csv beside it.
+        elapsed_time (float): The total seconds.
+        task_times (list of lists): The job name, test subject, validation subject, epochs, predicted and actual time of each task.
+        predicted_makespan (float): The predicted total time. May be None.
+    """
+    if not os.path.exists(output_dir):
+        os.makedirs(output_dir)
+    with open(os.path.join(output_dir, outfile), 'w') as fp:
+        fp.write(f"{elapsed_time}")
+    with open(os.path.join(output_dir, outfile.replace('_TIME_', '_TASKS_').replace('.txt', '.csv')), 'w', newline='') as fp:
+        writer = csv.writer(fp)
+        writer.writerow(['job_name', 'test_subject', 'validation_subject', 'n_epochs', 'predicted', 'actual_seconds'])
+        writer.writerows(task_times)
+        writer.writerow(['makespan', None, None, None, predicted_makespan, elapsed_time])
+
+
+def write_failed_tasks(output_dir, outfile, failed_tasks):
+    """ Writes the tasks that failed too many times.
+
+    Args:
+        output_dir (str): The timing directory.
+        outfile (str): The name of the total time file. The failed tasks are in a '_FAILED_' csv beside it.
+        failed_tasks (list of lists): The job name, test subject, validation subject, epochs, attempts and last rank of each task.
+    """
+    with open(os.path.join(output_dir, outfile.replace('_TIME_', '_FAILED_').replace('.txt', '.csv')), 'w', newline='') as fp:
+        writer = csv.writer(fp)
+        writer.writerow(['job_name', 'test_subject', 'validation_subject', 'n_epochs', 'attempts', 'last_rank'])
+        writer.writerows(failed_tasks)
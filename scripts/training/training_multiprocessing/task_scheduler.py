@@ -0,0 +1,418 @@
+from training.random_search.create_random_json import write_trial_config
+from training.random_search.search_space import SearchSpace
+from training.random_search.tpe import TPEProposer
+from training.training_multiprocessing.cost_model import get_makespan
+from termcolor import colored
+import pandas as pd
+import json
+import math
+import os
+
+
+class TaskScheduler:
+    def __init__(self, tasks, cost_model=None):
+        """ Gives out the training tasks, each run to its full number of epochs.
+            With a cost model, the longest tasks are given first, so no long task is left to run alone at the end.
+            Otherwise, they are given in their reverse order.
+
+        Args:
+            tasks (list of tuples): The (config, n_epochs, test subject, validation subject) tuples to run.
+            cost_model (CostModel): Predicts the training time of each task. Default is None. (Optional)
+        """
+        self.cost_model = cost_model
+        self.tasks = list(tasks)
+        
+        # Chooses among the next tasks for the data a node has cached. Set by the caller.
+        self.affinity = None
+        
+        # Tasks are taken from the end of the list
+        if cost_model is not None:
+            self.tasks.sort(key=cost_model.predict)
+
+
+    def next_task(self, worker=None):
+        """ Gets the next task to run.
+
+        Args:
+            worker (str): The node that will train it, for the cache affinity. Default is None. (Optional)
+
+        Returns:
+            (tuple): A (config, n_epochs, test subject, validation subject) tuple. None if no task can be given now.
+        """
+        if self.tasks:
+            return self._pop(self.tasks, worker)
+        return None
+
+
+    def report(self, task, val_loss):
+        """ Receives the result of a finished task.
+
+        Args:
+            task (tuple): The task that was given out.
+            val_loss (float): Its validation loss. May be None.
+        """
+        pass
+
+
+    def is_finished(self):
+        """ Checks if no more tasks will be given.
+
+        Returns:
+            (bool): If the processes waiting for a task can be terminated.
+        """
+        return not self.tasks
+
+
+    def get_predicted_makespan(self, n_workers):
+        """ Predicts the time to run every task, given out in order to the workers as they are free.
+
+        Args:
+            n_workers (int): The number of training processes.
+
+        Returns:
+            (float): The predicted time. None if there is no cost model, or the tasks are not known in advance.
+        """
+        if self.cost_model is None:
+            return None
+        return get_makespan([self.cost_model.predict(task) for task in reversed(self.tasks)], n_workers)
+
+
+    def _pop(self, items, worker=None, get_task=lambda item: item):
+        """ Removes the next item from the end of a list. With cache affinity, one of the last few may be chosen instead.
+
+        Args:
+            items (list): The items, each holding a task.
+            worker (str): The node that will train it. Default is None, for the next item. (Optional)
+            get_task (function): Gets the task of an item. Default is the item itself. (Optional)
+
+        Returns:
+            (object): The item.
+        """
+        if self.affinity is None or worker is None:
+            return items.pop()
+        window = items[-self.affinity.lookahead:]
+        ordered_task = get_task(window[-1])
+        item = items.pop(len(items) - len(window) + self.affinity.choose([get_task(item) for item in window], worker))
+        self.affinity.record(worker, get_task(item), ordered_task)
+        return item
+
+
+
+class ASHAScheduler(TaskScheduler):
+    def __init__(self, tasks, min_epochs, reduction_factor=3):
+        """ Gives out the training tasks with asynchronous successive halving (ASHA).
+            Every trial, a configuration, is first trained on all of its folds for a few epochs, the lowest rung.
+            When its mean validation loss is within the best 1/reduction_factor of the trials finished at a rung,
+            it is promoted and trained further to the next rung. Promotions never wait for a rung to fill:
+            when no trial can be promoted, a new trial is started instead.
+
+        Args:
+            tasks (list of tuples): The (config, n_epochs, test subject, validation subject) tuples of every trial.
+            min_epochs (int): The epochs of the lowest rung.
+            reduction_factor (int): The growth of the epochs between rungs, and the inverse of the promoted fraction. Default is 3. (Optional)
+        """
+        super().__init__([])
+        if min_epochs < 1 or reduction_factor < 2:
+            raise ValueError(colored(f"Error: ASHA needs 'min_epochs' >= 1 and 'reduction_factor' >= 2, given {min_epochs} and {reduction_factor}.", 'red'))
+        self.reduction_factor = reduction_factor
+
+        # Group the fold tasks of each trial by its job name, in the given order
+        self.trials = {}
+        for task in tasks:
+            self.trials.setdefault(task[0]['job_name'], []).append(task)
+        self.new_trials = list(self.trials)[::-1]
+        self.rungs = get_rung_epochs(min_epochs, reduction_factor, max(task[1] for task in tasks) if tasks else min_epochs)
+
+        # The mean validation loss of the trials finished at each rung, and the trials promoted from it
+        self.results = [{} for _ in self.rungs]
+        self.promoted = [set() for _ in self.rungs]
+
+        # The fold tasks ready to be given, and the (trial, rung) of each given task that has not reported
+        self.pending = []
+        self.running = {}
+        self.rung_jobs = {}
+
+        print(colored(f"ASHA is scheduling {len(self.trials)} trials with the rungs {self.rungs} epochs.", 'cyan'))
+
+
+    def next_task(self, worker=None):
+        """ Gets the next task to run. A trial is promoted or started if no fold task is pending.
+
+        Args:
+            worker (str): The node that will train it, for the cache affinity. Default is None. (Optional)
+
+        Returns:
+            (tuple): A (config, n_epochs, test subject, validation subject) tuple. None if no task can be given now.
+        """
+        if not self.pending:
+            self._add_job()
+        if not self.pending:
+            return None
+        task, trial, rung = self._pop(self.pending, worker, lambda item: item[0])
+        self.running[id(task)] = (trial, rung)
+        return task
+
+
+    def report(self, task, val_loss):
+        """ Receives the validation loss of a fold task. Once every fold of the trial's rung has reported,
+            the mean loss is recorded for the rung.
+
+        Args:
+            task (tuple): The task that was given out.
+            val_loss (float): Its validation loss. May be None.
+        """
+        trial, rung = self.running.pop(id(task))
+        job = self.rung_jobs[(trial, rung)]
+        job['remaining'] -= 1
+        if val_loss is not None:
+            job['losses'].append(val_loss)
+        if job['remaining']:
+            return
+
+        # Trials without a validation loss are never promoted
+        del self.rung_jobs[(trial, rung)]
+        self.results[rung][trial] = sum(job['losses']) / len(job['losses']) if job['losses'] else math.inf
+        print(colored(
+            f"ASHA: {trial} finished rung {rung+1}/{len(self.rungs)} ({self.rungs[rung]} epochs) " +
+            f"with a validation loss of {self.results[rung][trial]:.4f}.",
+            'cyan'
+        ))
+        if not self.running and not self.pending and self.is_finished():
+            self.print_summary()
+
+
+    def is_finished(self):
+        """ Checks if no more tasks will be given. No trial can be promoted once nothing is running.
+
+        Returns:
+            (bool): If the processes waiting for a task can be terminated.
+        """
+        return not self.pending and not self.new_trials and not self.running and \
+            all(self._get_promotable(rung) is None for rung in range(len(self.rungs) - 1))
+
+
+    def get_predicted_makespan(self, n_workers):
+        """ The tasks depend on the reported results, so the makespan is not predicted. """
+        return None
+
+
+    def print_summary(self):
+        """ Prints the number of trials finished at each rung, and the best of each. """
+        for rung, results in enumerate(self.results):
+            if results:
+                best = min(results, key=results.get)
+                print(colored(f"ASHA rung {rung+1} ({self.rungs[rung]} epochs): {len(results)} trials, best {best} with a loss of {results[best]:.4f}.", 'magenta'))
+
+
+    def _add_job(self):
+        """ Adds the fold tasks of a promoted trial, starting from the highest rung, or of a new trial. """
+        for rung in reversed(range(len(self.rungs) - 1)):
+            trial = self._get_promotable(rung)
+            if trial is not None:
+                self.promoted[rung].add(trial)
+                print(colored(f"ASHA: Promoting {trial} to rung {rung+2}/{len(self.rungs)} ({self.rungs[rung+1]} epochs).", 'green'))
+                self._add_trial_tasks(trial, rung + 1)
+                return
+        if self.new_trials:
+            self._add_trial_tasks(self.new_trials.pop(), 0)
+
+
+    def _get_promotable(self, rung):
+        """ Finds a trial in the top 1/reduction_factor of a rung that was not promoted yet.
+
+        Args:
+            rung (int): The rung index.
+
+        Returns:
+            (str): The trial's job name. None if there is no such trial.
+        """
+        results = self.results[rung]
+        n_top = len(results) // self.reduction_factor
+        for trial in sorted(results, key=results.get)[:n_top]:
+            if trial not in self.promoted[rung] and results[trial] != math.inf:
+                return trial
+        return None
+
+
+    def _add_trial_tasks(self, trial, rung):
+        """ Adds the fold tasks of a trial, trained up to the epochs of a rung.
+
+        Args:
+            trial (str): The trial's job name.
+            rung (int): The rung index.
+        """
+        folds = self.trials[trial]
+        self.rung_jobs[(trial, rung)] = {'remaining': len(folds), 'losses': []}
+        for config, n_epochs, test_subject, validation_subject in folds:
+            self.pending.append(((config, min(n_epochs, self.rungs[rung]), test_subject, validation_subject), trial, rung))
+
+
+
+class ProposalScheduler(TaskScheduler):
+    def __init__(self, search_config, get_trial_tasks):
+        """ Runs a random search whose trials are proposed from the results of the finished ones, with TPE.
+            A trial is proposed whenever a process is idle and no fold task is pending, until 'n_trials' were proposed.
+            Trial configurations that an earlier run already wrote are run first, and skipped if they are finished.
+
+        Args:
+            search_config (dict): The random search configuration, with the 'proposer' settings.
+            get_trial_tasks (function): Gets the (config, n_epochs, test subject, validation subject) tuples of a trial's configuration.
+        """
+        super().__init__([])
+        self.search_config = search_config
+        self.get_trial_tasks = get_trial_tasks
+        self.n_trials = search_config['n_trials']
+        settings = {key: value for key, value in search_config['proposer'].items() if key != 'method'}
+        if search_config['proposer'].get('method', 'tpe') != 'tpe':
+            raise ValueError(colored(f"Error: Unknown proposer method '{search_config['proposer']['method']}'. The only choice is 'tpe'.", 'red'))
+        self.proposer = TPEProposer(SearchSpace(search_config), seed=search_config.get('seed'), **settings)
+
+        # The hyperparameters and result of each trial, and the folds that have not reported
+        self.trials = []
+        self.pending = []
+        self.running = {}
+        self.remaining = {}
+
+
+    def next_task(self, worker=None):
+        """ Gets the next task to run. A trial is proposed if no fold task is pending.
+
+        Args:
+            worker (str): The node that will train it, for the cache affinity. Default is None. (Optional)
+
+        Returns:
+            (tuple): A (config, n_epochs, test subject, validation subject) tuple. None if no task can be given now.
+        """
+        while not self.pending and len(self.trials) < self.n_trials:
+            self._add_trial()
+        if not self.pending:
+            return None
+        task, index = self._pop(self.pending, worker, lambda item: item[0])
+        self.running[id(task)] = index
+        return task
+
+
+    def report(self, task, val_loss):
+        """ Receives the validation loss of a fold task. Once every fold of a trial has reported, the proposer is told its mean.
+
+        Args:
+            task (tuple): The task that was given out.
+            val_loss (float): Its validation loss. May be None.
+        """
+        index = self.running.pop(id(task))
+        trial = self.trials[index]
+        if val_loss is not None:
+            trial['losses'].append(val_loss)
+        self.remaining[index] -= 1
+        if self.remaining[index]:
+            return
+
+        # Trials without a validation loss count as the worst
+        del self.remaining[index]
+        trial['val_loss'] = sum(trial['losses']) / len(trial['losses']) if trial['losses'] else None
+        self.proposer.tell(trial['values'], trial['val_loss'])
+        print(colored(f"Random search trial {index} finished with a validation loss of {trial['val_loss']}.", 'cyan'))
+        self._write_summary()
+
+
+    def is_finished(self):
+        """ Checks if no more tasks will be given.
+
+        Returns:
+            (bool): If the processes waiting for a task can be terminated.
+        """
+        return not self.pending and len(self.trials) >= self.n_trials
+
+
+    def get_predicted_makespan(self, n_workers):
+        """ The trials depend on the reported results, so the makespan is not predicted. """
+        return None
+
+
+    def _add_trial(self):
+        """ Adds the fold tasks of the next trial. An earlier run's configuration is reused, otherwise a new one is proposed. """
+        index = len(self.trials)
+        config_path = os.path.join(self.search_config['configurations_directory'], f"rs_{index}_config.json")
+        if os.path.exists(config_path):
+            with open(config_path) as fp:
+                trial_config = json.load(fp)
+            values = {
+                'batch_size': trial_config['hyperparameters']['batch_size'],
+                'learning_rate': trial_config['hyperparameters']['learning_rate'],
+                'momentum': trial_config['hyperparameters']['momentum'],
+                'bool_nesterov': trial_config['hyperparameters']['bool_nesterov'],
+                'model': trial_config['selected_model_name']
+            }
+            self.proposer.add_pending(values)
+        else:
+            values = self.proposer.ask()[0]
+            trial_config = write_trial_config(index, values, self.search_config)
+            print(colored(f"Proposed random search trial {index}: {values}", 'green'))
+
+        tasks = self.get_trial_tasks(trial_config)
+        self.trials.append({'values': values, 'losses': [], 'val_loss': None})
+        self.remaining[index] = len(tasks)
+        self.pending.extend((task, index) for task in tasks)
+        
+        # A trial without folds is finished at once
+        if not tasks:
+            del self.remaining[index]
+            self.proposer.tell(values, None)
+
+
+    def _write_summary(self):
+        """ Writes the hyperparameters and validation loss of every finished trial. """
+        rows = [
+            {'index': index, **trial['values'], 'decay': trial['values']['learning_rate'], 'val_loss': trial['val_loss']}
+            for index, trial in enumerate(self.trials) if index not in self.remaining
+        ]
+        columns = ["index", "model", "batch_size", "learning_rate", "decay", "momentum", "bool_nesterov", "val_loss"]
+        pd.DataFrame(rows, columns=columns).to_csv(
+            os.path.join(self.search_config['configurations_directory'], "random_search_summary.csv")
+        )
+
+
+
+def get_rung_epochs(min_epochs, reduction_factor, max_epochs):
+    """ Gets the epochs of each ASHA rung. They grow geometrically, and the last rung is the full number of epochs.
+
+    Args:
+        min_epochs (int): The epochs of the lowest rung.
+        reduction_factor (int): The growth between rungs.
+        max_epochs (int): The full number of epochs.
+
+    Returns:
+        (list of int): The epochs of each rung.
+    """
+    rungs = []
+    epochs = min_epochs
+    while epochs < max_epochs:
+        rungs.append(epochs)
+        epochs *= reduction_factor
+    rungs.append(max_epochs)
+    return rungs
+
+
+def create_scheduler(configs, tasks, is_outer, cost_model=None):
+    """ Creates the scheduler of the given tasks. ASHA is used in the inner loop if every configuration enables it.
+
+    Args:
+        configs (list of dict): The training configurations.
+        tasks (list of tuples): The (config, n_epochs, test subject, validation subject) tuples to run.
+        is_outer (bool): If this is of the outer loop or not.
+        cost_model (CostModel): Orders the tasks longest first, when every task is run in full. Default is None. (Optional)
+
+    Returns:
+        (TaskScheduler): The scheduler.
+    """
+    n_asha = sum('asha' in config for config in configs)
+    if not n_asha:
+        return TaskScheduler(tasks, cost_model)
+    if is_outer or n_asha != len(configs):
+        print(colored("Warning: ASHA is only used in the inner loop, when every configuration has the 'asha' setting. Every task will be run in full.", 'yellow'))
+        return TaskScheduler(tasks, cost_model)
+    return ASHAScheduler(
+        tasks,
+        configs[0]['asha'].get('min_epochs', 1),
+        configs[0]['asha'].get('reduction_factor', 3)
+    )
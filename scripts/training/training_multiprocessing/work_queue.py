@@ -0,0 +1,455 @@
+import datetime
+import threading
+import hashlib
+import pickle
+import socket
+import json
+import time
+import uuid
+import os
+from termcolor import colored
+from training.training_multiprocessing.task_runner import split_tasks, run_training, write_task_times, write_failed_tasks
+from training.training_multiprocessing.task_ledger import get_task_key
+from training.training_multiprocessing.cost_model import get_cost_model
+from util.get_config import parse_training_configs
+import argparse
+
+
+def parse_queue_args():
+    """ Parses the location and lease settings of the work queue. """
+    parser = argparse.ArgumentParser()
+
+    parser.add_argument("--queue", type=str, default=None,
+                        help="A work queue directory on a shared filesystem. Every job given the same one pulls from one task pool")
+    parser.add_argument("--heartbeat_seconds", type=float, default=30,
+                        help="Time between the lease renewals of a claimed task")
+    parser.add_argument("--lease_seconds", type=float, default=600,
+                        help="Time without a renewal before a claimed task is considered abandoned and claimed again")
+    parser.add_argument("--max_retries", type=int, default=2,
+                        help="Times a task is claimed again before it is considered failed")
+
+    # This functions allows to not produce an error when extra arguments are present
+    args = parser.parse_known_args()[0]
+    return args.queue, args.heartbeat_seconds, args.lease_seconds, args.max_retries
+
+
+def get_worker_name():
+    """ Gets a name for this process that is unique across the jobs sharing a queue.
+
+    Returns:
+        (str): The host, the Slurm job and array task if there are any, and the process id.
+    """
+    parts = [socket.gethostname()]
+    if 'SLURM_JOB_ID' in os.environ:
+        parts.append(f"job{os.environ['SLURM_JOB_ID']}")
+    if 'SLURM_ARRAY_TASK_ID' in os.environ:
+        parts.append(f"array{os.environ['SLURM_ARRAY_TASK_ID']}")
+    parts.append(f"pid{os.getpid()}")
+    return '_'.join(parts)
+
+
+def _write_atomic(path, data):
+    """ Writes a file so other processes either see all of it or none of it.
+
+    Args:
+        path (str): The file location.
+        data (bytes): The contents.
+    """
+    tmp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+    with open(tmp_path, 'wb') as fp:
+        fp.write(data)
+        fp.flush()
+        os.fsync(fp.fileno())
+    os.replace(tmp_path, path)
+
+
+class LeaseRenewal:
+    def __init__(self, lock_path, interval):
+        """ Renews the lease of a claimed task from a background thread while it is trained,
+            by touching its lock file. Use it as a context manager around the training.
+
+        Args:
+            lock_path (str): The lock file of the claim.
+            interval (float): The time between renewals.
+        """
+        self.lock_path = lock_path
+        self.interval = interval
+        self.stopped = threading.Event()
+        self.thread = None
+
+
+    def __enter__(self):
+        self.stopped.clear()
+        self.thread = threading.Thread(target=self._renew, daemon=True)
+        self.thread.start()
+        return self
+
+
+    def __exit__(self, *args):
+        self.stopped.set()
+        self.thread.join()
+        self.thread = None
+
+
+    def _renew(self):
+        while not self.stopped.wait(self.interval):
+            try:
+                os.utime(self.lock_path)
+            except FileNotFoundError:
+                print(colored(f"Warning: The claim {self.lock_path} was taken over by another process.", 'yellow'))
+                return
+
+
+class WorkQueue:
+    def __init__(self, queue_dir, lease_seconds=600, max_retries=2):
+        """ A pool of tasks on a shared filesystem, which any number of independent jobs pull from.
+            Each task is a pickle in 'tasks/'. A job claims it by creating its lock in 'claims/' with O_EXCL,
+            so only one job can hold it. The holder keeps touching the lock while it trains. A lock untouched
+            for longer than the lease is renamed away by whichever job sees it first, as only one rename can succeed,
+            and the task is claimed again. A finished task gets a marker in 'done/', and each failed attempt a record in 'failed/'.
+
+        Args:
+            queue_dir (str): The queue directory. Every job must see the same filesystem.
+            lease_seconds (float): Time without a renewal before a claim is considered abandoned. Default is 600. (Optional)
+            max_retries (int): Times a task is claimed again after failing. Default is 2. (Optional)
+        """
+        self.queue_dir = queue_dir
+        self.lease_seconds = lease_seconds
+        self.max_retries = max_retries
+        self.worker_name = get_worker_name()
+        for folder in ['tasks', 'claims', 'done', 'failed']:
+            os.makedirs(os.path.join(queue_dir, folder), exist_ok=True)
+
+
+    def add_tasks(self, tasks):
+        """ Adds tasks to the pool. Every job may add the same tasks, each is only stored once.
+
+        Args:
+            tasks (list of tuples): The (config, n_epochs, test subject, validation subject) tuples.
+
+        Returns:
+            (list of str): The id of each task.
+        """
+        task_ids = []
+        for task in tasks:
+            task_id = get_task_id(task)
+            path = self._path('tasks', f'{task_id}.pkl')
+            if not os.path.exists(path):
+                _write_atomic(path, pickle.dumps(task))
+            task_ids.append(task_id)
+        return task_ids
+
+
+    def load_task(self, task_id):
+        """ Loads a task. Each load is a new copy, as training changes its configuration.
+
+        Args:
+            task_id (str): The task id.
+
+        Returns:
+            (tuple): The task.
+        """
+        with open(self._path('tasks', f'{task_id}.pkl'), 'rb') as fp:
+            return pickle.load(fp)
+
+
+    def claim(self, task_id):
+        """ Tries to claim a task. An abandoned claim is taken over.
+            The caller filters out finished and failed tasks, which are only checked again once the claim is held.
+
+        Args:
+            task_id (str): The task id.
+
+        Returns:
+            (bool): If this process now holds the task.
+        """
+        lock_path = self._path('claims', f'{task_id}.lock')
+        try:
+            fd = os.open(lock_path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+        except FileExistsError:
+            if not self._take_over(task_id):
+                return False
+            return self.claim(task_id)
+        with os.fdopen(fd, 'w') as fp:
+            json.dump({'worker': self.worker_name, 'claimed_at': time.time()}, fp)
+
+        # The task may have finished or failed since the caller checked
+        if self.is_done(task_id) or self.is_failed(task_id):
+            self.release(task_id)
+            return False
+        return True
+
+
+    def finish(self, task_id, val_loss, seconds):
+        """ Marks a held task as done, and releases it.
+
+        Args:
+            task_id (str): The task id.
+            val_loss (float): Its validation loss. May be None.
+            seconds (float): Its training time.
+        """
+        record = {'worker': self.worker_name, 'finished_at': time.time(), 'seconds': seconds, 'val_loss': val_loss}
+        _write_atomic(self._path('done', f'{task_id}.json'), json.dumps(record).encode())
+        self.release(task_id)
+
+
+    def fail(self, task_id, error, worker=None):
+        """ Records a failed attempt of a task. The claim is not released.
+
+        Args:
+            task_id (str): The task id.
+            error (str): Why it did not finish.
+            worker (str): The process that held it. Default is this one. (Optional)
+        """
+        record = {'worker': worker or self.worker_name, 'failed_at': time.time(), 'error': error}
+        _write_atomic(self._path('failed', f'{task_id}.{uuid.uuid4().hex}.json'), json.dumps(record).encode())
+
+
+    def release(self, task_id):
+        """ Removes this process's claim of a task.
+
+        Args:
+            task_id (str): The task id.
+        """
+        try:
+            os.remove(self._path('claims', f'{task_id}.lock'))
+        except FileNotFoundError:
+            pass
+
+
+    def is_done(self, task_id):
+        """ Checks if a task was finished by any job.
+
+        Args:
+            task_id (str): The task id.
+
+        Returns:
+            (bool): If it is done.
+        """
+        return os.path.exists(self._path('done', f'{task_id}.json'))
+
+
+    def get_attempts(self, task_id):
+        """ Counts the failed attempts of a task.
+
+        Args:
+            task_id (str): The task id.
+
+        Returns:
+            (int): The number of failed attempts.
+        """
+        return sum(1 for name in os.listdir(self._path('failed')) if name.startswith(f'{task_id}.') and name.endswith('.json'))
+
+
+    def get_status(self):
+        """ Lists the finished tasks and the failed attempts of every task, reading each directory once.
+
+        Returns:
+            (set of str): The ids of the finished tasks.
+            (dict): The number of failed attempts of each task id.
+        """
+        done = {name[:-len('.json')] for name in os.listdir(self._path('done')) if name.endswith('.json')}
+        attempts = {}
+        for name in os.listdir(self._path('failed')):
+            if name.endswith('.json'):
+                task_id = name.split('.', 1)[0]
+                attempts[task_id] = attempts.get(task_id, 0) + 1
+        return done, attempts
+
+
+    def is_failed(self, task_id):
+        """ Checks if a task failed too many times to be claimed again.
+
+        Args:
+            task_id (str): The task id.
+
+        Returns:
+            (bool): If it failed.
+        """
+        return self.get_attempts(task_id) > self.max_retries
+
+
+    def get_val_loss(self, task_id):
+        """ Gets the validation loss of a finished task.
+
+        Args:
+            task_id (str): The task id.
+
+        Returns:
+            (float): The validation loss. None if there is none.
+        """
+        with open(self._path('done', f'{task_id}.json')) as fp:
+            return json.load(fp)['val_loss']
+
+
+    def get_lock_path(self, task_id):
+        """ Gets the lock file of a task's claim.
+
+        Args:
+            task_id (str): The task id.
+
+        Returns:
+            (str): The location of the lock.
+        """
+        return self._path('claims', f'{task_id}.lock')
+
+
+    def _take_over(self, task_id):
+        """ Removes the claim of a task if its lease ran out, and records the abandoned attempt.
+
+        Args:
+            task_id (str): The task id.
+
+        Returns:
+            (bool): If the claim was removed, so the task can be claimed again.
+        """
+        lock_path = self._path('claims', f'{task_id}.lock')
+        try:
+            if time.time() - os.stat(lock_path).st_mtime < self.lease_seconds:
+                return False
+
+            # Only one process can rename the lock away. The lock may have been claimed again since it was checked.
+            expired_path = f'{lock_path}.{uuid.uuid4().hex}.expired'
+            os.rename(lock_path, expired_path)
+        except FileNotFoundError:
+            return True
+        if time.time() - os.stat(expired_path).st_mtime < self.lease_seconds:
+            try:
+                os.link(expired_path, lock_path)
+            except FileExistsError:
+                pass
+            os.remove(expired_path)
+            return False
+
+        try:
+            with open(expired_path) as fp:
+                worker = json.load(fp).get('worker')
+        except (OSError, ValueError):
+            worker = None
+        os.remove(expired_path)
+        print(colored(f"The claim of task {task_id} by {worker} ran out, it will be claimed again.", 'red'))
+        self.fail(task_id, "The lease ran out", worker)
+        return True
+
+
+    def _path(self, *parts):
+        return os.path.join(self.queue_dir, *parts)
+
+
+def get_task_id(task):
+    """ Gets the queue id of a task, which is the same in every job.
+
+    Args:
+        task (tuple): A (config, n_epochs, test subject, validation subject) tuple.
+
+    Returns:
+        (str): The id.
+    """
+    return hashlib.sha1(repr(get_task_key(task)).encode()).hexdigest()[:16]
+
+
+def run_queue_worker(queue, task_ids, rank, is_outer, heartbeat_seconds, cost_model=None, poll_seconds=None):
+    """ Claims and trains tasks of the queue until each is done or failed.
+        While other jobs hold the last tasks, this waits in case their leases run out.
+
+    Args:
+        queue (WorkQueue): The work queue.
+        task_ids (list of str): The tasks to train, in the order to claim them.
+        rank (int): The rank that names this process's outputs. Must not be 0, as the queue is shared.
+        is_outer (bool): If this is of the outer loop.
+        heartbeat_seconds (float): The time between lease renewals.
+        cost_model (CostModel): Predicts the training time of each task, to compare with the actual time. Default is None. (Optional)
+        poll_seconds (float): The time between checks for abandoned tasks. Default is the heartbeat time. (Optional)
+
+    Returns:
+        (tuple): The job name, test subject, validation subject, epochs, predicted and actual time of each task this process trained,
+            and the job name, test subject, validation subject, epochs and attempts of each failed task.
+    """
+    task_times = []
+    while True:
+        # Filter the tasks with one listing of the finished and failed ones, instead of checking each on the shared filesystem
+        done, attempts = queue.get_status()
+        pending = [task_id for task_id in task_ids if task_id not in done and attempts.get(task_id, 0) <= queue.max_retries]
+        if not pending:
+            break
+        task_id = next((task_id for task_id in pending if queue.claim(task_id)), None)
+        if task_id is None:
+            time.sleep(poll_seconds or heartbeat_seconds)
+            continue
+
+        task = queue.load_task(task_id)
+        config, n_epochs, test_subject, validation_subject = task
+        predicted = cost_model.predict(task) if cost_model is not None else None
+        print(colored(f"{queue.worker_name} claimed the task for test {test_subject}, validation {validation_subject}, {n_epochs} epochs.", 'green'))
+        start_time = time.perf_counter()
+        try:
+            with LeaseRenewal(queue.get_lock_path(task_id), heartbeat_seconds):
+                val_loss = run_training(rank, config, n_epochs, test_subject, validation_subject, is_outer)
+        except Exception as e:
+            print(colored(f"The task for test {test_subject}, validation {validation_subject} failed. {e!r}", 'red'))
+            queue.fail(task_id, repr(e))
+            queue.release(task_id)
+            continue
+        seconds = time.perf_counter() - start_time
+        queue.finish(task_id, val_loss, seconds)
+        task_times.append([config['job_name'], test_subject, validation_subject, n_epochs, predicted, seconds])
+
+    failed_tasks = []
+    done, attempts = queue.get_status()
+    for task_id in task_ids:
+        if attempts.get(task_id, 0) > queue.max_retries:
+            config, n_epochs, test_subject, validation_subject = queue.load_task(task_id)
+            failed_tasks.append([config['job_name'], test_subject, validation_subject, n_epochs, attempts[task_id], None])
+    return task_times, failed_tasks
+
+
+def main(config_loc, is_outer, rank=1):
+    """ Runs the training process as one of any number of independent jobs sharing a work queue.
+        Each job builds the same tasks from the configurations, and adds any missing ones to the queue.
+        The jobs then claim tasks until none are left, so a job array needs no hand-split configurations.
+
+    Args:
+        config_loc (str): The location of the configuration.
+        is_outer (bool): Whether this is of the outer loop.
+        rank (int): The rank that names this process's outputs. Default is 1. (Optional)
+    """
+    queue_dir, heartbeat_seconds, lease_seconds, max_retries = parse_queue_args()
+    if queue_dir is None:
+        raise Exception(colored("Error: No work queue given. Use --queue DIR.", 'red'))
+
+    # Get start time
+    start_time_name = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    start_perf = time.perf_counter()
+
+    # Get the configurations
+    configs = parse_training_configs(config_loc)
+    if not configs:
+        print(colored("No configurations given.", 'yellow'))
+        return
+
+    # Only a single dispatcher can decide which trials to propose or promote
+    if any('proposer' in config for config in configs):
+        raise Exception(colored("Error: Proposed trials need one process to give out the tasks. Use MPI or the process pool instead.", 'red'))
+    if any('asha' in config for config in configs):
+        print(colored("Warning: ASHA needs one process to give out the tasks. Every task will be run in full.", 'yellow'))
+
+    # The longest tasks are claimed first, as with the other backends
+    tasks = split_tasks(configs, is_outer)
+    cost_model = get_cost_model(configs, is_outer)
+    if cost_model is not None:
+        tasks.sort(key=cost_model.predict, reverse=True)
+    queue = WorkQueue(queue_dir, lease_seconds, max_retries)
+    task_ids = queue.add_tasks(tasks)
+    print(colored(f"{queue.worker_name} is pulling from the work queue {queue_dir} with {len(task_ids)} tasks.", 'cyan'))
+
+    task_times, failed_tasks = run_queue_worker(queue, task_ids, rank, is_outer, heartbeat_seconds, cost_model)
+
+    # Write the processing time, the time of each task this job trained, and the failed tasks
+    elapsed_time = time.perf_counter() - start_perf
+    loop = 'OUTER' if is_outer else 'INNER'
+    outfile = f'_TIME_QUEUE_{loop}_{start_time_name}_{queue.worker_name}.txt'
+    write_task_times("../results/training_timings", outfile, elapsed_time, task_times, None)
+    if failed_tasks:
+        print(colored(f"{len(failed_tasks)} tasks failed too many times.", 'red'))
+        write_failed_tasks("../results/training_timings", outfile, failed_tasks)
+    print(colored(f"{queue.worker_name} is finished. No tasks are left in the work queue.", 'yellow'))
@@ -1,6 +1,8 @@
 from training.training_modules.data_processing import training_preparation
 from training.training_modules.output_processing import console_printing
 from training.training_modules.training_processing import training_loop
+from training.training_multiprocessing import work_queue
+from training.training_modules.training_processing.fused_fold import fuse_configs
 from training.training_checkpointing_logging.logger import *
 from util.get_config import parse_training_configs
 from termcolor import colored
@@ -146,8 +148,13 @@ def main(config_loc, is_outer):
     # Enables eager execution of tf.functions.
     # tf.config.run_functions_eagerly(True)
     
-    # Parse the command line arguments
-    configs = parse_training_configs(config_loc)
+    # With a work queue, this is one of many jobs pulling from a shared task pool
+    if work_queue.parse_queue_args()[0] is not None:
+        work_queue.main(config_loc, is_outer)
+        return
+    
+    # Parse the command line arguments. Configurations set to be fused train as one.
+    configs = fuse_configs(parse_training_configs(config_loc))
     for config in configs:
         
         # Read in the log's subject list, if it exists